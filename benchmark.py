@@ -0,0 +1,329 @@
+"""
+⏱️ Micro-benchmarks for bot.py's hot paths on synthetic data.
+
+Generates question trees (many small files / single large banks) and leaderboards in a
+temporary directory, then times:
+- get_available_quizzes (warm), a cold catalog scan, an unchanged catalog refresh
+- compiling a bank, load_questions_from_file (full decode), a 10-question sample
+- send_question (cached and uncached screens)
+- finalize_quiz scoring, show_review_question
+- leaderboard_handler, a leaderboard rebuild and a single rank update
+
+Results are written as JSON (tagged with the git commit) so runs can be compared:
+    python benchmark.py                                  # full grid, writes benchmark-results.json
+    python benchmark.py --quick --out before.json
+    python benchmark.py --quick --out after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+WORKDIR = tempfile.mkdtemp(prefix='quizbot-bench-')
+os.environ['QUIZ_BANK_DIR'] = os.path.join(WORKDIR, 'banks')  # must be set before bot is imported
+
+import bot  # noqa: E402
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger('benchmark')
+logging.getLogger('bot').setLevel(logging.WARNING)
+
+FULL = {
+    'files': [10, 100, 1000, 10000],
+    'bank_sizes': [100, 1000, 10000, 100000],
+    'leaderboard_users': [1000, 10000, 100000, 1000000],
+}
+QUICK = {
+    'files': [10, 100, 1000],
+    'bank_sizes': [100, 1000, 10000],
+    'leaderboard_users': [1000, 10000, 100000],
+}
+QUESTIONS_PER_FILE = 20  # for the many-files trees
+
+# --- Synthetic data ---
+
+def synthetic_question(rng: random.Random, i: int) -> dict:
+    q_type = rng.choice(('MCQ', 'MCQ', 'MCQ', 'MSQ'))
+    options = [f"Option {chr(65 + k)} for question {i}: " + 'x' * rng.randint(5, 40) for k in range(4)]
+    answer = sorted(rng.sample(range(4), rng.randint(1, 3))) if q_type == 'MSQ' else rng.randrange(4)
+    return {
+        'q': f"[{q_type}] Synthetic question {i}: " + ' '.join(f"word{rng.randrange(1000)}" for _ in range(rng.randint(10, 60))),
+        'options': options,
+        'answer': answer,
+        'explanation': f"Because of reason {i}. " * rng.randint(1, 5),
+    }
+
+def write_bank(path: str, count: int, seed: int) -> None:
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([synthetic_question(rng, i) for i in range(count)], f)
+
+def build_tree(root: str, files: int) -> None:
+    """`files` quizzes, 100 per folder, folders grouped 10 per subject."""
+    for n in range(files):
+        folder = os.path.join(root, f"subject_{n // 1000:02d}", f"set_{n // 100:03d}")
+        write_bank(os.path.join(folder, f"quiz_{n:05d}.json"), QUESTIONS_PER_FILE, seed=n)
+
+def build_leaderboard(users: int) -> None:
+    rng = random.Random(users)
+    bot.leaderboard_data.clear()
+    for user_id in range(1, users + 1):
+        tests = rng.randint(1, 50)
+        bot.leaderboard_data[user_id] = {
+            'total_score': tests * 7, 'total_questions': tests * 10, 'tests_taken': tests,
+            'best_score_pct': round(rng.random() * 100, 1), 'username': f'user{user_id}', 'user_id': user_id,
+        }
+
+# --- Stand-ins for Telegram objects ---
+
+class FakeMessage:
+    _ids = iter(range(1, 1 << 62))
+
+    def __init__(self, chat_id: int = 1):
+        self.chat_id = chat_id
+        self.message_id = next(self._ids)  # a fresh id per call, so no edit is skipped as a no-op
+
+    async def edit_text(self, text, reply_markup=None, parse_mode=None, **kwargs):
+        return self
+
+    async def edit_reply_markup(self, reply_markup=None, **kwargs):
+        return self
+
+    async def reply_text(self, text, reply_markup=None, parse_mode=None, **kwargs):
+        return self
+
+class FakeBot:
+    async def send_message(self, chat_id, text, reply_markup=None, parse_mode=None, **kwargs):
+        return FakeMessage(chat_id)
+
+def fake_update(user_id: int = 1):
+    user = types.SimpleNamespace(id=user_id, username=f'user{user_id}', first_name='Bench')
+    message = FakeMessage(user_id)
+    query = types.SimpleNamespace(from_user=user, message=message, data='')
+    return types.SimpleNamespace(message=message, callback_query=query, effective_user=user,
+                                 effective_chat=types.SimpleNamespace(id=user_id))
+
+# --- Timing ---
+
+class Runner:
+    def __init__(self, min_time: float):
+        self.min_time = min_time
+        self.results = []
+        self.loop = asyncio.new_event_loop()
+
+    def measure(self, name: str, params: dict, fn, setup=None, is_async: bool = False, max_runs: int = 1000) -> None:
+        """Run fn until min_time has passed (at least 3 runs); setup() runs untimed before each call."""
+        samples = []
+        deadline = time.perf_counter() + self.min_time
+        while len(samples) < 3 or (time.perf_counter() < deadline and len(samples) < max_runs):
+            arg = setup() if setup else None
+            started = time.perf_counter()
+            if is_async:
+                self.loop.run_until_complete(fn(arg) if setup else fn())
+            else:
+                fn(arg) if setup else fn()
+            samples.append(time.perf_counter() - started)
+        result = {
+            'name': name,
+            'params': params,
+            'runs': len(samples),
+            'min_us': round(min(samples) * 1e6, 2),
+            'median_us': round(statistics.median(samples) * 1e6, 2),
+            'mean_us': round(statistics.fmean(samples) * 1e6, 2),
+        }
+        self.results.append(result)
+        label = ', '.join(f'{k}={v}' for k, v in params.items())
+        logger.info(f"{name:<28} {label:<22} median {result['median_us']:>12.1f} us   min {result['min_us']:>12.1f} us   ({len(samples)} runs)")
+
+# --- Benchmarks ---
+
+def bench_catalog(runner: Runner, files: int) -> None:
+    root = os.path.join(WORKDIR, f'tree_{files}')
+    build_tree(root, files)
+    params = {'files': files}
+
+    runner.measure('catalog_cold_scan', params, lambda: bot.QuizCatalog(root).refresh(), max_runs=50)
+
+    bot.quiz_catalog = bot.QuizCatalog(root, refresh_interval=3600)
+    bot.quiz_catalog.refresh()
+    runner.measure('get_available_quizzes', params, bot.get_available_quizzes)
+    runner.measure('catalog_refresh_unchanged', params, bot.quiz_catalog.refresh, max_runs=200)
+    shutil.rmtree(root)
+
+def bench_bank(runner: Runner, size: int) -> None:
+    root = os.path.join(WORKDIR, f'bank_{size}')
+    write_bank(os.path.join(root, 'big.json'), size, seed=size)
+    bot.quiz_catalog = bot.QuizCatalog(root, refresh_interval=3600)
+    bot.question_banks.clear()
+    bot.question_registry = bot.QuestionRegistry(bot.QUESTION_CACHE_SIZE)
+    entry = bot.quiz_catalog.entry('big')
+    params = {'questions': size}
+
+    scratch = os.path.join(WORKDIR, 'scratch.qbank')
+    runner.measure('bank_compile', params, lambda: bot.compile_bank(entry.path, scratch), max_runs=20)
+    bot.get_question_bank('big')  # compile + map once
+    runner.measure('load_questions_from_file', params, lambda: bot.load_questions_from_file('big'), max_runs=50)
+
+    bank = bot.get_question_bank('big')
+    runner.measure('bank_sample_10', params, lambda: [bot.question_registry.get(qid) for qid in bank.sample(10)])
+    shutil.rmtree(root)
+
+def start_session(bank, user_id: int, count: int = 20, mode: str = 'standard_10'):
+    qids = bank.sample(count)
+    session = bot.QuizSession(qids, mode, 'big', user_id)
+    for i, qid in enumerate(qids):
+        session.answers[i] = bot.question_registry.get(qid).answer_mask if i % 2 else 1
+    bot.user_sessions[user_id] = session
+    return session
+
+def bench_quiz_flow(runner: Runner) -> None:
+    root = os.path.join(WORKDIR, 'flow')
+    write_bank(os.path.join(root, 'big.json'), 1000, seed=1)
+    bot.quiz_catalog = bot.QuizCatalog(root, refresh_interval=3600)
+    bot.question_banks.clear()
+    bot.question_registry = bot.QuestionRegistry(bot.QUESTION_CACHE_SIZE)
+    bank = bot.get_question_bank('big')
+    context = types.SimpleNamespace(bot=FakeBot())
+    params = {'questions': 20}
+
+    session = start_session(bank, 1)
+
+    async def send_next(_):
+        session.current = (session.current + 1) % len(session)
+        await bot.send_question(FakeMessage(), context, 1)
+
+    def uncached():
+        bot.question_screens = bot.QuestionScreenCache(bot.RENDER_CACHE_SIZE)
+
+    runner.measure('send_question_cached', params, send_next, setup=lambda: None, is_async=True)
+    runner.measure('send_question_uncached', params, send_next, setup=uncached, is_async=True)
+
+    user_ids = iter(range(10, 1 << 62))
+
+    def new_session():
+        user_id = next(user_ids)
+        start_session(bank, user_id)
+        return user_id
+
+    async def finalize(user_id):
+        await bot.finalize_quiz(user_id, context)
+
+    runner.measure('finalize_quiz', params, finalize, setup=new_session, is_async=True)
+
+    user_id = new_session()
+    runner.loop.run_until_complete(bot.finalize_quiz(user_id, context))
+    quiz_key = next(reversed(bot.completed_quizzes._entries))
+    update = fake_update(user_id)
+    indexes = iter(range(1 << 62))
+
+    async def review(_):
+        update.callback_query.message = FakeMessage(user_id)
+        await bot.show_review_question(update.callback_query, quiz_key, next(indexes) % 20)
+
+    runner.measure('show_review_question', params, review, setup=lambda: None, is_async=True)
+    shutil.rmtree(root)
+
+def bench_leaderboard(runner: Runner, users: int) -> None:
+    build_leaderboard(users)
+    params = {'users': users}
+    runner.measure('leaderboard_rebuild', params, lambda: bot.leaderboard_index.rebuild(bot.leaderboard_data), max_runs=20)
+    update = fake_update(1)
+    runner.measure('leaderboard_handler', params, lambda: bot.leaderboard_handler(update, None), is_async=True)
+
+    rng = random.Random(0)
+
+    def pick():
+        user_id = rng.randint(1, users)
+        stats = bot.leaderboard_data[user_id]
+        stats['tests_taken'] += 1
+        stats['best_score_pct'] = round(rng.random() * 100, 1)
+        return user_id
+
+    runner.measure('leaderboard_update', params, lambda user_id: bot.leaderboard_index.update(user_id, bot.leaderboard_data[user_id]), setup=pick)
+    bot.leaderboard_data.clear()
+    bot.leaderboard_index.rebuild(bot.leaderboard_data)
+
+# --- Report ---
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: list, baseline_path: str, threshold: float) -> int:
+    """Print median ratios against a previous run; returns the number of regressions."""
+    with open(baseline_path) as f:
+        baseline = {(r['name'], json.dumps(r['params'], sort_keys=True)): r for r in json.load(f)['results']}
+    regressions = 0
+    print(f"\n📈 Compared with {baseline_path} (regression: > {threshold:.2f}x slower median)")
+    for result in results:
+        old = baseline.get((result['name'], json.dumps(result['params'], sort_keys=True)))
+        if not old or not old['median_us']:
+            continue
+        ratio = result['median_us'] / old['median_us']
+        flag = '❌' if ratio > threshold else ('✅' if ratio < 1 / threshold else '  ')
+        regressions += ratio > threshold
+        label = ', '.join(f'{k}={v}' for k, v in result['params'].items())
+        print(f"{flag} {result['name']:<28} {label:<22} {old['median_us']:>12.1f} -> {result['median_us']:>12.1f} us  ({ratio:.2f}x)")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for bot.py's hot functions.")
+    parser.add_argument('--quick', action='store_true', help="smaller grid (skips the 10k-file, 100k-question and 1M-user cases)")
+    parser.add_argument('--only', help="comma-separated groups: catalog,bank,flow,leaderboard")
+    parser.add_argument('--min-time', type=float, default=0.5, help="seconds spent per benchmark (at least 3 runs)")
+    parser.add_argument('--out', default='benchmark-results.json')
+    parser.add_argument('--compare', help="previous results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="median slowdown counted as a regression")
+    args = parser.parse_args()
+
+    grid = QUICK if args.quick else FULL
+    groups = set(args.only.split(',')) if args.only else {'catalog', 'bank', 'flow', 'leaderboard'}
+    runner = Runner(args.min_time)
+    try:
+        if 'catalog' in groups:
+            for files in grid['files']:
+                bench_catalog(runner, files)
+        if 'bank' in groups:
+            for size in grid['bank_sizes']:
+                bench_bank(runner, size)
+        if 'flow' in groups:
+            bench_quiz_flow(runner)
+        if 'leaderboard' in groups:
+            for users in grid['leaderboard_users']:
+                bench_leaderboard(runner, users)
+    finally:
+        runner.loop.close()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'grid': 'quick' if args.quick else 'full',
+        'results': runner.results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"💾 {len(runner.results)} results written to {args.out}")
+
+    if args.compare:
+        sys.exit(1 if compare(runner.results, args.compare, args.threshold) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,36 @@
 import logging
 import os
 import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime
+from array import array
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, error, WebAppInfo
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, CallbackContext, BaseUpdateProcessor, BaseRateLimiter
+from sortedcontainers import SortedList
+import tornado.web
+import tornado.httpserver
 import random
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from bisect import bisect_left, bisect_right
 import sys
 import json
+import signal
+import time
+import mmap
+import struct
+import re
+import heapq
+import itertools
+import base64
+import functools
+import hashlib
+import html
+import math
+import ctypes
+import ctypes.util
+import errno
+import threading
+import sqlite3
+from typing import NamedTuple
 
 # Check Python version
 if sys.version_info >= (3, 13):
@@ -16,10 +39,49 @@ if sys.version_info >= (3, 13):
 # Setup Logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
+logging.getLogger('tornado.access').setLevel(logging.WARNING)  # no line per webhook call
 
 # --- Configuration & Initialization ---
 BOT_TOKEN = os.environ.get('BOT_TOKEN') 
+BOT_API_URL = os.environ.get('BOT_API_URL')  # e.g. a local Bot API server: http://127.0.0.1:8081/bot
+# Webhook mode is used when a public URL is known (Render sets RENDER_EXTERNAL_URL), otherwise long polling
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL') or os.environ.get('RENDER_EXTERNAL_URL')
+BOT_MODE = os.environ.get('BOT_MODE', 'webhook' if WEBHOOK_URL else 'polling')
+PORT = int(os.environ.get('PORT', '10000'))
+WEBHOOK_PATH = '/' + os.environ.get('WEBHOOK_PATH', 'telegram').strip('/')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')  # checked against X-Telegram-Bot-Api-Secret-Token
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # Prometheus text on /metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # if set, /metrics wants "Authorization: Bearer <token>"
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', '40'))  # handlers running at once
+MAX_PENDING_UPDATES = int(os.environ.get('MAX_PENDING_UPDATES', str(8 * MAX_CONCURRENT_UPDATES)))  # accepted but waiting
+GLOBAL_SEND_RATE = float(os.environ.get('GLOBAL_SEND_RATE', '30'))  # outgoing chat requests per second, all chats
+CHAT_SEND_RATE = float(os.environ.get('CHAT_SEND_RATE', '1'))  # per private chat, per second
+CHAT_SEND_BURST = int(os.environ.get('CHAT_SEND_BURST', '3'))  # short bursts allowed per private chat
+GROUP_SEND_RATE = float(os.environ.get('GROUP_SEND_RATE', str(20 / 60)))  # per group chat, per second
+SEND_MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', '3'))  # retries after a 429 (flood control)
 QUIZ_DATA_DIR = 'questions' 
+CATALOG_REFRESH_SECONDS = float(os.environ.get('CATALOG_REFRESH_SECONDS', '30'))
+WATCH_QUESTIONS = os.environ.get('WATCH_QUESTIONS', '1') == '1'  # hot-reload quiz files on change
+WATCH_DEBOUNCE_SECONDS = float(os.environ.get('WATCH_DEBOUNCE_SECONDS', '1'))  # quiet time before reloading
+WATCH_POLL_SECONDS = float(os.environ.get('WATCH_POLL_SECONDS', '5'))  # when inotify isn't available
+RETIRED_BANK_SWEEP_SECONDS = float(os.environ.get('RETIRED_BANK_SWEEP_SECONDS', '60'))  # how often replaced banks are checked for release
+QUIZ_BANK_DIR = os.environ.get('QUIZ_BANK_DIR', '.qbank_cache')  # compiled question banks
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', '4096'))  # pre-rendered question screens
+DUPLICATE_SIMILARITY = float(os.environ.get('DUPLICATE_SIMILARITY', '0.8'))  # estimated Jaccard above which questions count as the same
+SEARCH_RESULTS = int(os.environ.get('SEARCH_RESULTS', '8'))  # hits listed by /search
+BROWSE_PAGE_SIZE = int(os.environ.get('BROWSE_PAGE_SIZE', '8'))  # entries per page in the quiz browser
+MESSAGE_STATE_CACHE_SIZE = int(os.environ.get('MESSAGE_STATE_CACHE_SIZE', '50000'))  # messages whose shown content we remember
+QUESTION_CACHE_SIZE = int(os.environ.get('QUESTION_CACHE_SIZE', '20000'))  # decoded questions shared by all sessions
+BOT_DB_PATH = os.environ.get('BOT_DB_PATH', os.path.join('data', 'bot.db'))  # SQLite (WAL) persistent state
+LEADERBOARD_FLUSH_SECONDS = float(os.environ.get('LEADERBOARD_FLUSH_SECONDS', '2'))
+SESSION_FLUSH_SECONDS = float(os.environ.get('SESSION_FLUSH_SECONDS', '1'))
+MASTERY_FLUSH_SECONDS = float(os.environ.get('MASTERY_FLUSH_SECONDS', '5'))
+MASTERY_MEMORY_BUDGET = int(os.environ.get('MASTERY_MEMORY_BUDGET', str(32 * 1024 * 1024)))  # bytes of mastery records + alias tables kept in RAM
+SEEN_FLUSH_SECONDS = float(os.environ.get('SEEN_FLUSH_SECONDS', '5'))
+SEEN_CACHE_SIZE = int(os.environ.get('SEEN_CACHE_SIZE', '50000'))  # (user, quiz) seen-question sets kept in memory
+REVIEW_MEMORY_BUDGET = int(os.environ.get('REVIEW_MEMORY_BUDGET', str(8 * 1024 * 1024)))  # bytes of review data kept in RAM
+REVIEW_MEMORY_TTL = float(os.environ.get('REVIEW_MEMORY_TTL', '3600'))  # idle seconds before a review spills to disk
+REVIEW_DISK_TTL = float(os.environ.get('REVIEW_DISK_TTL', str(7 * 24 * 3600)))  # seconds a review stays reviewable
 
 # Define quiz modes and their parameters
 QUIZ_MODES = {
@@ -27,155 +89,2637 @@ QUIZ_MODES = {
     'standard_10': {'num_q': 10, 'timed': False, 'label': "📝 Standard (10Q)", 'feedback': True},
     'full_20': {'num_q': 20, 'timed': False, 'label': "🎯 Full Test (20Q)", 'feedback': True},
     'timed_10_300': {'num_q': 10, 'timed': True, 'time_limit': 300, 'label': "⏱️ Timed Challenge (10Q - 5min)", 'feedback': True},
-    'simulation_20_720': {'num_q': 20, 'timed': True, 'time_limit': 720, 'label': "🧠 Full Simulation (20Q - 12min)", 'feedback': False}
+    'simulation_20_720': {'num_q': 20, 'timed': True, 'time_limit': 720, 'label': "🧠 Full Simulation (20Q - 12min)", 'feedback': False},
+    'adaptive_10': {'num_q': 10, 'timed': False, 'label': "🧬 Adaptive Practice (10Q)", 'feedback': True, 'adaptive': True},
 }
 
+# Optional Random Mix weighting per root topic (default 1.0).
+# A topic with weight 2.0 makes each of its questions twice as likely to be drawn.
+RANDOM_MIX_WEIGHTS = {}
+
 # Global state
 leaderboard_data = defaultdict(lambda: {'total_score': 0, 'total_questions': 0, 'tests_taken': 0, 'best_score_pct': 0, 'username': 'N/A', 'user_id': 0})
 user_sessions = {}
-completed_quizzes = {}  # Store completed quiz data for review
 
-# --- DYNAMIC TOPIC LOADING (NO HARDCODING NEEDED!) ---
-def get_all_topic_files() -> dict:
-    """
-    🔥 AUTO-DISCOVERS all topics from JSON files in 'questions' folder
-    Returns: {topic_name: file_path}
-    NO NEED TO UPDATE CODE when adding new topics!
-    """
-    topics = {}
-    try:
-        if not os.path.exists(QUIZ_DATA_DIR):
-            os.makedirs(QUIZ_DATA_DIR, exist_ok=True)
-            return topics
-            
-        # Scan for individual topic files in the root questions folder
-        for filename in os.listdir(QUIZ_DATA_DIR):
-            if filename.endswith('.json') and not filename.startswith('_'):
-                topic_name = filename[:-5]  # Remove .json
-                topics[topic_name] = os.path.join(QUIZ_DATA_DIR, filename)
-                logger.info(f"📚 Discovered topic: {topic_name}")
-                
-    except Exception as e:
-        logger.error(f"Error discovering topics: {e}")
-        
-    return topics
+# --- DYNAMIC TOPIC LOADING (NO HARDCODING NEEDED!) ---
+def get_all_topic_files() -> dict:
+    """
+    🔥 AUTO-DISCOVERS all topics from JSON files in 'questions' folder
+    Returns: {topic_name: file_path}
+    NO NEED TO UPDATE CODE when adding new topics!
+    """
+    return {topic_id: quiz_catalog.entry(topic_id).path for topic_id, _ in quiz_catalog.sorted_topics()}
+
+# --- Utility Functions ---
+
+def load_questions_from_file(quiz_id: str) -> list:
+    """
+    Loads ALL questions of a quiz (quiz_id is the path relative to QUIZ_DATA_DIR).
+    Quiz starts should prefer get_question_bank(quiz_id).sample(k), which decodes only k records.
+    """
+    bank = get_question_bank(quiz_id)
+    if bank is None:
+        return []
+    return [bank[i] for i in range(len(bank))]
+
+class QuizEntry(NamedTuple):
+    """One quiz file known to the catalog."""
+    quiz_id: str
+    label: str
+    icon: str
+    path: str
+    size: int
+    mtime_ns: int
+
+class CatalogDir(NamedTuple):
+    """Cached listing of a single folder inside QUIZ_DATA_DIR."""
+    mtime_ns: int
+    quiz_ids: tuple
+    subdirs: tuple
+
+class FolderNode(NamedTuple):
+    """One folder of the quiz browser tree. Entries are sorted once, when the tree is built."""
+    path: str          # relative to QUIZ_DATA_DIR, '' for the root
+    label: str
+    parent: str        # None for the root
+    entries: tuple     # (is_folder, id, label): subfolders first, then quizzes
+    quiz_count: int    # quizzes in this folder and everything below it
+
+def quiz_icon(quiz_id: str) -> str:
+    """Pick the menu icon based on the top-level folder or filename."""
+    parts = quiz_id.split('/')
+    top_folder = parts[0].lower() if len(parts) > 1 else f"{parts[0]}.json".lower()
+
+    if 'gate' in top_folder and 'pyq' in top_folder:
+        return "📖"
+    elif 'mock' in top_folder:
+        return "🧠"
+    elif 'pyq' in top_folder:
+        return "📖"
+    elif 'subject' in top_folder or 'subject_wise' in top_folder:
+        return "📚"
+    elif 'weekly' in top_folder or 'daily' in top_folder:
+        return "📅"
+    return "📋"
+
+def quiz_label(quiz_id: str) -> str:
+    """Create a user-friendly label (without icon) from a quiz id."""
+    parts = quiz_id.split('/')
+
+    # Use last 3 parts for label or all if less than 3
+    display_parts = parts[-3:] if len(parts) >= 3 else parts
+
+    # Capitalize and make it readable
+    return " | ".join([p.replace('_', ' ').title() for p in display_parts])
+
+class QuizCatalog:
+    """
+    🔥 In-memory catalog of every quiz under QUIZ_DATA_DIR.
+    Built once, then only folders whose mtime changed are re-listed.
+    Menu handlers read the cached views, so no os.walk per click.
+    """
+
+    def __init__(self, root: str, refresh_interval: float = 30.0):
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self.generation = 0  # bumped whenever the set of quizzes changes
+        self._dirs = {}      # relative folder ('' for root) -> CatalogDir
+        self._entries = {}   # quiz_id -> QuizEntry
+        self._last_check = None
+        self._views = {}     # cached derived views, reset on every change
+
+    def _scan_dir(self, rel_dir: str, mtime_ns: int) -> None:
+        """(Re)list one folder and replace its entries in the catalog."""
+        old = self._dirs.get(rel_dir)
+        if old:
+            for quiz_id in old.quiz_ids:
+                self._entries.pop(quiz_id, None)
+
+        abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        quiz_ids, subdirs = [], []
+        with os.scandir(abs_dir) as it:
+            for entry in it:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir():
+                    subdirs.append(rel_path)
+                elif entry.name.endswith('.json') and not entry.name.startswith('_'):
+                    st = entry.stat()
+                    quiz_id = rel_path[:-5]  # Remove '.json'
+                    icon = quiz_icon(quiz_id)
+                    self._entries[quiz_id] = QuizEntry(
+                        quiz_id, f"{icon} {quiz_label(quiz_id)}", icon,
+                        entry.path, st.st_size, st.st_mtime_ns
+                    )
+                    quiz_ids.append(quiz_id)
+                    logger.debug(f"✅ Found quiz: {quiz_id}")
+
+        self._dirs[rel_dir] = CatalogDir(mtime_ns, tuple(quiz_ids), tuple(subdirs))
+
+    def _drop_dir(self, rel_dir: str) -> None:
+        for quiz_id in self._dirs.pop(rel_dir).quiz_ids:
+            self._entries.pop(quiz_id, None)
+
+    def refresh(self) -> bool:
+        """Stat every known folder and re-list only the ones that changed. Returns True on change."""
+        self._last_check = time.monotonic()
+        changed = False
+        try:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root, exist_ok=True)
+                logger.warning(f"Created questions directory: {self.root}")
+
+            seen = set()
+            pending = ['']
+            while pending:
+                rel_dir = pending.pop()
+                abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+                try:
+                    mtime_ns = os.stat(abs_dir).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(rel_dir)
+                cached = self._dirs.get(rel_dir)
+                if cached is None or cached.mtime_ns != mtime_ns:
+                    self._scan_dir(rel_dir, mtime_ns)
+                    changed = True
+                pending.extend(self._dirs[rel_dir].subdirs)
+
+            for rel_dir in [d for d in self._dirs if d not in seen]:
+                self._drop_dir(rel_dir)
+                changed = True
+
+        except Exception as e:
+            logger.error(f"❌ Error listing quizzes in {self.root}: {e}")
+
+        if changed:
+            self.generation += 1
+            self._views = {}
+            logger.info(f"📊 Quiz catalog rebuilt: {len(self._entries)} quiz(es) in {len(self._dirs)} folder(s)")
+        return changed
+
+    def _ensure_fresh(self) -> None:
+        if self._last_check is None or time.monotonic() - self._last_check >= self.refresh_interval:
+            self.refresh()
+
+    def _view(self, name: str, build):
+        self._ensure_fresh()
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = build()
+        return view
+
+    def entry(self, quiz_id: str):
+        """Return the QuizEntry for quiz_id or None."""
+        self._ensure_fresh()
+        return self._entries.get(quiz_id)
+
+    def available(self) -> dict:
+        """{quiz_id: label} for every quiz."""
+        return self._view('available', lambda: {q: e.label for q, e in self._entries.items()})
+
+    def sorted_quizzes(self) -> list:
+        """[(quiz_id, label)] sorted alphabetically by label."""
+        return self._view('sorted', lambda: sorted(self.available().items(), key=lambda item: item[1]))
+
+    def sorted_topics(self) -> list:
+        """Root-level quizzes only (the 'topics'), sorted by label."""
+        return self._view('topics', lambda: [(q, l) for q, l in self.sorted_quizzes() if '/' not in q])
+
+    def folder(self, rel_dir: str):
+        """FolderNode for rel_dir ('' for the root) or None."""
+        return self._view('tree', self._build_tree).get(rel_dir)
+
+    def _build_tree(self) -> dict:
+        counts = {}
+        for rel_dir in sorted(self._dirs, key=lambda d: d.count('/') if d else -1, reverse=True):
+            listing = self._dirs[rel_dir]
+            counts[rel_dir] = len(listing.quiz_ids) + sum(counts.get(d, 0) for d in listing.subdirs)
+
+        tree = {}
+        for rel_dir, listing in self._dirs.items():
+            folders = sorted(
+                ((True, d, f"📁 {d.rsplit('/', 1)[-1]} ({counts[d]})") for d in listing.subdirs if counts.get(d)),
+                key=lambda item: item[1].lower())
+            quizzes = sorted(
+                ((False, q, f"{self._entries[q].icon} {quiz_label(q.rsplit('/', 1)[-1])}")
+                 for q in listing.quiz_ids if q in self._entries),
+                key=lambda item: item[1].lower())
+            parent = None if not rel_dir else (rel_dir.rsplit('/', 1)[0] if '/' in rel_dir else '')
+            label = f"📂 {rel_dir}" if rel_dir else "📂 All quizzes"
+            tree[rel_dir] = FolderNode(rel_dir, label, parent, tuple(folders + quizzes), counts[rel_dir])
+        return tree
+
+    def snapshot(self) -> dict:
+        """{quiz_id: (size, mtime_ns)} as currently known, to diff against after a refresh."""
+        return {q: (e.size, e.mtime_ns) for q, e in self._entries.items()}
+
+    def restat(self, quiz_ids) -> list:
+        """Re-stat single quiz files (editing a file in place doesn't touch its folder's mtime)."""
+        changed = []
+        for quiz_id in quiz_ids:
+            entry = self._entries.get(quiz_id)
+            if entry is None:
+                continue
+            try:
+                st = os.stat(entry.path)
+            except OSError:
+                continue  # deleted: the folder rescan drops it
+            if (st.st_size, st.st_mtime_ns) != (entry.size, entry.mtime_ns):
+                self._entries[quiz_id] = entry._replace(size=st.st_size, mtime_ns=st.st_mtime_ns)
+                changed.append(quiz_id)
+        if changed:
+            self.generation += 1
+            self._views = {}
+        return changed
+
+quiz_catalog = QuizCatalog(QUIZ_DATA_DIR, refresh_interval=CATALOG_REFRESH_SECONDS)
+
+def get_available_quizzes() -> dict:
+    """
+    🔥 FULLY AUTOMATIC - NO HARDCODING REQUIRED!
+    Served from the in-memory quiz catalog (re-checked every CATALOG_REFRESH_SECONDS).
+    Returns a dict of available quizzes {relative_path_id: label}.
+    """
+    return quiz_catalog.available()
+
+# --- Question Model ---
+#
+# Banks come in two schemas:
+#   {"q": "[MSQ] ...", "options": [...], "answer": 1 | [0, 2], "explanation": ...}
+#   {"question": "...", "type": "MCQ", "options": ["A) ..."], "correct_answer": "C" | ["B", "D"],
+#    "explanation": ..., "topic": ..., "difficulty": ...}
+# Both are normalized ONCE (when the bank is compiled) into a slotted Question, so rendering
+# and scoring read precomputed fields instead of re-parsing the text on every tap.
+
+MAX_OPTIONS = 8  # answers are stored as one option bitmask per question
+OPTION_PREFIX = re.compile(r'^\s*([A-Ha-h])\s*[).:]\s*')
+
+class Question:
+    """One normalized question. answer_mask has bit i set when option i is correct."""
+
+    __slots__ = ('text', 'options', 'answer_mask', 'q_type', 'is_msq', 'needs_calculator',
+                 'topic', 'explanation', 'img_url', 'difficulty', 'qid')
+
+    def __init__(self, text, options, answer_mask, q_type, is_msq, needs_calculator,
+                 topic=None, explanation=None, img_url=None, difficulty=None):
+        self.text = text
+        self.options = tuple(options)
+        self.answer_mask = answer_mask
+        self.q_type = sys.intern(q_type)
+        self.is_msq = bool(is_msq)
+        self.needs_calculator = bool(needs_calculator)
+        self.topic = sys.intern(topic) if topic else None
+        self.explanation = explanation or None
+        self.img_url = img_url or None
+        self.difficulty = sys.intern(difficulty) if difficulty else None
+        self.qid = None  # global question id, set by QuestionBank
+
+    @property
+    def answer_index(self) -> int:
+        """Lowest correct option (the only one for MCQ/NAT)."""
+        return (self.answer_mask & -self.answer_mask).bit_length() - 1
+
+    @property
+    def correct_options(self) -> list:
+        return [i for i in range(len(self.options)) if self.answer_mask >> i & 1]
+
+    def to_record(self) -> list:
+        """Compact list form stored in compiled banks."""
+        return [self.text, list(self.options), self.answer_mask, self.q_type, int(self.is_msq),
+                int(self.needs_calculator), self.topic, self.explanation, self.img_url, self.difficulty]
+
+    @classmethod
+    def from_record(cls, record: list) -> 'Question':
+        return cls(*record)
+
+def _answer_letters_to_indices(value) -> list:
+    """'C' / 'A, C' / ['B', 'D'] -> [2] / [0, 2] / [1, 3]."""
+    if isinstance(value, str):
+        value = re.split(r'[\s,;/]+', value.strip())
+    indices = []
+    for item in value:
+        if isinstance(item, int):
+            indices.append(item)
+        elif isinstance(item, str) and len(item.strip()) == 1 and item.strip().isalpha():
+            indices.append(ord(item.strip().upper()) - 65)
+        elif isinstance(item, str) and item.strip().isdigit():
+            indices.append(int(item.strip()))
+        else:
+            raise ValueError(f"unrecognised answer {item!r}")
+    return indices
+
+def normalize_question(raw: dict, default_topic: str = None):
+    """
+    Convert a raw question dict (either schema) into a Question.
+    Returns None for questions that can't be answered with buttons (e.g. NAT without options).
+    """
+    text = raw.get('q') or raw.get('question')
+    options = raw.get('options') or []
+    if not text or not options or len(options) > MAX_OPTIONS:
+        return None
+
+    # Strip "A) " style prefixes - the keyboard adds its own letters
+    if all((m := OPTION_PREFIX.match(str(opt))) and m.group(1).upper() == chr(65 + i) for i, opt in enumerate(options)):
+        options = [OPTION_PREFIX.sub('', str(opt), count=1) for opt in options]
+    options = [str(opt) for opt in options]
+
+    if 'answer' in raw:
+        answer = raw['answer']
+        indices = answer if isinstance(answer, list) else [answer]
+        multi = isinstance(answer, list)
+    else:
+        answer = raw.get('correct_answer')
+        if answer is None:
+            return None
+        indices = _answer_letters_to_indices(answer)
+        multi = isinstance(answer, list) or len(indices) > 1
+
+    if not indices or any(not isinstance(i, int) or not 0 <= i < len(options) for i in indices):
+        return None
+
+    # Type from the "[MSQ]"/"[NAT]" text prefix first (what users see), then the explicit field
+    declared = str(raw.get('type') or '').upper()
+    if text.startswith('[MSQ]'):
+        q_type = 'MSQ'
+    elif text.startswith('[NAT]'):
+        q_type = 'NAT'
+    elif text.startswith('[MCQ]'):
+        q_type = 'MCQ'
+    elif declared in ('MCQ', 'MSQ', 'NAT'):
+        q_type = declared
+    else:
+        q_type = 'MSQ' if multi else 'MCQ'
+
+    mask = 0
+    for i in indices:
+        mask |= 1 << i
+
+    return Question(
+        text=text,
+        options=options,
+        answer_mask=mask,
+        q_type=q_type,
+        is_msq=multi or q_type == 'MSQ',
+        needs_calculator=has_calculator_emoji(text),
+        topic=raw.get('topic') or default_topic,
+        explanation=raw.get('explanation'),
+        img_url=raw.get('img_url'),
+        difficulty=raw.get('difficulty'),
+    )
+
+# --- Compiled Question Banks ---
+#
+# Layout of a .qbank file (all integers little-endian):
+#   header   : magic b'QBNK', u16 version, u16 reserved, u32 count, u64 source size, i64 source mtime_ns
+#   offsets  : (count + 1) x u32, byte offsets of each record relative to the data section
+#   data     : one compact UTF-8 JSON array per question (Question.to_record())
+# The file is memory-mapped read-only, so several bot processes share the same pages
+# and a quiz start only decodes the records it actually samples.
+
+BANK_MAGIC = b'QBNK'
+BANK_VERSION = 2
+BANK_HEADER = struct.Struct('<4sHHIQq')
+BANK_OFFSET = struct.Struct('<I')
+
+def compiled_bank_path(quiz_id: str) -> str:
+    """Where the compiled bank for quiz_id lives."""
+    return os.path.join(QUIZ_BANK_DIR, f'{quiz_id}.qbank')
+
+def compile_bank(source_path: str, bank_path: str) -> int:
+    """Compile one JSON question file into a .qbank file. Returns the number of records."""
+    st = os.stat(source_path)
+    with open(source_path, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+    if not isinstance(questions, list):
+        raise ValueError(f"{source_path} must contain a JSON list of questions")
+
+    default_topic = os.path.splitext(os.path.basename(source_path))[0]
+    normalized = [normalize_question(q, default_topic) if isinstance(q, dict) else None for q in questions]
+    skipped = sum(1 for q in normalized if q is None)
+    if skipped:
+        logger.warning(f"⚠️ Skipped {skipped} unplayable question(s) in {source_path}")
+
+    records = [json.dumps(q.to_record(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+               for q in normalized if q is not None]
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+
+    os.makedirs(os.path.dirname(bank_path) or '.', exist_ok=True)
+    tmp_path = f'{bank_path}.{os.getpid()}.{threading.get_ident()}.tmp'  # hot reload compiles in worker threads
+    with open(tmp_path, 'wb') as f:
+        f.write(BANK_HEADER.pack(BANK_MAGIC, BANK_VERSION, 0, len(records), st.st_size, st.st_mtime_ns))
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        f.writelines(records)
+    # Atomic swap: processes that still map the old file keep reading the old inode
+    os.replace(tmp_path, bank_path)
+    return len(records)
+
+class QuestionBank:
+    """Read-only, mmap-backed random access to a compiled question bank."""
+
+    __slots__ = ('quiz_id', 'path', 'count', 'source_size', 'source_mtime_ns', 'base', 'clusters', '_mm', '_data_at')
+
+    def __init__(self, quiz_id: str, path: str):
+        self.quiz_id = quiz_id
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _, count, self.source_size, self.source_mtime_ns = BANK_HEADER.unpack_from(self._mm, 0)
+            if magic != BANK_MAGIC or version != BANK_VERSION:
+                raise ValueError(f"{path} is not a version {BANK_VERSION} question bank")
+        except Exception:
+            self._mm.close()
+            raise
+        self.count = count
+        self.base = None  # first global question id, assigned by question_registry
+        self.clusters = None  # near-duplicate cluster per record (array, 0 = unique), set by search_index
+        self._data_at = BANK_HEADER.size + (count + 1) * BANK_OFFSET.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def record_bytes(self, index: int) -> bytes:
+        """Raw encoded record at index."""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        at = BANK_HEADER.size + index * BANK_OFFSET.size
+        start, end = struct.unpack_from('<II', self._mm, at)
+        return self._mm[self._data_at + start:self._data_at + end]
+
+    def __getitem__(self, index: int) -> Question:
+        question = Question.from_record(json.loads(self.record_bytes(index)))
+        question.qid = self.base + index
+        return question
+
+    def sample(self, k: int) -> array:
+        """Global ids of k distinct random questions (or all of them if the bank is smaller), one per duplicate cluster."""
+        k = min(k, self.count)
+        if self.clusters is None:
+            return array('I', (self.base + i for i in random.sample(range(self.count), k)))
+        draws = itertools.chain(((self, random.randrange(self.count)) for _ in range(2 * k + 16)),
+                                ((self, i) for i in permuted(self.count)))
+        return sample_distinct(draws, k)
+
+    def matches(self, size: int, mtime_ns: int) -> bool:
+        """True if this bank was compiled from a source file with these stats."""
+        return self.source_size == size and self.source_mtime_ns == mtime_ns
+
+    def close(self) -> None:
+        self._mm.close()
+
+def permuted(n: int):
+    """
+    Yields range(n) in random order, lazily: a Fisher-Yates shuffle that only remembers the
+    slots it has swapped, so taking the first m values costs O(m) time and memory, not O(n).
+    """
+    swapped = {}
+    for i in range(n):
+        j = random.randrange(i, n)
+        value = swapped.get(j, j)
+        swapped[j] = swapped.pop(i, i)
+        yield value
+
+def question_cluster(bank: QuestionBank, index: int) -> int:
+    """Near-duplicate cluster of a record; 0 when it has no known duplicates."""
+    clusters = bank.clusters
+    return clusters[index] if clusters is not None and index < len(clusters) else 0
+
+def sample_distinct(draws, k: int) -> array:
+    """First k questions from an iterable of (bank, record) draws, skipping repeats and repeated duplicate clusters."""
+    picked, clusters = {}, set()
+    for bank, index in draws:
+        if len(picked) == k:
+            break
+        qid = bank.base + index
+        if qid in picked:
+            continue
+        cluster = question_cluster(bank, index)
+        if cluster:
+            if cluster in clusters:
+                continue
+            clusters.add(cluster)
+        picked[qid] = None
+    return array('I', picked)
+
+class QuestionRegistry:
+    """
+    Global integer question ids shared by every session: qid = bank.base + record index.
+    Each mapped bank gets a fresh id range, and replaced banks stay registered, so ids held
+    by running sessions keep pointing at the questions they were started with.
+    Decoded questions are shared through a bounded LRU cache.
+    """
+
+    def __init__(self, cache_size: int):
+        self.cache_size = cache_size
+        self._bases = []   # ascending first ids
+        self._banks = []
+        self._next = 0
+        self._cache = OrderedDict()  # qid -> Question
+
+    def register(self, bank: QuestionBank) -> None:
+        bank.base = self._next
+        self._next += max(len(bank), 1)
+        self._bases.append(bank.base)
+        self._banks.append(bank)
+
+    def unregister(self, bank: QuestionBank) -> None:
+        """Forget a released bank (its ids are never handed out again)."""
+        i = bisect_left(self._bases, bank.base)
+        if i < len(self._banks) and self._banks[i] is bank:
+            del self._bases[i]
+            del self._banks[i]
+        end = bank.base + len(bank)
+        for qid in [q for q in self._cache if bank.base <= q < end]:
+            del self._cache[qid]
+
+    def bank_of(self, qid: int) -> QuestionBank:
+        i = bisect_right(self._bases, qid) - 1
+        if i < 0 or qid - self._banks[i].base >= len(self._banks[i]):
+            raise KeyError(qid)
+        return self._banks[i]
+
+    def get(self, qid: int) -> Question:
+        question = self._cache.get(qid)
+        if question is not None:
+            self._cache.move_to_end(qid)
+            return question
+        bank = self.bank_of(qid)
+        question = self._cache[qid] = bank[qid - bank.base]
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return question
+
+question_registry = QuestionRegistry(QUESTION_CACHE_SIZE)
+question_banks = {}  # quiz_id -> QuestionBank (open, mapped)
+question_banks_generation = 0  # bumped whenever a bank is (re)mapped
+
+def open_question_bank(quiz_id: str, source_path: str, size: int, mtime_ns: int) -> QuestionBank:
+    """Open the compiled bank for quiz_id, (re)compiling it first if it is missing or stale."""
+    bank_path = compiled_bank_path(quiz_id)
+    try:
+        bank = QuestionBank(quiz_id, bank_path)
+        if bank.matches(size, mtime_ns):
+            return bank
+        bank.close()
+    except (OSError, ValueError, struct.error):
+        pass
+
+    count = compile_bank(source_path, bank_path)
+    logger.info(f"🛠️ Compiled {count} questions: {quiz_id} -> {bank_path}")
+    return QuestionBank(quiz_id, bank_path)
+
+def get_question_bank(quiz_id: str):
+    """
+    Returns the mapped QuestionBank for quiz_id, or None if the quiz doesn't exist / can't be compiled.
+    Banks stay open, so repeated quiz starts cost only the sampled records.
+    """
+    quiz_id = quiz_id.replace('\\', '/')
+    entry = quiz_catalog.entry(quiz_id)
+    if entry is None:
+        logger.error(f"❌ Quiz not found in catalog: {quiz_id}")
+        return None
+
+    bank = question_banks.get(quiz_id)
+    if bank is not None and bank.matches(entry.size, entry.mtime_ns):
+        return bank
+
+    try:
+        # Don't close the previous bank: running quizzes may still hold its questions
+        bank = open_question_bank(quiz_id, entry.path, entry.size, entry.mtime_ns)
+    except Exception as e:
+        logger.error(f"❌ Error loading questions for {quiz_id}: {e}")
+        return None
+
+    install_bank(quiz_id, bank)
+    logger.info(f"✅ Mapped {len(bank)} questions from {quiz_id}")
+    return bank
+
+def live_question_bank(qid: int):
+    """
+    The bank qid was drawn from, if it is still the live version of its quiz, else None.
+    Per-user state indexed by record (mastery, seen sets) must skip answers to an edited
+    quiz: reordered or replaced questions would land on the wrong records.
+    """
+    bank = question_registry.bank_of(qid)
+    return bank if question_banks.get(bank.quiz_id) is bank else None
+
+class RandomMixIndex:
+    """
+    🎲 Global (bank, record) index over every root topic, for Random Mix.
+    Stores one cumulative weight per bank, so a single uniform draw picks both the bank
+    and the record: sampling k questions is O(k) no matter how many topics exist.
+    Rebuilt only when the catalog or a bank changes.
+    """
+
+    def __init__(self, weights: dict = None):
+        self.weights = weights if weights is not None else {}
+        self.total = 0          # number of drawable questions
+        self._key = None
+        self._banks = []
+        self._bank_weights = []
+        self._cumulative = []   # cumulative weight up to and including each bank
+
+    def _ensure_built(self) -> None:
+        topics = quiz_catalog.sorted_topics()  # also refreshes the catalog when due
+        key = (quiz_catalog.generation, question_banks_generation)
+        if key == self._key:
+            return
+
+        banks, bank_weights, cumulative, total, running = [], [], [], 0, 0.0
+        for quiz_id, _ in topics:
+            weight = float(self.weights.get(quiz_id, 1.0))
+            bank = get_question_bank(quiz_id)
+            if not bank or weight <= 0:
+                continue
+            running += weight * len(bank)
+            banks.append(bank)
+            bank_weights.append(weight)
+            cumulative.append(running)
+            total += len(bank)
+
+        self._banks, self._bank_weights, self._cumulative, self.total = banks, bank_weights, cumulative, total
+        # Key taken after building: get_question_bank above may have (re)mapped banks
+        self._key = (quiz_catalog.generation, question_banks_generation)
+        logger.info(f"🎲 Random Mix index: {total} questions across {len(banks)} topic(s)")
+
+    def banks(self) -> list:
+        """Banks the current index draws from (may lag question_banks until the next sample)."""
+        return self._banks
+
+    def _draw(self) -> tuple:
+        """One weighted (bank_index, record) pair."""
+        r = random.random() * self._cumulative[-1]
+        b = min(bisect_right(self._cumulative, r), len(self._banks) - 1)
+        start = self._cumulative[b - 1] if b else 0.0
+        record = min(int((r - start) / self._bank_weights[b]), len(self._banks[b]) - 1)
+        return b, record
+
+    def sample(self, k: int) -> array:
+        """Global ids of up to k distinct random questions from all root topics."""
+        self._ensure_built()
+        k = min(k, self.total)
+        if k <= 0:
+            return array('I')
+
+        if 2 * k > self.total:
+            # Tiny catalog: enumerating every pair is cheaper than rejection sampling
+            pairs = [(bank, i) for bank in self._banks for i in range(len(bank))]
+            random.shuffle(pairs)
+            return sample_distinct(pairs, k)
+
+        draws = ((self._banks[b], i) for b, i in (self._draw() for _ in range(4 * k + 16)))
+        picked = sample_distinct(draws, k)
+        if len(picked) < k:
+            # Mostly duplicates: fall back to a full pass in random order
+            pairs = [(bank, i) for bank in self._banks for i in range(len(bank))]
+            random.shuffle(pairs)
+            picked = sample_distinct(pairs, k)
+        return picked
+
+random_mix_index = RandomMixIndex(RANDOM_MIX_WEIGHTS)
+
+def compile_all_banks() -> int:
+    """Compile every stale bank in the catalog (used by `python bot.py --compile`). Returns failures."""
+    quiz_catalog.refresh()
+    failures = 0
+    for quiz_id, _ in quiz_catalog.sorted_quizzes():
+        if get_question_bank(quiz_id) is None:
+            failures += 1
+    return failures
+
+# --- Question Search ---
+#
+# Inverted index over question text, options, topic and explanation of every mapped bank.
+# Each bank is indexed on its own (a "segment"), and term -> banks directories point a query
+# at just the segments that contain its terms. Replacing a bank only rebuilds its segment.
+
+SEARCH_TOKEN = re.compile(r'[^\W_]+')
+SEARCH_STOPWORDS = frozenset(
+    'a an and are as at be by for from how in is it of on or the to what which with'.split())
+SEARCH_FIELD_WEIGHTS = (3, 1, 2, 1)  # text, options, topic, explanation
+SEARCH_FUZZY_MATCH = 0.6  # share of a term's trigrams a question must contain to count as a fuzzy hit
+
+def search_tokens(text: str) -> list:
+    return [t for t in SEARCH_TOKEN.findall(text.lower()) if len(t) > 1 and t not in SEARCH_STOPWORDS]
+
+def search_trigrams(token: str) -> set:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+# --- Near-Duplicate Detection (MinHash / LSH) ---
+#
+# The same question often sits in several files. Every question gets a MinHash signature over
+# word 3-grams of its normalized text and options, computed with its search segment. Signatures
+# are split into bands; questions sharing a band land in the same bucket and are checked against
+# the bucket's first member only, so clustering is linear in the number of questions.
+
+MINHASH_HASH = struct.Struct('<32H')  # one 64-byte blake2b digest = 32 hash functions
+MINHASH_SIZE = MINHASH_HASH.size
+MINHASH_BANDS = 8                      # x 4 rows: candidates from roughly 0.6 similarity up
+MINHASH_ROW_BYTES = MINHASH_SIZE // MINHASH_BANDS
+MINHASH_EMPTY = b'\xff' * MINHASH_SIZE  # nothing to fingerprint: never clustered
+MINHASH_IGNORED = frozenset(('mcq', 'msq', 'nat'))
+
+def minhash_signature(question: Question) -> bytes:
+    tokens = [t for t in SEARCH_TOKEN.findall(' '.join((question.text,) + question.options).lower())
+              if t not in MINHASH_IGNORED]
+    shingles = {' '.join(tokens[i:i + 3]) for i in range(len(tokens) - 2)} or {' '.join(tokens)} - {''}
+    if not shingles:
+        return MINHASH_EMPTY
+    rows = [MINHASH_HASH.unpack(hashlib.blake2b(s.encode('utf-8'), digest_size=MINHASH_SIZE).digest()) for s in shingles]
+    return MINHASH_HASH.pack(*map(min, zip(*rows)))
+
+def cluster_duplicates(banks: list) -> tuple:
+    """
+    banks: [(quiz_id, signatures)], signatures being MINHASH_SIZE bytes per record.
+    Returns ({quiz_id: array of cluster ids (0 = unique)}, number of clusters).
+    """
+    offsets, total = [], 0
+    for _, signatures in banks:
+        offsets.append(total)
+        total += len(signatures) // MINHASH_SIZE
+    all_signatures = b''.join(signatures for _, signatures in banks)
+    parent = array('I', range(total))
+
+    def find(g):
+        while parent[g] != g:
+            parent[g] = parent[parent[g]]
+            g = parent[g]
+        return g
+
+    def similar(a, b):
+        sa = MINHASH_HASH.unpack_from(all_signatures, a * MINHASH_SIZE)
+        sb = MINHASH_HASH.unpack_from(all_signatures, b * MINHASH_SIZE)
+        return sum(x == y for x, y in zip(sa, sb)) >= DUPLICATE_SIMILARITY * len(sa)
+
+    for band in range(MINHASH_BANDS):
+        leaders = {}  # one band at a time keeps the buckets at one entry per question
+        for g in range(total):
+            at = g * MINHASH_SIZE
+            if all_signatures[at:at + MINHASH_SIZE] == MINHASH_EMPTY:
+                continue
+            key = all_signatures[at + band * MINHASH_ROW_BYTES:at + (band + 1) * MINHASH_ROW_BYTES]
+            leader = leaders.setdefault(key, g)
+            if leader != g:
+                a, b = find(leader), find(g)
+                if a != b and similar(leader, g):
+                    parent[max(a, b)] = min(a, b)
+
+    sizes = defaultdict(int)
+    for g in range(total):
+        sizes[find(g)] += 1
+    ids = {}
+    result = {}
+    for (quiz_id, signatures), offset in zip(banks, offsets):
+        clusters = array('I', bytes(4 * (len(signatures) // MINHASH_SIZE)))
+        for i in range(len(clusters)):
+            root = find(offset + i)
+            if sizes[root] > 1:
+                clusters[i] = ids.setdefault(root, len(ids) + 1)
+        result[quiz_id] = clusters
+    return result, len(ids)
+
+class SearchSegment:
+    """Token and trigram postings (plus MinHash signatures) for one bank, by record index. Built off the event loop."""
+
+    __slots__ = ('bank', 'tokens', 'trigrams', 'signatures')
+
+    def __init__(self, bank: QuestionBank):
+        self.bank = bank
+        self.tokens = {}    # token -> (array of records, array of field weights)
+        self.trigrams = {}  # trigram -> array of records
+        self.signatures = bytearray()  # MINHASH_SIZE bytes per record
+
+    @classmethod
+    def build(cls, bank: QuestionBank) -> 'SearchSegment':
+        segment = cls(bank)
+        for record in range(len(bank)):
+            q = bank[record]
+            segment.signatures += minhash_signature(q)
+            weights = defaultdict(int)
+            fields = (q.text, ' '.join(q.options), q.topic or '', q.explanation or '')
+            for field, field_weight in zip(fields, SEARCH_FIELD_WEIGHTS):
+                for token in search_tokens(field):
+                    weights[token] += field_weight
+            trigrams = set()
+            for token, weight in weights.items():
+                postings = segment.tokens.get(token)
+                if postings is None:
+                    postings = segment.tokens[token] = (array('I'), array('B'))
+                postings[0].append(record)
+                postings[1].append(min(weight, 255))
+                trigrams |= search_trigrams(token)
+            for trigram in trigrams:
+                postings = segment.trigrams.get(trigram)
+                if postings is None:
+                    postings = segment.trigrams[trigram] = array('I')
+                postings.append(record)
+        return segment
+
+class SearchIndex:
+    """
+    🔍 In-memory question search for /search.
+    Exact tokens score by field weight x idf; trigrams catch typos and partial words.
+    sync() follows question_banks: only added, replaced or removed banks are (re)indexed,
+    then near-duplicate clusters are recomputed from the stored signatures.
+    """
+
+    def __init__(self):
+        self.segments = {}       # quiz_id -> SearchSegment
+        self.docs = 0            # indexed questions
+        self._token_banks = {}   # token -> {quiz_id}
+        self._trigram_banks = {}  # trigram -> {quiz_id}
+        self._token_df = {}      # token -> questions containing it
+        self._key = None         # question_banks_generation last synced
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def _install(self, quiz_id: str, segment: SearchSegment) -> None:
+        self._remove(quiz_id)
+        self.segments[quiz_id] = segment
+        self.docs += len(segment.bank)
+        for token, (records, _) in segment.tokens.items():
+            self._token_banks.setdefault(token, set()).add(quiz_id)
+            self._token_df[token] = self._token_df.get(token, 0) + len(records)
+        for trigram in segment.trigrams:
+            self._trigram_banks.setdefault(trigram, set()).add(quiz_id)
+
+    def _remove(self, quiz_id: str) -> None:
+        segment = self.segments.pop(quiz_id, None)
+        if segment is None:
+            return
+        self.docs -= len(segment.bank)
+        for token, (records, _) in segment.tokens.items():
+            self._token_banks[token].discard(quiz_id)
+            if not self._token_banks[token]:
+                del self._token_banks[token]
+            self._token_df[token] -= len(records)
+            if not self._token_df[token]:
+                del self._token_df[token]
+        for trigram in segment.trigrams:
+            self._trigram_banks[trigram].discard(quiz_id)
+            if not self._trigram_banks[trigram]:
+                del self._trigram_banks[trigram]
+
+    async def sync(self, map_all: bool = False) -> None:
+        """Bring the index in line with question_banks. map_all maps every catalog quiz first (startup)."""
+        async with self._lock:
+            if map_all:
+                for quiz_id, _ in quiz_catalog.sorted_quizzes():
+                    get_question_bank(quiz_id)
+            changed = False
+            while self._key != question_banks_generation:
+                key = question_banks_generation
+                removed = [q for q in self.segments if q not in question_banks]
+                for quiz_id in removed:
+                    self._remove(quiz_id)
+                indexed = 0
+                for quiz_id, bank in list(question_banks.items()):
+                    segment = self.segments.get(quiz_id)
+                    if segment is not None and segment.bank is bank:
+                        continue
+                    segment = await asyncio.to_thread(SearchSegment.build, bank)
+                    if question_banks.get(quiz_id) is bank:  # not replaced while we were building
+                        self._install(quiz_id, segment)
+                        indexed += 1
+                self._key = key
+                if indexed or removed:
+                    changed = True
+                    logger.info(f"🔍 Search index: {self.docs} questions in {len(self.segments)} bank(s) "
+                                f"({indexed} indexed, {len(removed)} dropped)")
+            if changed:
+                await self._cluster()
+
+    async def _cluster(self) -> None:
+        """Group near-duplicates across all indexed banks and hand each bank its cluster ids."""
+        segments = sorted(self.segments.items())
+        clusters, count = await asyncio.to_thread(
+            cluster_duplicates, [(quiz_id, bytes(segment.signatures)) for quiz_id, segment in segments])
+        for quiz_id, segment in segments:
+            segment.bank.clusters = clusters[quiz_id]
+        duplicated = sum(1 for arr in clusters.values() for c in arr if c)
+        logger.info(f"🧬 Near-duplicates: {duplicated} question(s) in {count} cluster(s)")
+
+    def search(self, query: str, limit: int) -> list:
+        """[(quiz_id, record)] best first: questions matching more query terms rank higher, then by score."""
+        terms = list(dict.fromkeys(search_tokens(query)))
+        scores = defaultdict(float)
+        matched_terms = defaultdict(int)
+        for term in terms:
+            exact = set()
+            df = self._token_df.get(term)
+            if df:
+                idf = math.log(1 + self.docs / df)
+                for quiz_id in self._token_banks[term]:
+                    records, weights = self.segments[quiz_id].tokens[term]
+                    for record, weight in zip(records, weights):
+                        key = (quiz_id, record)
+                        scores[key] += idf * weight
+                        matched_terms[key] += 1
+                        exact.add(key)
+
+            trigrams = search_trigrams(term)
+            if not trigrams:
+                continue
+            shared = defaultdict(int)
+            for trigram in trigrams:
+                for quiz_id in self._trigram_banks.get(trigram, ()):
+                    for record in self.segments[quiz_id].trigrams[trigram]:
+                        shared[(quiz_id, record)] += 1
+            needed = math.ceil(len(trigrams) * SEARCH_FUZZY_MATCH)
+            for key, count in shared.items():
+                if count >= needed and key not in exact:
+                    scores[key] += count / len(trigrams)
+                    matched_terms[key] += 1
+
+        best = heapq.nlargest(limit, scores, key=lambda key: (matched_terms[key], scores[key]))
+        return best
+
+    def start(self) -> None:
+        """Index every quiz in the background (searches before it finishes see what's done so far)."""
+        self._task = asyncio.create_task(self.sync(map_all=True))
+
+    @property
+    def busy(self) -> bool:
+        """True while a sync may be reading banks in a worker thread."""
+        return self._lock.locked()
+
+    def refresh(self) -> None:
+        """Start a background sync if banks changed since the last one. Never waits for it."""
+        if self._key != question_banks_generation and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.sync())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+search_index = SearchIndex()
+
+# --- Hot Reload (question folder watcher) ---
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+def load_inotify():
+    """libc's inotify functions via ctypes, or None where inotify isn't available."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+class RetiredBanks:
+    """
+    🧹 Banks replaced or removed by a reload. They stay mapped and registered while running quizzes,
+    resident reviews or the indexes still hold their questions; a periodic sweep (not the per-quiz
+    paths) closes and unregisters the ones nothing refers to any more.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._banks = []
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._banks)
+
+    def add(self, bank: 'QuestionBank') -> None:
+        self._banks.append(bank)
+
+    def _unreferenced(self) -> list:
+        pinned = {id(bank) for bank in random_mix_index.banks()} | {id(s.bank) for s in search_index.segments.values()}
+        waiting = [bank for bank in self._banks if id(bank) not in pinned]
+        # Every id of the banks still unaccounted for: one C-level isdisjoint() per session / review
+        ids = set().union(*(range(bank.base, bank.base + len(bank)) for bank in waiting))
+        for qids in itertools.chain((s.qids for s in user_sessions.values()), completed_quizzes.resident_qids()):
+            if not waiting:
+                break
+            if ids.isdisjoint(qids):
+                continue
+            for bank in [b for b in waiting if any(b.base <= qid < b.base + len(b) for qid in qids)]:
+                waiting.remove(bank)
+                ids.difference_update(range(bank.base, bank.base + len(bank)))
+        return waiting
+
+    def release(self) -> int:
+        """Close and unregister every retired bank nothing uses any more. Returns the count."""
+        if not self._banks or search_index.busy:
+            return 0
+        released = self._unreferenced()
+        for bank in released:
+            self._banks.remove(bank)
+            question_registry.unregister(bank)
+            bank.close()
+        if released:
+            logger.info(f"🧹 Released {len(released)} replaced question bank(s) ({len(self._banks)} still in use)")
+        return len(released)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.release()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+retired_banks = RetiredBanks(RETIRED_BANK_SWEEP_SECONDS)
+
+def install_bank(quiz_id: str, bank: 'QuestionBank') -> None:
+    """Make bank the live version of quiz_id. The previous one is retired, not closed:
+    running quizzes and resident reviews may still hold its questions."""
+    global question_banks_generation
+    question_registry.register(bank)
+    old = question_banks.get(quiz_id)
+    question_banks[quiz_id] = bank
+    question_banks_generation += 1
+    if old is not None and old is not bank:
+        retired_banks.add(old)
+
+def retire_bank(quiz_id: str) -> None:
+    global question_banks_generation
+    old = question_banks.pop(quiz_id, None)
+    if old is not None:
+        question_banks_generation += 1
+        retired_banks.add(old)
+
+async def reload_quizzes(updated, removed) -> None:
+    """Recompile updated quizzes in a worker thread and swap them in; forget removed ones."""
+    for quiz_id in removed:
+        retire_bank(quiz_id)
+    for quiz_id in sorted(updated):
+        entry = quiz_catalog.entry(quiz_id)
+        if entry is None:
+            continue
+        bank = question_banks.get(quiz_id)
+        if bank is not None and bank.matches(entry.size, entry.mtime_ns):
+            continue  # already mapped on demand since the change
+        try:
+            bank = await asyncio.to_thread(open_question_bank, quiz_id, entry.path, entry.size, entry.mtime_ns)
+        except Exception as e:
+            logger.error(f"❌ Error reloading questions for {quiz_id}: {e}")
+            retire_bank(quiz_id)
+            continue
+        if quiz_catalog.entry(quiz_id) is entry:  # not changed again meanwhile
+            install_bank(quiz_id, bank)
+    await search_index.sync()
+    retired_banks.release()  # usually frees the removed banks right away
+
+class QuizWatcher:
+    """
+    👀 Watches QUIZ_DATA_DIR so new, edited and deleted quiz files go live without a restart.
+    Uses inotify (via ctypes) where available and polls otherwise. A burst of events is
+    debounced into one pass that recompiles only the files that changed.
+    """
+
+    def __init__(self, catalog: QuizCatalog, debounce: float, poll_interval: float):
+        self.catalog = catalog
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._libc = None
+        self._fd = None
+        self._wds = {}             # watch descriptor -> folder relative to the root
+        self._dirty = set()        # quiz ids named by file events
+        self._full_rescan = False  # queue overflow / folder moved: re-stat everything
+        self._debounce_handle = None
+        self._task = None          # running reload pass, or the polling loop
+        self._again = False        # events arrived during a reload pass
+        self._applied = {}         # catalog snapshot question_banks was last brought in line with
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._fd is not None else 'polling'
+
+    def start(self) -> None:
+        self._applied = self.catalog.snapshot()
+        self._libc = load_inotify()
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                if self._watch_tree(''):
+                    asyncio.get_running_loop().add_reader(fd, self._on_readable)
+                    logger.info(f"👀 Watching {self.catalog.root} for quiz changes (inotify, {len(self._wds)} folder(s))")
+                    return
+                self._close_fd()
+        self._task = asyncio.create_task(self._poll())
+        logger.info(f"👀 Watching {self.catalog.root} for quiz changes (polling every {self.poll_interval:g}s)")
+
+    async def stop(self) -> None:
+        if self._debounce_handle:
+            self._debounce_handle.cancel()
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            self._close_fd()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _close_fd(self) -> None:
+        os.close(self._fd)
+        self._fd = None
+        self._wds = {}
+
+    def _watch_tree(self, rel_dir: str) -> bool:
+        """Add watches for rel_dir and every folder below it. False if the kernel refused."""
+        pending = [rel_dir]
+        while pending:
+            rel = pending.pop()
+            path = os.path.join(self.catalog.root, rel) if rel else self.catalog.root
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), INOTIFY_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOENT:
+                    continue  # already gone again
+                logger.warning(f"⚠️ inotify watch on {path} failed: {os.strerror(err)}")
+                return False
+            self._wds[wd] = rel
+            try:
+                with os.scandir(path) as it:
+                    pending.extend(f"{rel}/{e.name}" if rel else e.name for e in it if e.is_dir())
+            except OSError:
+                pass
+        return True
+
+    def _on_readable(self) -> None:
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+                offset += length
+                self._on_event(wd, mask, name)
+        self._schedule()
+
+    def _on_event(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self._full_rescan = True
+            return
+        if mask & IN_IGNORED:
+            self._wds.pop(wd, None)
+            return
+        rel_dir = self._wds.get(wd)
+        if rel_dir is None:
+            return
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(rel_path)
+            elif mask & IN_MOVED_FROM:
+                self._full_rescan = True  # watches below it now carry stale paths
+        elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self._full_rescan = True
+        elif name.endswith('.json'):
+            self._dirty.add(rel_path[:-5])
+
+    def _schedule(self) -> None:
+        """(Re)start the debounce timer: reload once things have been quiet for `debounce` seconds."""
+        if self._debounce_handle:
+            self._debounce_handle.cancel()
+        self._debounce_handle = asyncio.get_running_loop().call_later(self.debounce, self._kick)
+
+    def _kick(self) -> None:
+        self._debounce_handle = None
+        if self._task and not self._task.done():
+            self._again = True
+            return
+        self._task = asyncio.create_task(self._reload())
+
+    async def _reload(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        full, self._full_rescan = self._full_rescan, False
+        try:
+            if full and self._fd is not None:
+                # Folders may have moved: start the watches over
+                for wd in list(self._wds):
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                self._wds = {}
+                self._watch_tree('')
+            await self.apply(None if full else dirty)
+        except Exception as e:
+            # Keep watching; the next pass diffs against the last applied snapshot and retries
+            logger.error(f"❌ Quiz reload failed: {e}")
+        if self._again:
+            self._again = False
+            self._schedule()
+
+    async def apply(self, dirty=None) -> None:
+        """
+        One reload pass. dirty: quiz ids to re-stat, or None to re-stat every quiz.
+        Diffs against the last applied snapshot, not the catalog's state before this pass:
+        menu clicks refresh the same catalog and may already have picked the change up.
+        """
+        before = self._applied
+        self.catalog.refresh()  # folders whose listing changed
+        self.catalog.restat(self.catalog.snapshot() if dirty is None else dirty)  # in-place edits keep the folder mtime
+        after = self.catalog.snapshot()
+
+        added = after.keys() - before.keys()
+        removed = before.keys() - after.keys()
+        changed = {q for q in after.keys() & before.keys() if after[q] != before[q]}
+        if not (added or removed or changed):
+            return
+        await reload_quizzes(added | changed, removed)
+        self._applied = after
+        logger.info(f"♻️ Quizzes hot-reloaded: {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.apply()
+            except Exception as e:
+                logger.error(f"❌ Quiz folder poll failed: {e}")
+
+quiz_watcher = QuizWatcher(quiz_catalog, WATCH_DEBOUNCE_SECONDS, WATCH_POLL_SECONDS)
+
+def format_time(seconds: float) -> str:
+    """Formats seconds into MM:SS string."""
+    minutes = int(seconds // 60)
+    seconds = int(seconds % 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+def has_calculator_emoji(question_text: str) -> bool:
+    """Check if question needs calculator (has 🧮 emoji)"""
+    return "🧮" in question_text
+
+async def send_message_robust(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup=None, priority: int = None):
+    """Sends a message, handling common Telegram API errors."""
+    try:
+        return await context.bot.send_message(
+            chat_id=chat_id, 
+            text=text, 
+            reply_markup=reply_markup, 
+            parse_mode='HTML',
+            rate_limit_args=priority
+        )
+    except error.TelegramError as e:
+        logger.error(f"Failed to send message to {chat_id}: {e}")
+        return None
+
+# --- Metrics (Prometheus text format, served on /metrics) ---
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    """Latency histogram with one label; per label value: bucket counts + sum, all plain lists."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> [count per bucket..., count above last bucket, sum]
+
+    def observe(self, label_value: str, seconds: float) -> None:
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def render(self, out: list) -> None:
+        out.append(f"# HELP {self.name} {self.help_text}")
+        out.append(f"# TYPE {self.name} histogram")
+        for label_value, series in sorted(self._series.items()):
+            label = f'{self.label}="{_label_value(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                out.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += series[-2]
+            out.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            out.append(f'{self.name}_sum{{{label}}} {series[-1]:.6f}')
+            out.append(f'{self.name}_count{{{label}}} {cumulative}')
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = defaultdict(int)  # label values tuple -> count
+
+    def inc(self, *label_values) -> None:
+        self._values[label_values] += 1
+
+    def render(self, out: list) -> None:
+        out.append(f"# HELP {self.name} {self.help_text}")
+        out.append(f"# TYPE {self.name} counter")
+        for label_values, value in sorted(self._values.items()):
+            labels = ','.join(f'{k}="{_label_value(v)}"' for k, v in zip(self.labels, label_values))
+            out.append(f'{self.name}{{{labels}}} {value}')
+
+class Gauge:
+    """Read at scrape time from a callable, so nothing has to keep it up to date."""
+
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self, out: list) -> None:
+        out.append(f"# HELP {self.name} {self.help_text}")
+        out.append(f"# TYPE {self.name} gauge")
+        out.append(f"{self.name} {self.read()}")
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        out = []
+        for metric in self._metrics:
+            metric.render(out)
+        return '\n'.join(out) + '\n'
+
+metrics = MetricsRegistry()
+handler_latency = metrics.add(Histogram('quizbot_handler_seconds', 'Time spent in command and callback handlers.', 'handler'))
+handler_errors = metrics.add(Counter('quizbot_handler_errors_total', 'Exceptions raised by handlers.', ('handler',)))
+api_latency = metrics.add(Histogram('quizbot_telegram_api_seconds', 'Duration of Bot API calls (excluding rate-limit waits).', 'method'))
+api_calls = metrics.add(Counter('quizbot_telegram_api_calls_total', 'Bot API calls by outcome.', ('method', 'outcome')))
+send_wait = metrics.add(Histogram('quizbot_telegram_send_wait_seconds', 'Time Bot API calls waited for rate limits.', 'priority'))
+metrics.add(Gauge('quizbot_active_sessions', 'Quiz sessions in progress.', lambda: len(user_sessions)))
+metrics.add(Gauge('quizbot_completed_quizzes', 'Completed quizzes held in memory for review.', lambda: len(completed_quizzes)))
+metrics.add(Gauge('quizbot_pending_timers', 'Timed quizzes with pending deadlines.', lambda: len(quiz_timers)))
+
+def instrumented(name: str, handler):
+    """Wrap a handler so its latency and errors are recorded under `name`."""
+    @functools.wraps(handler)
+    async def wrapper(update, context, *args):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context, *args)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(name, time.perf_counter() - started)
+    return wrapper
+
+# --- Outbound Dispatch (Telegram rate limits) ---
+
+SEND_PRIORITY_ALERT = 0     # timer warnings and time-up results
+SEND_PRIORITY_DEFAULT = 1   # everything else
+
+class TokenBucket:
+    """Reservation-style token bucket: taking a token may drive the balance negative, and the
+    caller waits out the deficit, so concurrent callers queue up in order without polling."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self, now: float) -> float:
+        """Take one token; returns how many seconds to wait before using it."""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def hold_off(self, now: float, seconds: float) -> None:
+        """Hand out nothing for the next `seconds` (Telegram said retry_after)."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) + 1 - seconds * self.rate
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+def retry_after_seconds(exc: error.RetryAfter) -> float:
+    delay = exc.retry_after
+    return delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+
+class OutboundDispatcher(BaseRateLimiter):
+    """
+    🚦 Paces every chat-bound Bot API call (send, edit, ...) under Telegram's flood limits.
+    Each call first waits for its chat's bucket (private chats ~1/s with small bursts,
+    groups ~20/min), then queues for the global bucket (~30/s), which is handed out
+    in priority order (`rate_limit_args`, lower first), so timer alerts jump the queue.
+    A 429 holds the chat back for retry_after and the call is retried.
+    Calls without a chat (answerCallbackQuery, setWebhook, ...) go straight through.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int, group_rate: float, max_retries: int):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}  # chat_id -> TokenBucket
+        self._prune_at = 1024
+        self._queue = []  # heap of (priority, seq, future) waiting for a global token
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def initialize(self) -> None:
+        # Called by both Application.initialize and Updater.initialize (via ExtBot): start one pump only
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+
+    async def shutdown(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Let anything still queued go out unpaced rather than hang
+        for _, _, waiter in self._queue:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._queue.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._prune_at:
+                now = time.monotonic()
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle(now)}
+                self._prune_at = max(1024, 2 * len(self._chats))
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            bucket = self._chats[chat_id] = (
+                TokenBucket(self.group_rate, 1) if is_group else TokenBucket(self.chat_rate, self.chat_burst)
+            )
+        return bucket
+
+    async def _wait_turn(self, chat_id, priority: int) -> None:
+        delay = self._chat_bucket(chat_id).reserve(time.monotonic())
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self._task is None:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+        self._wakeup.set()
+        await waiter
+
+    async def _pump(self) -> None:
+        while True:
+            if not self._queue:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            delay = self._global.reserve(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Pop after the wait, so a higher-priority call that arrived meanwhile goes first
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+    async def _call(self, callback, args, kwargs, endpoint: str):
+        started = time.perf_counter()
+        try:
+            result = await callback(*args, **kwargs)
+        except error.RetryAfter:
+            api_calls.inc(endpoint, 'retry_after')
+            raise
+        except Exception:
+            api_calls.inc(endpoint, 'error')
+            raise
+        finally:
+            api_latency.observe(endpoint, time.perf_counter() - started)
+        api_calls.inc(endpoint, 'ok')
+        return result
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await self._call(callback, args, kwargs, endpoint)
+
+        priority = SEND_PRIORITY_DEFAULT if rate_limit_args is None else rate_limit_args
+        for attempt in range(self.max_retries + 1):
+            queued = time.perf_counter()
+            await self._wait_turn(chat_id, priority)
+            send_wait.observe(str(priority), time.perf_counter() - queued)
+            try:
+                return await self._call(callback, args, kwargs, endpoint)
+            except error.RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_after_seconds(e)
+                logger.warning(f"🚧 Flood control on {endpoint} for chat {chat_id}: retrying in {delay:.0f}s")
+                self._chat_bucket(chat_id).hold_off(time.monotonic(), delay)
+
+class MessageStateTracker:
+    """
+    ✏️ Remembers a hash of the text and keyboard last shown in each bot message, so an edit
+    can be skipped when nothing changed (no round trip just to get "message is not modified"),
+    or sent as editMessageReplyMarkup when only the buttons changed (MSQ toggles, clear).
+    Kept as an LRU of (chat_id, message_id) -> (text hash, markup hash).
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._shown = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._shown)
+
+    async def edit(self, message, text: str, reply_markup=None, parse_mode=None):
+        key = (message.chat_id, message.message_id)
+        state = (hash(text), hash(reply_markup))
+        shown = self._shown.get(key)
+        try:
+            if shown == state:
+                self._shown.move_to_end(key)
+                return message
+            if shown is not None and shown[0] == state[0]:
+                result = await message.edit_reply_markup(reply_markup=reply_markup)
+            else:
+                result = await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        except error.BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                self._shown.pop(key, None)  # unsure what is shown now
+                raise
+            result = message
+        self._shown[key] = state
+        self._shown.move_to_end(key)
+        if len(self._shown) > self.maxsize:
+            self._shown.popitem(last=False)
+        return result
+
+message_states = MessageStateTracker(MESSAGE_STATE_CACHE_SIZE)
+
+# --- Quiz Sessions ---
+
+class QuizSession:
+    """
+    One running quiz, kept small because there is one per active user.
+    Questions are global ids into question_registry; answers hold one option
+    bitmask per question (0 = unanswered; MCQ sets a single bit, MSQ any subset).
+    """
+
+    __slots__ = ('qids', 'answers', 'current', 'started', 'mode', 'quiz_id', 'chat_id', 'is_finished')
+
+    def __init__(self, qids: array, mode: str, quiz_id: str, chat_id: int):
+        self.qids = qids
+        self.answers = bytearray(len(qids))
+        self.current = 0
+        self.started = time.monotonic()
+        self.mode = sys.intern(mode)
+        self.quiz_id = quiz_id
+        self.chat_id = chat_id
+        self.is_finished = False
+
+    @property
+    def is_timed(self) -> bool:
+        return QUIZ_MODES[self.mode]['timed']
+
+    @property
+    def time_limit(self) -> int:
+        return QUIZ_MODES[self.mode].get('time_limit', 0)
+
+    @property
+    def instant_feedback(self) -> bool:
+        return QUIZ_MODES[self.mode]['feedback']
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def __len__(self) -> int:
+        return len(self.qids)
+
+# --- Persistent Storage (SQLite, WAL) ---
+
+def open_database(path: str) -> sqlite3.Connection:
+    """Open the bot database in WAL mode. synchronous=NORMAL: commits don't fsync, checkpoints do."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+class WriteBehindStore:
+    """
+    Base for SQLite tables written from the event loop without blocking it.
+    Changes are queued per key (a newer change replaces an older one) and a background
+    task commits everything queued in one transaction every flush_interval seconds.
+    """
+
+    max_pending = 500  # flush early once this many keys are waiting
+
+    def __init__(self, path: str, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._conn = open_database(path)
+        self._pending = {}
+        self._flushing = {}  # batch being committed right now: still readable through _queued()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._writing = None  # task committing the current batch; outlives a cancelled flush()
+
+    def _queue(self, key, change) -> None:
+        self._pending[key] = change
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    def _merge(self, older, newer):
+        """One change equivalent to older followed by newer. Rows are full snapshots, so newer wins."""
+        return newer
+
+    def _queued(self, key):
+        """Newest change for key that may not be committed yet (queued or being flushed), or None."""
+        change = self._pending.get(key)
+        return change if change is not None else self._flushing.get(key)
+
+    def _apply(self, changes: list) -> None:
+        """Write a batch of (key, change) pairs; runs inside a transaction in a worker thread."""
+        raise NotImplementedError
+
+    def _write_batch(self, changes: list) -> None:
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._apply(changes)
+
+    async def flush(self) -> None:
+        """Commit everything queued so far (in a worker thread)."""
+        while self._writing is not None:
+            await asyncio.shield(self._writing)  # batches commit in order
+        if not self._pending:
+            return
+        self._flushing, self._pending = self._pending, {}
+        self._writing = asyncio.create_task(self._commit(list(self._flushing.items())))
+        # Shielded: cancelling the caller must not abandon a batch the worker thread is still writing
+        await asyncio.shield(self._writing)
+
+    async def _commit(self, changes: list) -> None:
+        try:
+            await asyncio.to_thread(self._write_batch, changes)
+        except sqlite3.Error as e:
+            logger.error(f"❌ {type(self).__name__} flush failed ({len(changes)} change(s) re-queued): {e}")
+            for key, change in changes:
+                newer = self._pending.get(key)
+                self._pending[key] = change if newer is None else self._merge(change, newer)
+        finally:
+            self._flushing = {}
+            self._writing = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)  # let it finish before the loop closes
+            self._task = None
+        await self.flush()  # waits for a batch still in the worker thread, then writes the rest
+        self._conn.close()
+
+class LeaderboardStore(WriteBehindStore):
+    """
+    💾 Durable leaderboard on SQLite with write-behind batching.
+    finalize_quiz() only queues the user's new stats (coalesced per user); a background
+    task commits everything queued in one transaction every LEADERBOARD_FLUSH_SECONDS.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 2.0):
+        super().__init__(path, flush_interval)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS leaderboard ('
+            ' user_id INTEGER PRIMARY KEY, username TEXT NOT NULL,'
+            ' total_score INTEGER NOT NULL, total_questions INTEGER NOT NULL,'
+            ' tests_taken INTEGER NOT NULL, best_score_pct REAL NOT NULL)'
+        )
+
+    def load_into(self, board: dict) -> int:
+        """Warm-load every stored row into the in-memory leaderboard. Returns the row count."""
+        rows = self._conn.execute(
+            'SELECT user_id, username, total_score, total_questions, tests_taken, best_score_pct FROM leaderboard'
+        ).fetchall()
+        for user_id, username, total_score, total_questions, tests_taken, best_score_pct in rows:
+            board[user_id].update(
+                user_id=user_id, username=username, total_score=total_score,
+                total_questions=total_questions, tests_taken=tests_taken, best_score_pct=best_score_pct
+            )
+        return len(rows)
+
+    def queue_update(self, user_id: int, stats: dict) -> None:
+        """Schedule the user's current stats for the next batch (never blocks)."""
+        self._queue(user_id, (
+            user_id, stats['username'], stats['total_score'], stats['total_questions'],
+            stats['tests_taken'], stats['best_score_pct']
+        ))
+
+    def _apply(self, changes: list) -> None:
+        self._conn.executemany(
+            'INSERT INTO leaderboard (user_id, username, total_score, total_questions, tests_taken, best_score_pct)'
+            ' VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET'
+            ' username=excluded.username, total_score=excluded.total_score,'
+            ' total_questions=excluded.total_questions, tests_taken=excluded.tests_taken,'
+            ' best_score_pct=excluded.best_score_pct',
+            [row for _, row in changes]
+        )
+
+leaderboard_store = None  # LeaderboardStore, opened in main()
+
+class LeaderboardIndex:
+    """
+    🏆 Order-statistics index over leaderboard_data, updated incrementally by finalize_quiz().
+    Ordered by best score, then tests taken (both descending): top-10 is a slice and a
+    user's rank is one O(log n) bisect.
+    """
+
+    def __init__(self):
+        self._ranked = SortedList()
+        self._keys = {}  # user_id -> current key in _ranked
+
+    @staticmethod
+    def _key(user_id: int, stats: dict) -> tuple:
+        return (-stats['best_score_pct'], -stats['tests_taken'], user_id)
+
+    def update(self, user_id: int, stats: dict) -> None:
+        old = self._keys.get(user_id)
+        if old is not None:
+            self._ranked.remove(old)
+        key = self._key(user_id, stats)
+        self._ranked.add(key)
+        self._keys[user_id] = key
+
+    def rebuild(self, board: dict) -> None:
+        self._keys = {user_id: self._key(user_id, stats) for user_id, stats in board.items() if stats['tests_taken'] > 0}
+        self._ranked = SortedList(self._keys.values())
+
+    def top(self, n: int = 10) -> list:
+        """user_ids of the n best players."""
+        return [key[2] for key in self._ranked.islice(0, n)]
+
+    def rank(self, user_id: int):
+        """1-based global rank of user_id, or None if they haven't finished a quiz."""
+        key = self._keys.get(user_id)
+        return None if key is None else self._ranked.bisect_left(key) + 1
+
+    def __len__(self) -> int:
+        return len(self._ranked)
+
+leaderboard_index = LeaderboardIndex()
+
+def pack_question_refs(qids) -> tuple:
+    """
+    Question ids -> (bank ids, array of interleaved (bank number, record index) pairs,
+    [source size, source mtime_ns] of each bank) for storage.
+    """
+    banks, refs, sources = [], array('I'), []
+    for qid in qids:
+        bank = question_registry.bank_of(qid)
+        if bank.quiz_id not in banks:
+            banks.append(bank.quiz_id)
+            sources.append([bank.source_size, bank.source_mtime_ns])
+        refs.extend((banks.index(bank.quiz_id), qid - bank.base))
+    return banks, refs, sources
+
+def resolve_question_ref(banks, refs, sources, i: int) -> int:
+    """Current question id for entry i of a stored ref list. Refuses a quiz file changed since: its records may have moved."""
+    quiz_id = banks[refs[2 * i]]
+    bank = get_question_bank(quiz_id)
+    if bank is None or refs[2 * i + 1] >= len(bank):
+        raise KeyError(quiz_id)
+    if not bank.matches(*sources[refs[2 * i]]):
+        raise KeyError(f"{quiz_id} changed since")
+    return bank.base + refs[2 * i + 1]
+
+class SessionStore(WriteBehindStore):
+    """
+    ♻️ Crash-safe snapshots of in-flight quizzes.
+    A new quiz writes its full record once (question refs as packed (bank, record) pairs);
+    later taps only rewrite `current` and `answers`. Changes are coalesced per user,
+    so a burst of taps costs one row update per flush.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        super().__init__(path, flush_interval)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            ' user_id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, quiz_id TEXT NOT NULL,'
+            ' mode TEXT NOT NULL, started_at REAL NOT NULL, current INTEGER NOT NULL,'
+            ' banks TEXT NOT NULL, refs BLOB NOT NULL, sources TEXT NOT NULL, answers BLOB NOT NULL)'
+        )
+
+    def track_new(self, user_id: int, session: 'QuizSession') -> None:
+        """Snapshot a freshly started session."""
+        banks, refs, sources = pack_question_refs(session.qids)
+        self._queue(user_id, ('new', (
+            user_id, session.chat_id, session.quiz_id, session.mode,
+            time.time() - session.elapsed(), session.current,
+            json.dumps(banks), refs.tobytes(), json.dumps(sources), bytes(session.answers)
+        )))
+
+    def track_progress(self, user_id: int, session: 'QuizSession') -> None:
+        """Record a tap (answer / navigation). Coalesces with any change still queued."""
+        change = ('progress', (session.current, bytes(session.answers), user_id))
+        pending = self._pending.get(user_id)
+        self._queue(user_id, change if pending is None else self._merge(pending, change))
+
+    def _merge(self, older, newer):
+        if older[0] == 'new' and newer[0] == 'progress':
+            # Row not written yet: refresh the full record instead of updating a missing row
+            current, answers, _ = newer[1]
+            row = older[1]
+            return ('new', row[:5] + (current,) + row[6:9] + (answers,))
+        return newer  # 'new' and 'delete' replace whatever came before
+
+    def forget(self, user_id: int) -> None:
+        self._queue(user_id, ('delete', (user_id,)))
+
+    def _apply(self, changes: list) -> None:
+        for _, (kind, row) in changes:
+            if kind == 'new':
+                self._conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+            elif kind == 'progress':
+                self._conn.execute('UPDATE sessions SET current = ?, answers = ? WHERE user_id = ?', row)
+            else:
+                self._conn.execute('DELETE FROM sessions WHERE user_id = ?', row)
+
+    def restore_into(self, sessions: dict) -> list:
+        """Rebuild stored sessions into `sessions`. Returns the restored user_ids."""
+        restored = []
+        rows = self._conn.execute(
+            'SELECT user_id, chat_id, quiz_id, mode, started_at, current, banks, refs, sources, answers FROM sessions'
+        ).fetchall()
+        for user_id, chat_id, quiz_id, mode, started_at, current, banks, refs, sources, answers in rows:
+            try:
+                if mode not in QUIZ_MODES:
+                    raise KeyError(mode)
+                banks = json.loads(banks)
+                sources = json.loads(sources)
+                pairs = array('I', refs)
+                qids = array('I', (resolve_question_ref(banks, pairs, sources, i) for i in range(len(pairs) // 2)))
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                logger.warning(f"⚠️ Dropping stored session of user {user_id}: {e}")
+                self.forget(user_id)
+                continue
+
+            session = QuizSession(qids, mode, quiz_id, chat_id)
+            session.answers[:] = answers
+            session.current = current
+            session.started = time.monotonic() - (time.time() - started_at)
+            sessions[user_id] = session
+            restored.append(user_id)
+        return restored
+
+session_store = None  # SessionStore, opened in main()
+
+class ReviewRecord:
+    """
+    A finished quiz kept for "👀 Review Answers": question refs + one answer bitmask per question.
+    While resident it also holds the played question ids, which keeps their bank alive even if the
+    quiz file is edited. Once archived only the refs remain, checked against the bank's source stats.
+    """
+
+    __slots__ = ('banks', 'refs', 'sources', 'qids', 'answers', 'score', 'total', 'score_pct', 'created_at', 'last_access')
+
+    def __init__(self, banks, refs, sources, answers: bytes, score: int, total: int, score_pct: float,
+                 created_at: float, qids: array = None):
+        self.banks = tuple(banks)
+        self.refs = refs
+        self.sources = sources
+        self.qids = qids
+        self.answers = answers
+        self.score = score
+        self.total = total
+        self.score_pct = score_pct
+        self.created_at = created_at
+        self.last_access = time.monotonic()
+
+    @classmethod
+    def from_session(cls, session: 'QuizSession', score: int, score_pct: float) -> 'ReviewRecord':
+        banks, refs, sources = pack_question_refs(session.qids)
+        return cls(banks, refs, sources, bytes(session.answers), score, len(session.qids), score_pct, time.time(),
+                   session.qids)
+
+    def question(self, i: int) -> Question:
+        if self.qids is not None:
+            return question_registry.get(self.qids[i])
+        return question_registry.get(resolve_question_ref(self.banks, self.refs, self.sources, i))
+
+    def nbytes(self) -> int:
+        """Approximate resident size, for the memory budget."""
+        qids = len(self.qids) * self.qids.itemsize if self.qids is not None else 0
+        return 200 + len(self.refs) * self.refs.itemsize + qids + len(self.answers)
+
+class ReviewArchive(WriteBehindStore):
+    """On-disk home of reviews evicted from memory. Rows older than REVIEW_DISK_TTL are purged."""
+
+    def __init__(self, path: str, flush_interval: float = 2.0, retention: float = 7 * 24 * 3600):
+        super().__init__(path, flush_interval)
+        self.retention = retention
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS reviews ('
+            ' quiz_key TEXT PRIMARY KEY, created_at REAL NOT NULL, score INTEGER NOT NULL,'
+            ' total INTEGER NOT NULL, score_pct REAL NOT NULL,'
+            ' banks TEXT NOT NULL, refs BLOB NOT NULL, sources TEXT NOT NULL, answers BLOB NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS reviews_created_at ON reviews (created_at)')
+
+    def put(self, quiz_key: str, record: ReviewRecord) -> None:
+        self._queue(quiz_key, record)
+
+    def get(self, quiz_key: str):
+        record = self._queued(quiz_key)
+        if record is not None:
+            return record
+        row = self._conn.execute(
+            'SELECT banks, refs, sources, answers, score, total, score_pct, created_at FROM reviews'
+            ' WHERE quiz_key = ? AND created_at >= ?', (quiz_key, time.time() - self.retention)
+        ).fetchone()
+        if row is None:
+            return None
+        banks, refs, sources, answers, score, total, score_pct, created_at = row
+        return ReviewRecord(json.loads(banks), array('I', refs), json.loads(sources), answers, score, total, score_pct,
+                            created_at)
+
+    def _apply(self, changes: list) -> None:
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(key, r.created_at, r.score, r.total, r.score_pct, json.dumps(r.banks), r.refs.tobytes(),
+              json.dumps(r.sources), r.answers)
+             for key, r in changes]
+        )
+        self._conn.execute('DELETE FROM reviews WHERE created_at < ?', (time.time() - self.retention,))
+
+class ReviewStore:
+    """
+    👀 Bounded home of completed quizzes for review.
+    Keeps only question refs + packed answers, within a memory budget and an idle TTL
+    (LRU order). Evicted reviews spill to the ReviewArchive, so recent quizzes stay
+    reviewable while resident memory stays flat.
+    """
+
+    def __init__(self, memory_budget: int, ttl: float):
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self.archive = None  # ReviewArchive, attached in main(); without it evicted reviews are dropped
+        self._entries = OrderedDict()  # quiz_key -> ReviewRecord, least recently used first
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _insert(self, quiz_key: str, record: ReviewRecord) -> None:
+        old = self._entries.pop(quiz_key, None)
+        if old is not None:
+            self._bytes -= old.nbytes()
+        record.last_access = time.monotonic()
+        self._entries[quiz_key] = record
+        self._bytes += record.nbytes()
+        self._evict()
+
+    def __setitem__(self, quiz_key: str, record: ReviewRecord) -> None:
+        self._insert(quiz_key, record)
+
+    def _evict(self) -> None:
+        expire_before = time.monotonic() - self.ttl
+        while self._entries:
+            quiz_key, oldest = next(iter(self._entries.items()))
+            if self._bytes <= self.memory_budget and oldest.last_access >= expire_before:
+                break
+            del self._entries[quiz_key]
+            self._bytes -= oldest.nbytes()
+            oldest.qids = None  # from here on it goes through refs + source stats
+            if self.archive:
+                self.archive.put(quiz_key, oldest)
+
+    def get(self, quiz_key: str):
+        """The ReviewRecord for quiz_key (from memory or disk), or None if it expired."""
+        record = self._entries.get(quiz_key)
+        if record is not None:
+            record.last_access = time.monotonic()
+            self._entries.move_to_end(quiz_key)
+            return record
+        if self.archive:
+            record = self.archive.get(quiz_key)
+            if record is not None:
+                self._insert(quiz_key, record)  # hot again
+            return record
+        return None
+
+    def resident_qids(self):
+        """Question id arrays of the reviews held in memory (they pin their banks)."""
+        return (record.qids for record in self._entries.values() if record.qids is not None)
+
+    def spill_all(self) -> None:
+        """Queue every resident review for the archive (used on shutdown)."""
+        if self.archive:
+            for quiz_key, record in self._entries.items():
+                self.archive.put(quiz_key, record)
+
+completed_quizzes = ReviewStore(REVIEW_MEMORY_BUDGET, REVIEW_MEMORY_TTL)  # Store completed quiz data for review
+
+# --- Adaptive Practice (spaced repetition) ---
+#
+# Every finished quiz updates a Leitner-style box per (user, question): a correct answer moves
+# the question up one box, a wrong or skipped one sends it back to box 1. Box b (>= 2) is due
+# again 2^(b-2) days after it was last seen. Per (user, quiz) this is stored as two flat arrays,
+# one byte (box) + two bytes (day last seen) per question, and adaptive quizzes draw from an
+# alias table over those weights: O(n) to build once per change, O(1) per draw.
+
+MASTERY_MAX_BOX = 8
+MASTERY_WEIGHT_NEW = 1.0      # never answered
+MASTERY_WEIGHT_WEAK = 4.0     # box 1: answered wrong last time
+MASTERY_WEIGHT_MIN = 0.05     # mastered and far from due, still drawable
+MASTERY_WEIGHT_MAX = 4.0      # long overdue
+
+def mastery_today() -> int:
+    return int(time.time() // 86400)
+
+class MasteryRecord:
+    """Boxes and last-seen days of one user's questions in one quiz, indexed by record."""
+
+    __slots__ = ('boxes', 'seen', 'version')
+
+    def __init__(self, boxes: bytes = b'', seen: bytes = b''):
+        self.boxes = bytearray(boxes)
+        self.seen = array('H')
+        self.seen.frombytes(seen)
+        self.version = 0
+
+    def nbytes(self) -> int:
+        return 100 + len(self.boxes) + len(self.seen) * self.seen.itemsize
+
+    def fit(self, count: int) -> None:
+        """Follow the bank's size after it was edited (new records start as never seen)."""
+        if len(self.boxes) < count:
+            self.boxes.extend(bytes(count - len(self.boxes)))
+            self.seen.extend(bytes(count - len(self.seen)))
+        elif len(self.boxes) > count:
+            del self.boxes[count:]
+            del self.seen[count:]
+
+    def weights(self, today: int) -> list:
+        weights = []
+        for box, seen in zip(self.boxes, self.seen):
+            if box == 0:
+                weights.append(MASTERY_WEIGHT_NEW)
+            elif box == 1:
+                weights.append(MASTERY_WEIGHT_WEAK)
+            else:
+                overdue = (today - seen) / (1 << (box - 2))
+                weights.append(min(MASTERY_WEIGHT_MAX, max(MASTERY_WEIGHT_MIN, overdue)))
+        return weights
+
+class AliasTable:
+    """Walker/Vose alias table: O(1) weighted draws. Stored as float32 + uint32 arrays."""
+
+    __slots__ = ('prob', 'alias', 'count')
+
+    def __init__(self, weights: list):
+        n = self.count = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.prob = array('f', bytes(4 * n))
+        self.alias = array('I', bytes(4 * n))
+        small = [i for i, s in enumerate(scaled) if s < 1.0]
+        large = [i for i, s in enumerate(scaled) if s >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] += scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:  # leftovers are 1.0 up to rounding
+            self.prob[i] = 1.0
+
+    def nbytes(self) -> int:
+        return 100 + len(self.prob) * self.prob.itemsize + len(self.alias) * self.alias.itemsize
+
+    def draw(self) -> int:
+        u = random.random() * self.count
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+class MasteryStore(WriteBehindStore):
+    """💾 One row per (user, quiz): a box byte and a uint16 last-seen day per question, as two blobs indexed by record."""
+
+    def __init__(self, path: str, flush_interval: float = 5.0):
+        super().__init__(path, flush_interval)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS mastery ('
+            ' user_id INTEGER NOT NULL, quiz_id TEXT NOT NULL, boxes BLOB NOT NULL, seen BLOB NOT NULL,'
+            ' PRIMARY KEY (user_id, quiz_id))'
+        )
+
+    def get(self, user_id: int, quiz_id: str):
+        """(boxes, seen) bytes or None."""
+        row = self._queued((user_id, quiz_id))
+        if row is not None:
+            return row
+        return self._conn.execute(
+            'SELECT boxes, seen FROM mastery WHERE user_id = ? AND quiz_id = ?', (user_id, quiz_id)
+        ).fetchone()
+
+    def queue_update(self, user_id: int, quiz_id: str, record: MasteryRecord) -> None:
+        self._queue((user_id, quiz_id), (bytes(record.boxes), record.seen.tobytes()))
+
+    def _apply(self, changes: list) -> None:
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO mastery (user_id, quiz_id, boxes, seen) VALUES (?, ?, ?, ?)',
+            [(user_id, quiz_id, boxes, seen) for (user_id, quiz_id), (boxes, seen) in changes]
+        )
+
+class MasteryTracker:
+    """
+    🧬 Mastery of every user over every question they've answered, for adaptive quizzes.
+    Records and alias tables of recently active (user, quiz) pairs share one LRU capped by
+    bytes (both grow with the bank, so a count cap says nothing about memory);
+    the rest live in the MasteryStore.
+    """
+
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self.store = None             # MasteryStore, opened in main()
+        self._cache = OrderedDict()   # ('record' | 'table', user_id, quiz_id) -> (nbytes, value), least recently used first
+        self._bytes = 0
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    def _cache_put(self, key, value, nbytes: int) -> None:
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._bytes -= old[0]
+        self._cache[key] = (nbytes, value)
+        self._bytes += nbytes
+        while self._bytes > self.memory_budget and len(self._cache) > 1:
+            _, (size, _) = self._cache.popitem(last=False)
+            self._bytes -= size
+
+    def record(self, user_id: int, quiz_id: str, count: int) -> MasteryRecord:
+        key = ('record', user_id, quiz_id)
+        record = self._cached(key)
+        if record is None:
+            row = self.store.get(user_id, quiz_id) if self.store else None
+            record = MasteryRecord(*row) if row else MasteryRecord()
+        record.fit(count)
+        self._cache_put(key, record, record.nbytes())
+        return record
+
+    def update(self, user_id: int, results) -> None:
+        """results: (qid, answered correctly) pairs from a finished quiz."""
+        today = mastery_today()
+        touched = {}
+        for qid, correct in results:
+            bank = live_question_bank(qid)
+            if bank is None:
+                continue
+            index = qid - bank.base
+            record = touched.get(bank.quiz_id)
+            if record is None:
+                record = touched[bank.quiz_id] = self.record(user_id, bank.quiz_id, len(bank))
+            record.boxes[index] = min(record.boxes[index] + 1 if record.boxes[index] else 2, MASTERY_MAX_BOX) if correct else 1
+            record.seen[index] = today
+        for quiz_id, record in touched.items():
+            record.version += 1
+            if self.store:
+                self.store.queue_update(user_id, quiz_id, record)
+
+    async def sample(self, user_id: int, bank: QuestionBank, k: int) -> array:
+        """Global ids of up to k distinct questions of bank, weighted towards weak and overdue ones."""
+        n = len(bank)
+        if k >= n:
+            return bank.sample(k)
+        key = ('table', user_id, bank.quiz_id)
+        record = self.record(user_id, bank.quiz_id, n)
+        today = mastery_today()
+        cached = self._cached(key)
+        if cached and cached[0] is bank and cached[1] == record.version and cached[2] == today:
+            table = cached[3]
+        else:
+            snapshot = MasteryRecord(bytes(record.boxes), record.seen.tobytes())
+            table = await asyncio.to_thread(lambda: AliasTable(snapshot.weights(today)))
+            self._cache_put(key, (bank, record.version, today, table), table.nbytes())
+
+        # Weights too lopsided to find k distinct ones quickly: top up uniformly
+        draws = itertools.chain(((bank, table.draw()) for _ in range(20 * k)), ((bank, i) for i in permuted(n)))
+        picked = sample_distinct(draws, k)
+        random.shuffle(picked)
+        return picked
+
+mastery = MasteryTracker(MASTERY_MEMORY_BUDGET)
+
+# --- Seen Questions (roaring-style bitsets) ---
+#
+# Every user gets, per quiz, the set of record indices they've already been asked. Regular
+# quizzes draw only unseen questions until the quiz is exhausted, then the set starts over.
+# Sets are kept encoded (a few bytes per seen question) and only decoded to sample or update.
+
+ROARING_ARRAY_MAX = 4096  # entries above which a 2-byte-per-entry chunk is no smaller than a bitmap
+ROARING_BITMAP_BYTES = 8192
+ROARING_CHUNK = struct.Struct('<HH')  # chunk key (index >> 16), cardinality - 1
+
+class SeenSet:
+    """
+    Roaring-style set of record indices. Indices are split into 65536-wide chunks; a chunk is a
+    sorted uint16 array while it holds up to ROARING_ARRAY_MAX entries and an 8 KiB bitmap after.
+    """
+
+    __slots__ = ('_chunks', 'count')
+
+    def __init__(self):
+        self._chunks = {}  # index >> 16 -> array('H') or bytearray bitmap
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, index: int) -> bool:
+        chunk = self._chunks.get(index >> 16)
+        if chunk is None:
+            return False
+        low = index & 0xFFFF
+        if isinstance(chunk, array):
+            j = bisect_left(chunk, low)
+            return j < len(chunk) and chunk[j] == low
+        return bool(chunk[low >> 3] >> (low & 7) & 1)
+
+    def add(self, index: int) -> None:
+        key, low = index >> 16, index & 0xFFFF
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            chunk = self._chunks[key] = array('H')
+        if isinstance(chunk, array):
+            j = bisect_left(chunk, low)
+            if j < len(chunk) and chunk[j] == low:
+                return
+            if len(chunk) < ROARING_ARRAY_MAX:
+                chunk.insert(j, low)
+                self.count += 1
+                return
+            bitmap = self._chunks[key] = bytearray(ROARING_BITMAP_BYTES)
+            for value in chunk:
+                bitmap[value >> 3] |= 1 << (value & 7)
+            chunk = bitmap
+        if not chunk[low >> 3] >> (low & 7) & 1:
+            chunk[low >> 3] |= 1 << (low & 7)
+            self.count += 1
+
+    def clear(self) -> None:
+        self._chunks = {}
+        self.count = 0
+
+    def to_bytes(self) -> bytes:
+        out = bytearray()
+        for key in sorted(self._chunks):
+            chunk = self._chunks[key]
+            if isinstance(chunk, array):
+                if chunk:
+                    out += ROARING_CHUNK.pack(key, len(chunk) - 1) + chunk.tobytes()
+            else:
+                out += ROARING_CHUNK.pack(key, int.from_bytes(chunk, 'little').bit_count() - 1) + chunk
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'SeenSet':
+        seen = cls()
+        at = 0
+        while at < len(data):
+            key, cardinality = ROARING_CHUNK.unpack_from(data, at)
+            cardinality += 1
+            at += ROARING_CHUNK.size
+            if cardinality <= ROARING_ARRAY_MAX:
+                chunk = array('H')
+                chunk.frombytes(data[at:at + 2 * cardinality])
+                at += 2 * cardinality
+            else:
+                chunk = bytearray(data[at:at + ROARING_BITMAP_BYTES])
+                at += ROARING_BITMAP_BYTES
+            seen._chunks[key] = chunk
+            seen.count += cardinality
+        return seen
+
+class SeenStore(WriteBehindStore):
+    """💾 One row per (user, quiz): the SeenSet of records already asked, in its compact chunked encoding."""
+
+    def __init__(self, path: str, flush_interval: float = 5.0):
+        super().__init__(path, flush_interval)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen_questions ('
+            ' user_id INTEGER NOT NULL, quiz_id TEXT NOT NULL, seen BLOB NOT NULL,'
+            ' PRIMARY KEY (user_id, quiz_id))'
+        )
+
+    def get(self, user_id: int, quiz_id: str):
+        """Encoded set or None."""
+        data = self._queued((user_id, quiz_id))
+        if data is not None:
+            return data
+        row = self._conn.execute(
+            'SELECT seen FROM seen_questions WHERE user_id = ? AND quiz_id = ?', (user_id, quiz_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def queue_update(self, user_id: int, quiz_id: str, data: bytes) -> None:
+        self._queue((user_id, quiz_id), data)
+
+    def _apply(self, changes: list) -> None:
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO seen_questions (user_id, quiz_id, seen) VALUES (?, ?, ?)',
+            [(user_id, quiz_id, data) for (user_id, quiz_id), data in changes]
+        )
+
+class SeenTracker:
+    """
+    👁️ Which questions each user has already been asked, per quiz.
+    Recently used sets stay in a bounded LRU in their encoded form; the rest live in the SeenStore.
+    """
+
+    def __init__(self, cache_size: int):
+        self.cache_size = cache_size
+        self.store = None             # SeenStore, opened in main()
+        self._sets = OrderedDict()    # (user_id, quiz_id) -> encoded SeenSet
+
+    def get(self, user_id: int, quiz_id: str) -> SeenSet:
+        data = self._sets.get((user_id, quiz_id))
+        if data is None and self.store:
+            data = self.store.get(user_id, quiz_id)
+        return SeenSet.from_bytes(data) if data else SeenSet()
+
+    def put(self, user_id: int, quiz_id: str, seen: SeenSet) -> None:
+        key = (user_id, quiz_id)
+        data = self._sets[key] = seen.to_bytes()
+        self._sets.move_to_end(key)
+        if len(self._sets) > self.cache_size:
+            self._sets.popitem(last=False)
+        if self.store:
+            self.store.queue_update(user_id, quiz_id, data)
+
+    def update(self, user_id: int, qids) -> None:
+        """Mark the questions of a finished quiz as seen."""
+        touched = defaultdict(list)
+        for qid in qids:
+            bank = live_question_bank(qid)
+            if bank is not None:
+                touched[bank.quiz_id].append(qid - bank.base)
+        for quiz_id, indices in touched.items():
+            seen = self.get(user_id, quiz_id)
+            for index in indices:
+                seen.add(index)
+            self.put(user_id, quiz_id, seen)
+
+    def sample(self, user_id: int, bank: QuestionBank, k: int) -> array:
+        """Up to k questions of bank this user hasn't seen; once they run out, the cycle starts over."""
+        n = len(bank)
+        if n == 0:
+            return array('I')
+        seen = self.get(user_id, bank.quiz_id)
+        if len(seen) >= n:
+            seen.clear()
+            self.put(user_id, bank.quiz_id, seen)
+        draws = itertools.chain(
+            ((bank, i) for i in (random.randrange(n) for _ in range(4 * k + 16)) if i not in seen),
+            ((bank, i) for i in permuted(n) if i not in seen))
+        picked = sample_distinct(draws, min(k, n))
+        if len(picked) < min(k, n):
+            # Quiz exhausted: finish with the last unseen ones, then start a new cycle
+            seen.clear()
+            self.put(user_id, bank.quiz_id, seen)
+            draws = itertools.chain(((bank, q - bank.base) for q in picked), ((bank, i) for i in permuted(n)))
+            picked = sample_distinct(draws, min(k, n))
+            random.shuffle(picked)
+        return picked
+
+seen_questions = SeenTracker(SEEN_CACHE_SIZE)
+
+async def pick_questions(user_id: int, bank: QuestionBank, mode_key: str) -> array:
+    """Questions for a new quiz on bank: weighted by the user's mastery in adaptive modes, otherwise unseen ones first."""
+    num_q = QUIZ_MODES[mode_key]['num_q']
+    if QUIZ_MODES[mode_key].get('adaptive'):
+        return await mastery.sample(user_id, bank, num_q)
+    return seen_questions.sample(user_id, bank, num_q)
+
+def session_changed(user_id: int) -> None:
+    """Call after every answer / navigation change to a running session."""
+    if session_store and user_id in user_sessions:
+        session_store.track_progress(user_id, user_sessions[user_id])
+
+# --- Callback Data Codec ---
+# callback_data is capped at 64 bytes by Telegram, so buttons carry a compact binary payload:
+# version byte, opcode byte, then varint arguments, base64url-encoded without padding.
+# Quiz ids are interned to small integers; review keys travel as their (user_id, timestamp) parts.
+
+CALLBACK_VERSION = 1
+
+OP_MODE_MENU = 1     # ()                        mode menu ("Start New Quiz", "Back to Modes")
+OP_TOPIC_MENU = 2    # ()                        topic menu ("Choose Topic Instead")
+OP_MODE_SELECT = 3   # (mode index)
+OP_TOPIC_SELECT = 4  # (quiz ref)
+OP_RANDOM_MIX = 5    # ()
+OP_QUIZ_START = 6    # (quiz ref[, mode index])
+OP_QUIZ = 7          # (quiz action[, option])  buttons of a running quiz
+OP_REVIEW = 8        # (user_id, timestamp, question index)
+OP_BROWSE = 9        # (folder ref, page[, mode index])  quiz browser
+OP_SEARCH_HIT = 10   # (quiz ref, record index)          /search result
+
+QUIZ_ANSWER, QUIZ_CLEAR, QUIZ_PREV, QUIZ_NEXT, QUIZ_SUBMIT = range(5)
 
-# --- Utility Functions ---
+# Modes travel as their position in QUIZ_MODES: add new modes at the end
+MODE_KEYS = list(QUIZ_MODES)
 
-def load_questions_from_file(quiz_id: str) -> list:
+def _pack_varint(value: int, out: bytearray) -> None:
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def encode_callback(op: int, *args: int) -> str:
+    out = bytearray((CALLBACK_VERSION, op))
+    for value in args:
+        _pack_varint(value, out)
+    return base64.urlsafe_b64encode(out).rstrip(b'=').decode('ascii')
+
+def decode_callback(data: str):
+    """Returns (op, args), or None for anything this version didn't produce (e.g. pre-upgrade buttons)."""
+    try:
+        raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    except (ValueError, TypeError):
+        return None
+    if len(raw) < 2 or raw[0] != CALLBACK_VERSION:
+        return None
+    args = []
+    value = shift = 0
+    for byte in raw[2:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            args.append(value)
+            value = shift = 0
+    if shift:
+        return None  # truncated varint
+    return raw[1], tuple(args)
+
+class CallbackIds:
     """
-    Loads questions from a JSON file using the full relative path stored in quiz_id.
-    FIXED: Now handles spaces in folder names correctly.
+    🔢 Interns quiz ids as small integers for callback data. The table lives in SQLite once
+    open() is called, so buttons already sitting in chats keep working across restarts.
     """
-    try:
-        # Handle both forward slashes and backslashes
-        quiz_id_normalized = quiz_id.replace('\\', '/')
-        file_path = os.path.join(QUIZ_DATA_DIR, f'{quiz_id_normalized}.json')
-        
-        logger.info(f"🔍 Attempting to load: {file_path}")
-        
-        if not os.path.exists(file_path):
-            logger.error(f"❌ Quiz file not found: {file_path}")
-            logger.info(f"📁 Current directory: {os.getcwd()}")
-            logger.info(f"📂 Looking for file at: {os.path.abspath(file_path)}")
-            return []
-            
-        with open(file_path, 'r', encoding='utf-8') as f:
-            questions = json.load(f)
-            logger.info(f"✅ Successfully loaded {len(questions)} questions from {quiz_id}")
-            return questions
-    except Exception as e:
-        logger.error(f"❌ Error loading questions for {quiz_id}: {e}")
-        return []
 
-def get_available_quizzes() -> dict:
+    def __init__(self):
+        self._ids = {}    # quiz_id -> ref
+        self._names = {}  # ref -> quiz_id
+        self._conn = None
+
+    def open(self, path: str) -> None:
+        self._conn = open_database(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS callback_ids (ref INTEGER PRIMARY KEY, quiz_id TEXT UNIQUE NOT NULL)")
+        for ref, quiz_id in self._conn.execute("SELECT ref, quiz_id FROM callback_ids"):
+            self._ids[quiz_id] = ref
+            self._names[ref] = quiz_id
+        # Refs handed out before open() (none in normal startup) get persisted too
+        self._conn.executemany("INSERT OR IGNORE INTO callback_ids (ref, quiz_id) VALUES (?, ?)",
+                               [(ref, quiz_id) for ref, quiz_id in self._names.items()])
+        self._conn.commit()
+
+    def intern(self, quiz_id: str) -> int:
+        ref = self._ids.get(quiz_id)
+        if ref is None:
+            ref = max(self._names, default=0) + 1
+            self._ids[quiz_id] = ref
+            self._names[ref] = quiz_id
+            if self._conn:
+                # Once per quiz, ever: cheap enough to write through
+                self._conn.execute("INSERT INTO callback_ids (ref, quiz_id) VALUES (?, ?)", (ref, quiz_id))
+                self._conn.commit()
+        return ref
+
+    def quiz_id(self, ref: int):
+        return self._names.get(ref)
+
+    def close(self) -> None:
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+callback_ids = CallbackIds()
+
+def quiz_start_data(quiz_id: str, mode_key: str = None) -> str:
+    if mode_key is None:
+        return encode_callback(OP_QUIZ_START, callback_ids.intern(quiz_id))
+    return encode_callback(OP_QUIZ_START, callback_ids.intern(quiz_id), MODE_KEYS.index(mode_key))
+
+def topic_select_data(quiz_id: str) -> str:
+    return encode_callback(OP_TOPIC_SELECT, callback_ids.intern(quiz_id))
+
+def browse_data(rel_dir: str, page: int, mode_key: str = None) -> str:
+    # Folders share the quiz id table; the trailing '/' keeps them apart from quiz ids
+    ref = callback_ids.intern(f"{rel_dir}/")
+    if mode_key is None:
+        return encode_callback(OP_BROWSE, ref, page)
+    return encode_callback(OP_BROWSE, ref, page, MODE_KEYS.index(mode_key))
+
+def search_hit_data(quiz_id: str, record: int) -> str:
+    return encode_callback(OP_SEARCH_HIT, callback_ids.intern(quiz_id), record)
+
+def review_data(quiz_key: str, q_index: int) -> str:
+    user_id, stamp = quiz_key.split('_')
+    return encode_callback(OP_REVIEW, int(user_id), int(stamp), q_index)
+
+CB_MODE_MENU = encode_callback(OP_MODE_MENU)
+CB_TOPIC_MENU = encode_callback(OP_TOPIC_MENU)
+CB_RANDOM_MIX = encode_callback(OP_RANDOM_MIX)
+CB_QUIZ_CLEAR = encode_callback(OP_QUIZ, QUIZ_CLEAR)
+CB_QUIZ_PREV = encode_callback(OP_QUIZ, QUIZ_PREV)
+CB_QUIZ_NEXT = encode_callback(OP_QUIZ, QUIZ_NEXT)
+CB_QUIZ_SUBMIT = encode_callback(OP_QUIZ, QUIZ_SUBMIT)
+CB_MODE_SELECT = [encode_callback(OP_MODE_SELECT, i) for i in range(len(MODE_KEYS))]
+CB_ANSWER = [encode_callback(OP_QUIZ, QUIZ_ANSWER, i) for i in range(MAX_OPTIONS)]
+
+def mode_menu_keyboard() -> InlineKeyboardMarkup:
+    keyboard = [[InlineKeyboardButton(QUIZ_MODES[mode_key]['label'], callback_data=CB_MODE_SELECT[i])]
+                for i, mode_key in enumerate(MODE_KEYS)]
+    keyboard.append([InlineKeyboardButton("➡️ Choose Topic Instead", callback_data=CB_TOPIC_MENU)])
+    return InlineKeyboardMarkup(keyboard)
+
+def browse_menu(node: FolderNode, page: int, mode_key: str = None):
     """
-    🔥 FULLY AUTOMATIC - NO HARDCODING REQUIRED!
-    Scans the QUIZ_DATA_DIR recursively and handles spaces in folder names.
-    Returns a dict of available quizzes {relative_path_id: label}.
+    (text, keyboard) for one page of a folder in the quiz browser.
+    Only the BROWSE_PAGE_SIZE entries on screen get buttons, so any catalog size fits in a message.
     """
-    available = {}
-    try:
-        if not os.path.exists(QUIZ_DATA_DIR):
-            os.makedirs(QUIZ_DATA_DIR, exist_ok=True)
-            logger.warning(f"Created questions directory: {QUIZ_DATA_DIR}")
-            
-        logger.info(f"📂 Scanning directory: {os.path.abspath(QUIZ_DATA_DIR)}")
-        
-        # Recursive scan with better logging
-        for root, dirs, files in os.walk(QUIZ_DATA_DIR):
-            logger.info(f"📁 Checking folder: {root}")
-            
-            for filename in files:
-                if filename.endswith('.json') and not filename.startswith('_'):
-                    full_path = os.path.join(root, filename)
-                    
-                    # Create the relative path ID
-                    relative_path = os.path.relpath(full_path, QUIZ_DATA_DIR)
-                    quiz_id = relative_path[:-5]  # Remove '.json'
-                    
-                    # Normalize path separators for consistency (use forward slash)
-                    quiz_id = quiz_id.replace(os.path.sep, '/')
-                    
-                    logger.info(f"✅ Found quiz: {quiz_id}")
-                    
-                    # Create a user-friendly label
-                    parts = quiz_id.split('/')
-                    
-                    # Use last 3 parts for label or all if less than 3
-                    display_parts = parts[-3:] if len(parts) >= 3 else parts
-                    
-                    # Capitalize and make it readable
-                    label = " | ".join([p.replace('_', ' ').title() for p in display_parts])
-                    
-                    # Prepend an icon based on the top-level folder or filename
-                    top_folder = parts[0].lower() if len(parts) > 1 else filename.lower()
-                    
-                    if 'gate' in top_folder and 'pyq' in top_folder:
-                        label = "📖 " + label
-                    elif 'mock' in top_folder:
-                        label = "🧠 " + label
-                    elif 'pyq' in top_folder:
-                        label = "📖 " + label
-                    elif 'subject' in top_folder or 'subject_wise' in top_folder:
-                        label = "📚 " + label
-                    elif 'weekly' in top_folder or 'daily' in top_folder:
-                        label = "📅 " + label
-                    else:
-                        label = "📋 " + label
-                        
-                    available[quiz_id] = label
-                    logger.info(f"   Label: {label}")
-
-        logger.info(f"📊 Total quizzes found: {len(available)}")
-        
-    except Exception as e:
-        logger.error(f"❌ Error listing quizzes in {QUIZ_DATA_DIR}: {e}")
-        
-    return available
+    pages = max(1, -(-len(node.entries) // BROWSE_PAGE_SIZE))
+    page = min(page, pages - 1)
+    start = page * BROWSE_PAGE_SIZE
 
-def format_time(seconds: float) -> str:
-    """Formats seconds into MM:SS string."""
-    minutes = int(seconds // 60)
-    seconds = int(seconds % 60)
-    return f"{minutes:02d}:{seconds:02d}"
+    keyboard = []
+    for is_folder, item_id, label in node.entries[start:start + BROWSE_PAGE_SIZE]:
+        data = browse_data(item_id, 0, mode_key) if is_folder else quiz_start_data(item_id, mode_key)
+        keyboard.append([InlineKeyboardButton(label, callback_data=data)])
 
-def has_calculator_emoji(question_text: str) -> bool:
-    """Check if question needs calculator (has 🧮 emoji)"""
-    return "🧮" in question_text
+    if pages > 1:
+        keyboard.append([
+            InlineKeyboardButton("◀️ Prev", callback_data=browse_data(node.path, (page - 1) % pages, mode_key)),
+            InlineKeyboardButton(f"📄 {page + 1}/{pages}", callback_data=browse_data(node.path, page, mode_key)),
+            InlineKeyboardButton("Next ▶️", callback_data=browse_data(node.path, (page + 1) % pages, mode_key)),
+        ])
+    if node.parent is not None:
+        keyboard.append([InlineKeyboardButton("⬆️ Up", callback_data=browse_data(node.parent, 0, mode_key))])
+    if mode_key is not None:
+        keyboard.append([InlineKeyboardButton("⬅️ Back to Modes", callback_data=CB_MODE_MENU)])
 
-async def send_message_robust(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup=None):
-    """Sends a message, handling common Telegram API errors."""
-    try:
-        return await context.bot.send_message(
-            chat_id=chat_id, 
-            text=text, 
-            reply_markup=reply_markup, 
-            parse_mode='HTML'
-        )
-    except error.TelegramError as e:
-        logger.error(f"Failed to send message to {chat_id}: {e}")
-        return None
+    if mode_key is None:
+        header = "📅 <b>Select a Test:</b>"
+    else:
+        mode_info = QUIZ_MODES[mode_key]
+        header = (f"📚 <b>Select Quiz for {mode_info['label']}</b>\n\n"
+                  f"Questions: {mode_info['num_q']}\n"
+                  f"{'⏱️ Timed: ' + format_time(mode_info.get('time_limit', 0)) if mode_info['timed'] else '⏱️ Untimed'}")
+    text = f"{header}\n\n{node.label}\n✨ {node.quiz_count} quiz(es) - automatically discovered!"
+    return text, InlineKeyboardMarkup(keyboard)
 
 # --- Command Handlers ---
 
@@ -186,11 +2730,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 Ready to test your knowledge? Choose a quiz mode or a specific topic!
 
 📚 <b>Commands:</b>
-/quiz - Select your challenge mode (Quick, Timed, Simulation)
+/quiz - Select your challenge mode (Quick, Timed, Simulation, Adaptive)
 /tests - Browse all available quizzes (Auto-discovered!)
 /topics - Focus on specific subjects (Auto-discovered!)
 /leaderboard - Top 10 rankers globally
 /mystats - Your personalized analytics
+/search &lt;words&gt; - Find questions by keyword
 /help - Complete guide and info
 /quite - exit the test
 
@@ -205,7 +2750,7 @@ Start your preparation now! 🚀"""
 
 async def special_tests(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    🔥 FULLY AUTOMATIC - Shows ALL available quizzes from subfolders.
+    🔥 FULLY AUTOMATIC - Browse ALL available quizzes folder by folder.
     NO CODE CHANGES needed when adding new quizzes!
     """
     available = get_available_quizzes()
@@ -217,35 +2762,25 @@ async def special_tests(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             "💡 <b>How to add quizzes:</b>\n"
             "1. Create a JSON file with questions\n"
             "2. Place it in the 'questions' folder or any subfolder\n"
-            "3. Restart the bot - it will appear automatically!\n\n"
+            "3. That's it - it will appear automatically within seconds!\n\n"
             "Try /quiz for mode-based quizzes.", 
             parse_mode='HTML'
         )
         return
 
-    # Sort available quizzes alphabetically by label
-    sorted_quizzes = sorted(available.items(), key=lambda item: item[1])
-    
-    keyboard = [[InlineKeyboardButton(label, callback_data=f'quiz_start_{quiz_id}')] 
-                for quiz_id, label in sorted_quizzes]
-    
+    # Paged folder browser, starting at the root (the tree is prebuilt by the catalog)
+    text, keyboard = browse_menu(quiz_catalog.folder(''), 0)
     await update.message.reply_text(
-        f"📅 <b>Select a Test:</b>\n\n✨ Found {len(available)} quiz(es) - automatically discovered!\n\n"
-        "🔥 <i>Just add new JSON files to 'questions' folder and they'll appear here!</i>",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        text + "\n\n🔥 <i>Just add new JSON files to 'questions' folder and they'll appear here!</i>",
+        reply_markup=keyboard,
         parse_mode='HTML'
     )
 
 async def quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show quiz mode selection"""
-    keyboard = [[InlineKeyboardButton(mode_data['label'], callback_data=f'mode_select_{mode_key}')] 
-                for mode_key, mode_data in QUIZ_MODES.items()]
-    
-    keyboard.append([InlineKeyboardButton("➡️ Choose Topic Instead", callback_data='topics_redirect')]) 
-    
     await update.message.reply_text(
         "🎮 <b>Select Quiz Mode:</b>\n\nChoose difficulty and type:",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=mode_menu_keyboard(),
         parse_mode='HTML'
     )
 
@@ -266,14 +2801,10 @@ async def topics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
     
-    # Separate topics (single level) from nested quizzes
-    topics_dict = {}
-    for quiz_id, label in available.items():
-        # Topics are files directly in questions folder (no subfolders)
-        if '/' not in quiz_id:
-            topics_dict[quiz_id] = label
+    # Topics are files directly in questions folder (no subfolders), already sorted
+    sorted_topics = quiz_catalog.sorted_topics()
     
-    if not topics_dict:
+    if not sorted_topics:
         await update.message.reply_text(
             "⚠️ No topics found in root folder!\n\n"
             "Topics should be JSON files directly in 'questions' folder.\n"
@@ -282,31 +2813,70 @@ async def topics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
     
-    # Sort topics alphabetically
-    sorted_topics = sorted(topics_dict.items(), key=lambda item: item[1])
-    
-    keyboard = [[InlineKeyboardButton(label, callback_data=f'topic_select_{topic_id}')] 
+    keyboard = [[InlineKeyboardButton(label, callback_data=topic_select_data(topic_id))] 
                 for topic_id, label in sorted_topics]
     
     # Add a random mix option
-    keyboard.append([InlineKeyboardButton("🎲 Random Mix (10Q)", callback_data='topic_select_random')])
+    keyboard.append([InlineKeyboardButton("🎲 Random Mix (10Q)", callback_data=CB_RANDOM_MIX)])
     
     await update.message.reply_text(
-        f'📚 <b>Choose Topic:</b>\n\n✨ Found {len(topics_dict)} topic(s) - automatically discovered!\n\n'
+        f'📚 <b>Choose Topic:</b>\n\n✨ Found {len(sorted_topics)} topic(s) - automatically discovered!\n\n'
         '🔥 <i>Add more JSON files to see them here!</i>',
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
 
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """🔍 /search <words>: find questions across every quiz and practise one."""
+    terms = ' '.join(context.args or []).strip()
+    if not terms:
+        await update.message.reply_text(
+            "🔍 <b>Search questions</b>\n\nUsage: /search &lt;words&gt;\nExample: /search tcp window",
+            parse_mode='HTML'
+        )
+        return
+
+    search_index.refresh()  # answer from the segments indexed so far
+    started = time.perf_counter()
+    hits = search_index.search(terms, SEARCH_RESULTS)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    lines, buttons = [], []
+    for quiz_id, record in hits:
+        try:
+            question = question_registry.get(search_index.segments[quiz_id].bank.base + record)
+        except KeyError:
+            continue  # bank replaced since it was indexed
+        n = len(lines) + 1
+        text = ' '.join(question.text.split())
+        snippet = text if len(text) <= 90 else text[:89] + '…'
+        lines.append(f"{n}. <b>{html.escape(quiz_label(quiz_id))}</b>\n{html.escape(snippet)}")
+        buttons.append(InlineKeyboardButton(f"▶️ {n}", callback_data=search_hit_data(quiz_id, record)))
+    if not lines:
+        await update.message.reply_text(
+            f"🔍 No questions match <b>{html.escape(terms)}</b>.\n\nTry fewer or different words.",
+            parse_mode='HTML'
+        )
+        return
+    keyboard = [buttons[i:i + 4] for i in range(0, len(buttons), 4)]
+
+    await update.message.reply_text(
+        f"🔍 <b>Results for:</b> {html.escape(terms)}\n\n" + "\n\n".join(lines) +
+        f"\n\n⚡ {len(lines)} match(es) in {elapsed_ms:.1f} ms - tap a number for a mini-quiz starting with it!",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='HTML'
+    )
+
 async def leaderboard_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show the leaderboard."""
-    sorted_board = sorted(leaderboard_data.items(), key=lambda x: x[1]['best_score_pct'], reverse=True)[:10]
+    top_users = leaderboard_index.top(10)
     
-    if not sorted_board:
+    if not top_users:
         text = "🏆 <b>Global Leaderboard</b>\n\nNo scores recorded yet! Start a quiz with /quiz."
     else:
         text = "🏆 <b>Top 10 Global Rankers:</b>\n\n"
-        for i, (user_id, data) in enumerate(sorted_board):
+        for i, user_id in enumerate(top_users):
+            data = leaderboard_data[user_id]
             text += f"{i+1}. <b>{data['username']}</b>: {data['best_score_pct']:.1f}% ({data['tests_taken']} tests)\n"
 
     await update.message.reply_text(text, parse_mode='HTML')
@@ -326,6 +2896,11 @@ async def mystats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         text += f"Total Correct Answers: <b>{stats['total_score']}</b>\n"
         text += f"Overall Average Score: <b>{avg_score:.1f}%</b>\n"
         text += f"Best Score Percentage: <b>{stats['best_score_pct']:.1f}%</b>\n"
+        
+        rank = leaderboard_index.rank(user_id)
+        if rank:
+            total = len(leaderboard_index)
+            text += f"Global Rank: <b>#{rank:,} of {total:,}</b> (top {rank / total * 100:.1f}%)\n"
 
     await update.message.reply_text(text, parse_mode='HTML')
 
@@ -335,346 +2910,404 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 # --- Internal Quiz Logic ---
 
-async def quiz_timer(user_id: int, context: ContextTypes.DEFAULT_TYPE, time_limit: int, chat_id: int) -> None:
-    """The timer function for timed quizzes."""
-    session = user_sessions.get(user_id)
-    if not session: return
+class QuizTimers:
+    """
+    ⏱️ One scheduler for every timed quiz: a heap of "one minute left" and "time up"
+    deadlines served by a single task, instead of one sleeping task per quiz.
+    Due deadlines fire together in a batch. Cancelling is O(1): the user's arm token is
+    dropped and its heap entries are skipped when they come up.
+    """
 
-    end_time = session['start_time'] + timedelta(seconds=time_limit)
-    
-    await asyncio.sleep(time_limit - 60)
-    if not session.get('is_finished') and session.get('timer_task'):
-        await send_message_robust(context, chat_id, "⏰ <b>ONE MINUTE REMAINING!</b> Submit your answers soon.")
-        
-    await asyncio.sleep(60)
-    
-    if not session.get('is_finished') and session.get('timer_task'):
-        logger.info(f"User {user_id} quiz timed out.")
-        await finalize_quiz(user_id, context, timed_out=True)
+    def __init__(self):
+        self._heap = []    # (deadline, token, user_id, kind)
+        self._armed = {}   # user_id -> token of the live deadlines
+        self._tokens = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._context = None
+        self._batches = set()  # running fire tasks (keeps references alive)
 
-async def send_question(message, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
-    """Sends the current question to the user."""
-    session = user_sessions.get(user_id)
-    if not session or session.get('is_finished'):
-        return
+    def __len__(self) -> int:
+        """Number of quizzes with pending deadlines."""
+        return len(self._armed)
 
-    q_index = session['current']
-    questions = session['questions']
-    
-    if q_index >= len(questions):
-        await finalize_quiz(user_id, context)
-        return
+    def arm(self, user_id: int, session: QuizSession) -> None:
+        """Schedule the session's deadlines from its remaining time (also used after a restart)."""
+        token = next(self._tokens)
+        self._armed[user_id] = token
+        now = time.monotonic()
+        deadline = now + max(0.0, session.time_limit - session.elapsed())
+        if deadline - 60 > now:
+            heapq.heappush(self._heap, (deadline - 60, token, user_id, 'warn'))
+        heapq.heappush(self._heap, (deadline, token, user_id, 'expire'))
+        if self._heap[0][1] == token:
+            self._wakeup.set()  # new earliest deadline
+        if len(self._heap) > 2 * len(self._armed) + 1024:
+            self._compact()
 
-    q_data = questions[q_index]
-    
-    # Determine question type from question text
-    q_type = "MCQ"
-    if q_data['q'].startswith('[MSQ]'):
-        q_type = "MSQ"
-    elif q_data['q'].startswith('[NAT]'):
-        q_type = "NAT"
-    
-    header = f"❓ <b>Question {q_index + 1}/{len(questions)}</b> [{q_type}]\n"
-    if session['is_timed']:
-        elapsed = (datetime.now() - session['start_time']).total_seconds()
-        remaining = session['time_limit'] - elapsed
-        time_display = f"⏱️ Time Left: {format_time(max(0, remaining))}\n"
-        header = f"{time_display}" + header
-        
-    question_text = f"{header}\n{q_data['q']}"
+    def cancel(self, user_id: int) -> None:
+        self._armed.pop(user_id, None)
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if self._armed.get(entry[2]) == entry[1]]
+        heapq.heapify(self._heap)
+
+    def start(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        self._context = context
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the scheduler and any batch still firing, so nothing touches the stores after they close."""
+        tasks = list(self._batches)
+        if self._task:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            delay = self._heap[0][0] - time.monotonic() if self._heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            due = []
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, token, user_id, kind = heapq.heappop(self._heap)
+                if self._armed.get(user_id) != token:
+                    continue  # cancelled or re-armed
+                if kind == 'expire':
+                    del self._armed[user_id]
+                due.append((user_id, kind))
+
+            if due:
+                batch = asyncio.create_task(self._fire(due))
+                self._batches.add(batch)
+                batch.add_done_callback(self._batches.discard)
+
+    async def _fire(self, due: list) -> None:
+        results = await asyncio.gather(*(self._fire_one(user_id, kind) for user_id, kind in due), return_exceptions=True)
+        for (user_id, kind), result in zip(due, results):
+            if isinstance(result, Exception):
+                logger.error(f"Timer '{kind}' for user {user_id} failed: {result}")
+
+    async def _fire_one(self, user_id: int, kind: str) -> None:
+        session = user_sessions.get(user_id)
+        if not session or session.is_finished:
+            return
+        if kind == 'warn':
+            await send_message_robust(self._context, session.chat_id, "⏰ <b>ONE MINUTE REMAINING!</b> Submit your answers soon.", priority=SEND_PRIORITY_ALERT)
+        else:
+            # Same lane as the user's taps, so a last-second answer and the timeout can't interleave
+            async with user_lanes.hold(user_id):
+                if session.is_finished or user_sessions.get(user_id) is not session:
+                    return
+                logger.info(f"User {user_id} quiz timed out.")
+                await finalize_quiz(user_id, self._context, timed_out=True)
+
+quiz_timers = QuizTimers()
+
+class QuestionScreenCache:
+    """
+    LRU cache of finished question screens (text body + InlineKeyboardMarkup).
+    A screen depends only on (question, position, selection bitmask), so Prev/Next,
+    answers and MSQ toggles re-use it. The timer line is added per request.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._screens = OrderedDict()  # (qid, index, total, mask) -> (text, markup)
+
+    def get(self, qid: int, q_index: int, total: int, selected: int) -> tuple:
+        key = (qid, q_index, total, selected)
+        cached = self._screens.get(key)
+        if cached is not None:
+            self._screens.move_to_end(key)
+            return cached
+
+        cached = self._screens[key] = render_question_screen(question_registry.get(qid), q_index, total, selected)
+        if len(self._screens) > self.maxsize:
+            self._screens.popitem(last=False)
+        return cached
+
+    def __len__(self) -> int:
+        return len(self._screens)
+
+def render_question_screen(q_data: Question, q_index: int, total: int, selected: int) -> tuple:
+    """Build the question text (without timer line) and its keyboard."""
+    header = f"❓ <b>Question {q_index + 1}/{total}</b> [{q_data.q_type}]\n"
+    question_text = f"{header}\n{q_data.text}"
 
     keyboard = []
-    
-    # Check if MSQ (multiple answers possible)
-    is_msq = isinstance(q_data.get('answer'), list)
-    user_answers = session['answers'][q_index] if session['answers'][q_index] else []
-    if not isinstance(user_answers, list):
-        user_answers = [user_answers] if user_answers is not None else []
-    
-    for i, option in enumerate(q_data['options']):
-        prefix = "✅ " if i in user_answers else ""
+    for i, option in enumerate(q_data.options):
+        prefix = "✅ " if selected >> i & 1 else ""
         button_text = f"{prefix}{chr(65+i)}. {option}"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f'answer_submit_{i}')])
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=CB_ANSWER[i])])
     
     # Add Clear Selection button for MSQ
-    if is_msq and user_answers:
-        keyboard.append([InlineKeyboardButton("🗑️ Clear Selection", callback_data='answer_clear')])
+    if q_data.is_msq and selected:
+        keyboard.append([InlineKeyboardButton("🗑️ Clear Selection", callback_data=CB_QUIZ_CLEAR)])
     
     # Navigation buttons
     nav_buttons = []
     if q_index > 0:
-        nav_buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data='quiz_nav_prev'))
-    if q_index < len(questions) - 1:
-        nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data='quiz_nav_next'))
+        nav_buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=CB_QUIZ_PREV))
+    if q_index < total - 1:
+        nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=CB_QUIZ_NEXT))
     if nav_buttons:
         keyboard.append(nav_buttons)
     
     # Add calculator button if question has 🧮 emoji
-    if has_calculator_emoji(q_data['q']):
+    if q_data.needs_calculator:
         keyboard.append([InlineKeyboardButton("🧮 Open Calculator", web_app=WebAppInfo(url="https://www.desmos.com/scientific"))])
     
-    keyboard.append([InlineKeyboardButton("🏁 SUBMIT FINAL ANSWERS 🏁", callback_data='quiz_submit_final')])
+    keyboard.append([InlineKeyboardButton("🏁 SUBMIT FINAL ANSWERS 🏁", callback_data=CB_QUIZ_SUBMIT)])
+
+    return question_text, InlineKeyboardMarkup(keyboard)
+
+question_screens = QuestionScreenCache(RENDER_CACHE_SIZE)
+
+async def send_question(message, context: ContextTypes.DEFAULT_TYPE, user_id: int, notice: str = None) -> None:
+    """Sends the current question to the user, with an optional notice line (answer feedback) on top."""
+    session = user_sessions.get(user_id)
+    if not session or session.is_finished:
+        return
+
+    q_index = session.current
+    
+    if q_index >= len(session):
+        await finalize_quiz(user_id, context, notice=notice)
+        return
+
+    question_text, reply_markup = question_screens.get(
+        session.qids[q_index], q_index, len(session), session.answers[q_index]
+    )
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Only the timer line changes between renders of the same screen
+    if session.is_timed:
+        remaining = session.time_limit - session.elapsed()
+        question_text = f"⏱️ Time Left: {format_time(max(0, remaining))}\n{question_text}"
+    if notice:
+        question_text = f"{notice}\n\n{question_text}"
 
     try:
-        await message.edit_text(question_text, reply_markup=reply_markup, parse_mode='HTML')
-    except error.BadRequest:
-        logger.info(f"Attempted to edit message with identical content for user {user_id}.")
+        await message_states.edit(message, question_text, reply_markup=reply_markup, parse_mode='HTML')
+    except error.BadRequest as e:
+        logger.info(f"Could not update question message for user {user_id}: {e}")
 
-async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handles user's answer submission and navigation via inline keyboard."""
+async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, action: int = None, option: int = -1) -> None:
+    """Handles user's answer submission and navigation via inline keyboard (OP_QUIZ buttons)."""
     query = update.callback_query
-    await query.answer()
     user_id = query.from_user.id
     session = user_sessions.get(user_id)
     
-    if not session or session.get('is_finished'):
-        await query.edit_message_text("❌ Quiz is finished or invalid session. Start a new one with /quiz.", parse_mode='HTML')
+    if not session or session.is_finished:
+        await message_states.edit(query.message, "❌ Quiz is finished or invalid session. Start a new one with /quiz.", parse_mode='HTML')
         return
 
-    data = query.data
-    q_index = session['current']
-    questions = session['questions']
+    q_index = session.current
+    total = len(session)
     
-    if data == 'quiz_nav_prev':
-        session['current'] = max(0, q_index - 1)
+    if action == QUIZ_PREV:
+        session.current = max(0, q_index - 1)
+        session_changed(user_id)
         await send_question(query.message, context, user_id)
         return
-    elif data == 'quiz_nav_next':
-        session['current'] = min(len(questions) - 1, q_index + 1)
+    elif action == QUIZ_NEXT:
+        session.current = min(total - 1, q_index + 1)
+        session_changed(user_id)
         await send_question(query.message, context, user_id)
         return
-    elif data == 'quiz_submit_final':
+    elif action == QUIZ_SUBMIT:
         await finalize_quiz(user_id, context)
         return
-    elif data == 'answer_clear':
-        session['answers'][q_index] = []
+    elif action == QUIZ_CLEAR:
+        session.answers[q_index] = 0
+        session_changed(user_id)
         await send_question(query.message, context, user_id)
         return
 
-    if data.startswith('answer_submit_'):
-        try:
-            selected_option = int(data.split('_')[-1])
-        except ValueError:
-            return
+    if action == QUIZ_ANSWER:
+        selected_option = option
 
         # Check if MSQ
-        q_data = questions[q_index]
-        is_msq = isinstance(q_data.get('answer'), list)
+        q_data = question_registry.get(session.qids[q_index])
+        is_msq = q_data.is_msq
+        if not 0 <= selected_option < len(q_data.options):
+            return
         
         if is_msq:
             # MSQ: Toggle selection
-            current_answers = session['answers'][q_index] if session['answers'][q_index] else []
-            if not isinstance(current_answers, list):
-                current_answers = []
-            
-            if selected_option in current_answers:
-                current_answers.remove(selected_option)
-            else:
-                current_answers.append(selected_option)
-            
-            session['answers'][q_index] = sorted(current_answers)
+            session.answers[q_index] ^= 1 << selected_option
         else:
             # MCQ/NAT: Single selection
-            session['answers'][q_index] = selected_option
+            session.answers[q_index] = 1 << selected_option
         
-        if session['instant_feedback'] and not is_msq:
-            correct_answer = questions[q_index]['answer']
+        feedback = None
+        if session.instant_feedback and not is_msq:
+            correct_answer = q_data.answer_index
             if selected_option == correct_answer:
                 feedback = "✅ <b>Correct Answer!</b> Moving to the next question."
             else:
                 feedback = f"❌ <b>Incorrect!</b> The correct answer was option {chr(65+correct_answer)}."
             
-            await send_message_robust(context, user_id, feedback)
-            
-            session['current'] = min(len(questions), q_index + 1)
+            session.current = min(total, q_index + 1)
         
-        await send_question(query.message, context, user_id)
+        session_changed(user_id)
+        # Feedback rides along in the next question's edit: one API call per answer
+        await send_question(query.message, context, user_id, notice=feedback)
 
-async def finalize_quiz(user_id: int, context: ContextTypes.DEFAULT_TYPE, timed_out=False) -> None:
+async def finalize_quiz(user_id: int, context: ContextTypes.DEFAULT_TYPE, timed_out=False, notice: str = None) -> None:
     """Calculates final score and updates the leaderboard."""
     session = user_sessions.get(user_id)
     if not session: return
 
-    session['is_finished'] = True
-    if session.get('timer_task'):
-        session['timer_task'].cancel()
-        session['timer_task'] = None
+    session.is_finished = True
+    quiz_timers.cancel(user_id)
 
     final_score = 0
-    total_q = len(session['questions'])
-    
-    # Calculate score handling both MSQ and MCQ
-    for q_data, user_ans in zip(session['questions'], session['answers']):
-        correct_ans = q_data['answer']
-        
-        if isinstance(correct_ans, list):  # MSQ
-            if isinstance(user_ans, list) and sorted(user_ans) == sorted(correct_ans):
-                final_score += 1
-        else:  # MCQ/NAT
-            if user_ans == correct_ans:
-                final_score += 1
+    total_q = len(session)
+    results = []
+    
+    # Calculate score: the selected option bitmask must equal the correct one (MCQ and MSQ alike)
+    for qid, user_mask in zip(session.qids, session.answers):
+        correct = user_mask == question_registry.get(qid).answer_mask
+        final_score += correct
+        results.append((qid, correct))
+    mastery.update(user_id, results)
+    seen_questions.update(user_id, session.qids)
             
     score_pct = (final_score / total_q) * 100 if total_q > 0 else 0
-    time_taken = (datetime.now() - session['start_time']).total_seconds()
+    time_taken = session.elapsed()
     
     stats = leaderboard_data[user_id]
     stats['total_score'] += final_score
     stats['total_questions'] += total_q
     stats['tests_taken'] += 1
     stats['best_score_pct'] = max(stats['best_score_pct'], score_pct)
+    leaderboard_index.update(user_id, stats)
+    if leaderboard_store:
+        leaderboard_store.queue_update(user_id, stats)
 
     # Store completed quiz for review
     quiz_key = f"{user_id}_{int(datetime.now().timestamp())}"
-    completed_quizzes[quiz_key] = {
-        'questions': session['questions'],
-        'user_answers': session['answers'],
-        'score': final_score,
-        'total': total_q,
-        'score_pct': score_pct
-    }
+    completed_quizzes[quiz_key] = ReviewRecord.from_session(session, final_score, score_pct)
 
     status_text = "⚠️ <b>TIME UP!</b> Your quiz has automatically submitted." if timed_out else "✅ <b>Quiz Complete!</b>"
     
-    result_text = f"🎉 {status_text}\n\n"
-    result_text += f"🎯 Mode: <b>{session['mode'].replace('_', ' ').title()}</b>\n"
+    result_text = f"{notice}\n\n" if notice else ""
+    result_text += f"🎉 {status_text}\n\n"
+    result_text += f"🎯 Mode: <b>{session.mode.replace('_', ' ').title()}</b>\n"
     result_text += f"✅ Correct Answers: <b>{final_score} / {total_q}</b>\n"
     result_text += f"💯 Score: <b>{score_pct:.1f}%</b>\n"
     result_text += f"⏱️ Time Taken: <b>{format_time(time_taken)}</b>"
 
     keyboard = [
-        [InlineKeyboardButton("👀 Review Answers", callback_data=f'review_start_{quiz_key}')],
-        [InlineKeyboardButton("🆕 Start New Quiz", callback_data='post_quiz_action_new')]
+        [InlineKeyboardButton("👀 Review Answers", callback_data=review_data(quiz_key, 0))],
+        [InlineKeyboardButton("🆕 Start New Quiz", callback_data=CB_MODE_MENU)]
     ]
     
-    await send_message_robust(context, session['chat_id'], result_text, reply_markup=InlineKeyboardMarkup(keyboard))
-    del user_sessions[user_id]
+    await send_message_robust(context, session.chat_id, result_text, reply_markup=InlineKeyboardMarkup(keyboard),
+                              priority=SEND_PRIORITY_ALERT if timed_out else None)
+    if user_sessions.get(user_id) is session:
+        del user_sessions[user_id]
+    if session_store:
+        session_store.forget(user_id)
 
-async def review_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Display detailed review of quiz answers."""
-    query = update.callback_query
-    await query.answer()
-    
-    data = query.data
-    
-    if data.startswith('review_start_'):
-        quiz_key = data.replace('review_start_', '')
-        
-        if quiz_key not in completed_quizzes:
-            await query.edit_message_text("❌ Quiz data not found. It may have been cleared.", parse_mode='HTML')
-            return
-        
-        # Start review from question 1
-        await show_review_question(query, quiz_key, 0)
-    
-    elif data.startswith('review_q_'):
-        parts = data.split('_')
-        quiz_key = parts[2]
-        q_index = int(parts[3])
-        
-        await show_review_question(query, quiz_key, q_index)
+async def review_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, stamp: int, q_index: int = 0) -> None:
+    """Display detailed review of quiz answers (OP_REVIEW buttons; index 0 starts the review)."""
+    await show_review_question(update.callback_query, f"{user_id}_{stamp}", q_index)
 
 async def show_review_question(query, quiz_key: str, q_index: int) -> None:
     """Show a single question in review mode."""
-    if quiz_key not in completed_quizzes:
-        await query.edit_message_text("❌ Quiz data not found.", parse_mode='HTML')
+    quiz_data = completed_quizzes.get(quiz_key)
+    if quiz_data is None:
+        await message_states.edit(query.message, "❌ Quiz data not found. It may have been cleared.", parse_mode='HTML')
         return
     
-    quiz_data = completed_quizzes[quiz_key]
-    questions = quiz_data['questions']
-    user_answers = quiz_data['user_answers']
+    total = quiz_data.total
     
-    if q_index >= len(questions):
+    if q_index >= total:
         # Review complete
-        await query.edit_message_text(
+        await message_states.edit(query.message, 
             f"✅ <b>Review Complete!</b>\n\n"
-            f"Final Score: <b>{quiz_data['score']}/{quiz_data['total']} ({quiz_data['score_pct']:.1f}%)</b>\n\n"
+            f"Final Score: <b>{quiz_data.score}/{total} ({quiz_data.score_pct:.1f}%)</b>\n\n"
             f"Keep practicing to improve! 💪",
             parse_mode='HTML',
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🆕 Start New Quiz", callback_data='post_quiz_action_new')]])
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🆕 Start New Quiz", callback_data=CB_MODE_MENU)]])
         )
         return
     
-    q_data = questions[q_index]
-    user_ans = user_answers[q_index]
-    correct_ans = q_data['answer']
-    
-    # Determine question type
-    q_type = "MCQ"
-    if q_data['q'].startswith('[MSQ]'):
-        q_type = "MSQ"
-    elif q_data['q'].startswith('[NAT]'):
-        q_type = "NAT"
+    try:
+        q_data = quiz_data.question(q_index)
+    except (KeyError, IndexError) as e:
+        logger.error(f"Review question {q_index} of {quiz_key} unavailable: {e}")
+        await message_states.edit(query.message, 
+            "❌ Quiz data not found. It may have been cleared, or the quiz has changed since you played it.",
+            parse_mode='HTML')
+        return
+    correct_mask = q_data.answer_mask
+    user_mask = quiz_data.answers[q_index]
     
     # Check if answer is correct
-    if isinstance(correct_ans, list):  # MSQ
-        is_correct = isinstance(user_ans, list) and sorted(user_ans) == sorted(correct_ans)
-    else:  # MCQ/NAT
-        is_correct = user_ans == correct_ans
-    
+    is_correct = user_mask == correct_mask
     status_icon = "✅" if is_correct else "❌"
     
     # Build review text
-    review_text = f"<b>Review - Question {q_index + 1}/{len(questions)}</b> [{q_type}] {status_icon}\n\n"
-    review_text += f"{q_data['q']}\n\n"
+    review_text = f"<b>Review - Question {q_index + 1}/{total}</b> [{q_data.q_type}] {status_icon}\n\n"
+    review_text += f"{q_data.text}\n\n"
     
     # Show options with indicators
-    for i, option in enumerate(q_data['options']):
+    for i, option in enumerate(q_data.options):
         prefix = ""
-        
-        if isinstance(correct_ans, list):  # MSQ
-            if i in correct_ans:
-                prefix = "✅ "
-            if isinstance(user_ans, list) and i in user_ans and i not in correct_ans:
-                prefix = "❌ "
-        else:  # MCQ/NAT
-            if i == correct_ans:
-                prefix = "✅ "
-            elif i == user_ans and i != correct_ans:
-                prefix = "❌ "
+        if correct_mask >> i & 1:
+            prefix = "✅ "
+        elif user_mask >> i & 1:
+            prefix = "❌ "
         
         review_text += f"{prefix}{chr(65+i)}. {option}\n"
     
     # Show user's answer
     review_text += f"\n<b>Your Answer:</b> "
-    if user_ans is None or (isinstance(user_ans, list) and len(user_ans) == 0):
+    if not user_mask:
         review_text += "Not answered"
-    elif isinstance(user_ans, list):
-        review_text += ", ".join([chr(65+i) for i in user_ans])
     else:
-        review_text += chr(65+user_ans)
+        review_text += ", ".join([chr(65+i) for i in range(len(q_data.options)) if user_mask >> i & 1])
     
     # Show correct answer
     review_text += f"\n<b>Correct Answer:</b> "
-    if isinstance(correct_ans, list):
-        review_text += ", ".join([chr(65+i) for i in correct_ans])
-    else:
-        review_text += chr(65+correct_ans)
+    review_text += ", ".join([chr(65+i) for i in q_data.correct_options])
     
     # Add explanation if available
-    if 'explanation' in q_data and q_data['explanation']:
-        review_text += f"\n\n💡 <b>Explanation:</b>\n{q_data['explanation']}"
+    if q_data.explanation:
+        review_text += f"\n\n💡 <b>Explanation:</b>\n{q_data.explanation}"
     
     # Navigation buttons for review
     keyboard = []
     nav_buttons = []
     
     if q_index > 0:
-        nav_buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f'review_q_{quiz_key}_{q_index-1}'))
+        nav_buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=review_data(quiz_key, q_index - 1)))
     
-    if q_index < len(questions) - 1:
-        nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f'review_q_{quiz_key}_{q_index+1}'))
+    if q_index < total - 1:
+        nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=review_data(quiz_key, q_index + 1)))
     else:
-        nav_buttons.append(InlineKeyboardButton("🏁 Finish Review", callback_data=f'review_q_{quiz_key}_{len(questions)}'))
+        nav_buttons.append(InlineKeyboardButton("🏁 Finish Review", callback_data=review_data(quiz_key, total)))
     
     if nav_buttons:
         keyboard.append(nav_buttons)
     
-    keyboard.append([InlineKeyboardButton("🆕 Start New Quiz", callback_data='post_quiz_action_new')])
+    keyboard.append([InlineKeyboardButton("🆕 Start New Quiz", callback_data=CB_MODE_MENU)])
     
     try:
-        await query.edit_message_text(
+        await message_states.edit(query.message, 
             review_text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
@@ -685,143 +3318,135 @@ async def show_review_question(query, quiz_key: str, q_index: int) -> None:
 # --- Callback Query Router ---
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Main router for all callback queries."""
+    """Main router for all callback queries (acknowledges each one exactly once, here)."""
     query = update.callback_query
+    decoded = decode_callback(query.data or '')
+    route = CALLBACK_ROUTES.get(decoded[0]) if decoded else None
+    if route is None or not route[1] <= len(decoded[1]) <= route[2]:
+        await query.answer("⌛ This button has expired. Start again with /quiz.")
+        return
     await query.answer()
-    
-    data = query.data
-    user_id = query.from_user.id
-    
-    # Route to appropriate handler
-    if data.startswith('mode_select_'):
-        await handle_mode_selection(update, context)
-    elif data.startswith('topic_select_'):
-        await handle_topic_selection(update, context)
-    elif data.startswith('quiz_start_'):
-        await handle_quiz_start(update, context)
-    elif data.startswith('answer_') or data.startswith('quiz_nav_') or data == 'quiz_submit_final':
-        await handle_answer(update, context)
-    elif data.startswith('review_'):
-        await review_quiz(update, context)
-    elif data == 'post_quiz_action_new':
-        keyboard = [[InlineKeyboardButton(mode_data['label'], callback_data=f'mode_select_{mode_key}')] 
-                    for mode_key, mode_data in QUIZ_MODES.items()]
-        keyboard.append([InlineKeyboardButton("➡️ Choose Topic Instead", callback_data='topics_redirect')])
-        
-        await query.edit_message_text(
-            "🎮 <b>Select Quiz Mode:</b>\n\nChoose your next challenge:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='HTML'
-        )
-    elif data == 'topics_redirect':
-        await show_topics_inline(query, context)
+    await route[0](update, context, *decoded[1])
 
-async def handle_mode_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def show_mode_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await message_states.edit(update.callback_query.message, 
+        "🎮 <b>Select Quiz Mode:</b>\n\nChoose your next challenge:",
+        reply_markup=mode_menu_keyboard(),
+        parse_mode='HTML'
+    )
+
+async def show_topic_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_topics_inline(update.callback_query, context)
+
+async def handle_mode_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, mode_index: int) -> None:
     """Handle quiz mode selection."""
     query = update.callback_query
-    mode_key = query.data.replace('mode_select_', '')
     
-    if mode_key not in QUIZ_MODES:
-        await query.edit_message_text("❌ Invalid mode selected.", parse_mode='HTML')
+    if mode_index >= len(MODE_KEYS):
+        await message_states.edit(query.message, "❌ Invalid mode selected.", parse_mode='HTML')
         return
     
     # Get available quizzes
     available = get_available_quizzes()
     
     if not available:
-        await query.edit_message_text(
+        await message_states.edit(query.message, 
             "⚠️ No quizzes available!\n\nPlease add JSON files to the 'questions' folder.",
             parse_mode='HTML'
         )
         return
     
-    # Show quiz selection for this mode
-    sorted_quizzes = sorted(available.items(), key=lambda item: item[1])
-    keyboard = [[InlineKeyboardButton(label, callback_data=f'quiz_start_{quiz_id}_{mode_key}')] 
-                for quiz_id, label in sorted_quizzes[:15]]  # Limit to 15 to avoid message size issues
-    
-    keyboard.append([InlineKeyboardButton("⬅️ Back to Modes", callback_data='back_to_modes')])
-    
-    mode_info = QUIZ_MODES[mode_key]
-    await query.edit_message_text(
-        f"📚 <b>Select Quiz for {mode_info['label']}</b>\n\n"
-        f"Questions: {mode_info['num_q']}\n"
-        f"{'⏱️ Timed: ' + format_time(mode_info.get('time_limit', 0)) if mode_info['timed'] else '⏱️ Untimed'}",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='HTML'
-    )
+    # Show quiz selection for this mode: the browser, at the root
+    text, keyboard = browse_menu(quiz_catalog.folder(''), 0, MODE_KEYS[mode_index])
+    await message_states.edit(query.message, text, reply_markup=keyboard, parse_mode='HTML')
+
+async def handle_browse(update: Update, context: ContextTypes.DEFAULT_TYPE, folder_ref: int, page: int, mode_index: int = None) -> None:
+    """Open one page of a folder in the quiz browser."""
+    query = update.callback_query
+    name = callback_ids.quiz_id(folder_ref)
+    mode_key = MODE_KEYS[mode_index] if mode_index is not None and mode_index < len(MODE_KEYS) else None
+    node = quiz_catalog.folder(name[:-1]) if name and name.endswith('/') else None
+    if node is None:
+        node = quiz_catalog.folder('')  # folder removed since the menu was sent
+        page = 0
+    text, keyboard = browse_menu(node, page, mode_key)
+    await message_states.edit(query.message, text, reply_markup=keyboard, parse_mode='HTML')
 
-async def handle_topic_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle topic selection and start quiz."""
+async def handle_topic_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, quiz_ref: int = None) -> None:
+    """Handle topic selection and start quiz (no quiz ref: Random Mix)."""
     query = update.callback_query
-    topic_id = query.data.replace('topic_select_', '')
     
-    if topic_id == 'random':
-        # Random mix of questions from all topics
-        all_questions = []
-        available = get_available_quizzes()
-        
-        for quiz_id in available.keys():
-            if '/' not in quiz_id:  # Only root topics
-                questions = load_questions_from_file(quiz_id)
-                all_questions.extend(questions)
+    if quiz_ref is None:
+        topic_id = 'random'
+
+        # Random mix of questions from all root topics, via the prebuilt global index
+        selected_questions = random_mix_index.sample(10)
         
-        if len(all_questions) < 10:
-            await query.edit_message_text(
+        if len(selected_questions) < 10:
+            await message_states.edit(query.message, 
                 "⚠️ Not enough questions for random mix!\n\nAdd more topics to use this feature.",
                 parse_mode='HTML'
             )
             return
         
-        selected_questions = random.sample(all_questions, min(10, len(all_questions)))
         quiz_mode = 'standard_10'
     else:
-        # Load specific topic
-        selected_questions = load_questions_from_file(topic_id)
+        # Load specific topic (only the sampled records are decoded)
+        topic_id = callback_ids.quiz_id(quiz_ref)
+        bank = get_question_bank(topic_id) if topic_id else None
         
-        if not selected_questions:
-            await query.edit_message_text(
+        if not bank:
+            await message_states.edit(query.message, 
                 f"❌ Could not load questions for topic: {topic_id}",
                 parse_mode='HTML'
             )
             return
         
         quiz_mode = 'standard_10'
-        selected_questions = random.sample(selected_questions, min(10, len(selected_questions)))
+        selected_questions = await pick_questions(query.from_user.id, bank, quiz_mode)
     
     await start_quiz_session(query, context, selected_questions, quiz_mode, topic_id)
 
-async def handle_quiz_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def handle_quiz_start(update: Update, context: ContextTypes.DEFAULT_TYPE, quiz_ref: int, mode_index: int = None) -> None:
     """Handle quiz start from tests menu."""
     query = update.callback_query
-    data_parts = query.data.replace('quiz_start_', '').split('_')
-    
-    # Extract quiz_id and mode_key
-    if len(data_parts) > 1 and data_parts[-1] in QUIZ_MODES:
-        mode_key = data_parts[-1]
-        quiz_id = '_'.join(data_parts[:-1])
-    else:
-        mode_key = 'standard_10'
-        quiz_id = '_'.join(data_parts)
+    quiz_id = callback_ids.quiz_id(quiz_ref)
+    mode_key = MODE_KEYS[mode_index] if mode_index is not None and mode_index < len(MODE_KEYS) else 'standard_10'
     
-    # Load questions
-    all_questions = load_questions_from_file(quiz_id)
+    # Map the compiled bank
+    bank = get_question_bank(quiz_id) if quiz_id else None
     
-    if not all_questions:
-        await query.edit_message_text(
+    if not bank:
+        await message_states.edit(query.message, 
             f"❌ Could not load quiz: {quiz_id}\n\nPlease check if the file exists.",
             parse_mode='HTML'
         )
         return
     
-    # Select questions based on mode
-    mode_config = QUIZ_MODES[mode_key]
-    num_questions = min(mode_config['num_q'], len(all_questions))
-    selected_questions = random.sample(all_questions, num_questions)
+    # Select questions based on mode (adaptive modes favour the user's weak and overdue questions)
+    selected_questions = await pick_questions(query.from_user.id, bank, mode_key)
     
     await start_quiz_session(query, context, selected_questions, mode_key, quiz_id)
 
-async def start_quiz_session(query, context: ContextTypes.DEFAULT_TYPE, questions: list, mode_key: str, quiz_id: str) -> None:
+async def handle_search_hit(update: Update, context: ContextTypes.DEFAULT_TYPE, quiz_ref: int, record: int) -> None:
+    """Start a quick quiz: the question picked from /search first, then others from its quiz."""
+    query = update.callback_query
+    quiz_id = callback_ids.quiz_id(quiz_ref)
+    bank = get_question_bank(quiz_id) if quiz_id else None
+
+    if not bank or record >= len(bank):
+        await message_states.edit(query.message, 
+            "❌ This question is no longer available.\n\nTry /search again.",
+            parse_mode='HTML'
+        )
+        return
+
+    num_q = QUIZ_MODES['quick_5']['num_q']
+    draws = itertools.chain([(bank, record)], ((bank, i) for i in permuted(len(bank))))
+    qids = sample_distinct(draws, num_q)
+    await start_quiz_session(query, context, qids, 'quick_5', quiz_id)
+
+async def start_quiz_session(query, context: ContextTypes.DEFAULT_TYPE, qids: array, mode_key: str, quiz_id: str) -> None:
     """Initialize and start a quiz session."""
     user_id = query.from_user.id
     user = query.from_user
@@ -834,32 +3459,20 @@ async def start_quiz_session(query, context: ContextTypes.DEFAULT_TYPE, question
     mode_config = QUIZ_MODES[mode_key]
     
     # Create session
-    user_sessions[user_id] = {
-        'questions': questions,
-        'answers': [None] * len(questions),
-        'current': 0,
-        'start_time': datetime.now(),
-        'is_timed': mode_config['timed'],
-        'time_limit': mode_config.get('time_limit', 0),
-        'instant_feedback': mode_config['feedback'],
-        'mode': mode_key,
-        'quiz_id': quiz_id,
-        'chat_id': query.message.chat_id,
-        'is_finished': False,
-        'timer_task': None
-    }
+    user_sessions[user_id] = QuizSession(qids, mode_key, quiz_id, query.message.chat_id)
     
-    # Start timer if timed quiz
+    if session_store:
+        session_store.track_new(user_id, user_sessions[user_id])
+    
+    # Start timer if timed quiz (and drop deadlines of any quiz this one replaces)
+    quiz_timers.cancel(user_id)
     if mode_config['timed']:
-        timer_task = asyncio.create_task(
-            quiz_timer(user_id, context, mode_config['time_limit'], query.message.chat_id)
-        )
-        user_sessions[user_id]['timer_task'] = timer_task
+        quiz_timers.arm(user_id, user_sessions[user_id])
     
-    await query.edit_message_text(
+    await message_states.edit(query.message, 
         f"🚀 <b>Quiz Starting!</b>\n\n"
         f"Mode: {mode_config['label']}\n"
-        f"Questions: {len(questions)}\n"
+        f"Questions: {len(qids)}\n"
         f"{'Time Limit: ' + format_time(mode_config['time_limit']) if mode_config['timed'] else 'No Time Limit'}\n\n"
         f"Good luck! 🍀",
         parse_mode='HTML'
@@ -873,53 +3486,316 @@ async def show_topics_inline(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     available = get_available_quizzes()
     
     if not available:
-        await query.edit_message_text(
+        await message_states.edit(query.message, 
             "⚠️ No topics found!\n\nAdd JSON files to 'questions' folder.",
             parse_mode='HTML'
         )
         return
     
-    topics_dict = {k: v for k, v in available.items() if '/' not in k}
+    sorted_topics = quiz_catalog.sorted_topics()
     
-    if not topics_dict:
-        await query.edit_message_text(
+    if not sorted_topics:
+        await message_states.edit(query.message, 
             "⚠️ No topics in root folder!\n\nUse /tests for all quizzes.",
             parse_mode='HTML'
         )
         return
     
-    sorted_topics = sorted(topics_dict.items(), key=lambda item: item[1])
-    keyboard = [[InlineKeyboardButton(label, callback_data=f'topic_select_{topic_id}')] 
+    keyboard = [[InlineKeyboardButton(label, callback_data=topic_select_data(topic_id))] 
                 for topic_id, label in sorted_topics]
     
-    keyboard.append([InlineKeyboardButton("🎲 Random Mix (10Q)", callback_data='topic_select_random')])
+    keyboard.append([InlineKeyboardButton("🎲 Random Mix (10Q)", callback_data=CB_RANDOM_MIX)])
     
-    await query.edit_message_text(
-        f'📚 <b>Choose Topic:</b>\n\n✨ {len(topics_dict)} topic(s) available',
+    await message_states.edit(query.message, 
+        f'📚 <b>Choose Topic:</b>\n\n✨ {len(sorted_topics)} topic(s) available',
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
 
+# Opcode -> (handler, min args, max args); decoded arguments are passed positionally after (update, context)
+CALLBACK_ROUTES = {
+    OP_MODE_MENU: (instrumented('cb:mode_menu', show_mode_menu), 0, 0),
+    OP_TOPIC_MENU: (instrumented('cb:topic_menu', show_topic_menu), 0, 0),
+    OP_MODE_SELECT: (instrumented('cb:mode_select', handle_mode_selection), 1, 1),
+    OP_TOPIC_SELECT: (instrumented('cb:topic_select', handle_topic_selection), 1, 1),
+    OP_RANDOM_MIX: (instrumented('cb:random_mix', handle_topic_selection), 0, 0),
+    OP_QUIZ_START: (instrumented('cb:quiz_start', handle_quiz_start), 1, 2),
+    OP_QUIZ: (instrumented('cb:quiz', handle_answer), 1, 2),
+    OP_REVIEW: (instrumented('cb:review', review_quiz), 2, 3),
+    OP_BROWSE: (instrumented('cb:browse', handle_browse), 2, 3),
+    OP_SEARCH_HIT: (instrumented('cb:search_hit', handle_search_hit), 2, 2),
+}
+
+# --- Concurrent Update Processing ---
+
+class UserLanes:
+    """
+    Keyed FIFO locks: one lane per user, created on first use and dropped as soon
+    as nobody holds or waits for it, so memory tracks *active* users only.
+    """
+
+    def __init__(self):
+        self._lanes = {}  # key -> [asyncio.Lock, holders + waiters]
+
+    def __len__(self) -> int:
+        return len(self._lanes)
+
+    def hold(self, key) -> 'UserLaneHold':
+        return UserLaneHold(self, key)
+
+    async def _acquire(self, key) -> None:
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = [asyncio.Lock(), 0]
+        lane[1] += 1
+        try:
+            await lane[0].acquire()
+        except BaseException:
+            self._release_ref(key, lane)
+            raise
+
+    def _release(self, key) -> None:
+        lane = self._lanes[key]
+        lane[0].release()
+        self._release_ref(key, lane)
+
+    def _release_ref(self, key, lane) -> None:
+        lane[1] -= 1
+        if lane[1] == 0:
+            del self._lanes[key]
+
+class UserLaneHold:
+    """`async with user_lanes.hold(user_id):` - runs the block in the user's lane."""
+
+    __slots__ = ('lanes', 'key')
+
+    def __init__(self, lanes: UserLanes, key):
+        self.lanes = lanes
+        self.key = key
+
+    async def __aenter__(self):
+        await self.lanes._acquire(self.key)
+
+    async def __aexit__(self, *exc):
+        self.lanes._release(self.key)
+
+user_lanes = UserLanes()
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    🚦 Processes updates of different users concurrently while each user's own updates
+    run one at a time, in arrival order (so taps can't race on the same session).
+    Up to max_pending updates are accepted; at most max_running handlers run at once.
+    Waiting in a user's lane doesn't take a running slot, so one fast tapper can't
+    starve everybody else.
+    """
+
+    def __init__(self, max_running: int, max_pending: int):
+        super().__init__(max(max_pending, max_running))
+        self._running = asyncio.BoundedSemaphore(max_running)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self._running:
+                await coroutine
+            return
+        async with user_lanes.hold(user.id):
+            async with self._running:
+                await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+# --- HTTP Server (webhook + health) ---
+
+BOT_STARTED_AT = time.monotonic()
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Receives updates pushed by Telegram and hands them to the Application."""
+
+    def initialize(self, bot_app: Application, secret: str) -> None:
+        self.bot_app = bot_app  # (self.application is tornado's own)
+        self.secret = secret
+
+    async def post(self) -> None:
+        if self.secret and self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            logger.warning(f"🚫 Rejected webhook call with a bad secret token from {self.request.remote_ip}")
+            self.set_status(403)
+            return
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_app.bot)
+        except (ValueError, TypeError) as e:
+            logger.error(f"❌ Malformed webhook payload: {e}")
+            self.set_status(400)
+            return
+        await self.bot_app.update_queue.put(update)
+        self.set_status(200)
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Prometheus scrape endpoint."""
+
+    def get(self) -> None:
+        if METRICS_TOKEN and self.request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            self.set_status(401)
+            return
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.render())
+
+class HealthHandler(tornado.web.RequestHandler):
+    """Liveness endpoint for Render's health check."""
+
+    def get(self) -> None:
+        self.write({
+            'status': 'ok',
+            'mode': BOT_MODE,
+            'uptime_seconds': round(time.monotonic() - BOT_STARTED_AT),
+            'active_sessions': len(user_sessions),
+        })
+
+def http_routes(application: Application) -> list:
+    """Routes served on PORT."""
+    routes = [(r'/healthz', HealthHandler)]
+    if METRICS_ENABLED:
+        routes.append((r'/metrics', MetricsHandler))
+    if BOT_MODE == 'webhook':
+        routes.append((WEBHOOK_PATH, TelegramWebhookHandler, {'bot_app': application, 'secret': WEBHOOK_SECRET}))
+    return routes
+
+def start_http_server(application: Application, address: str = '') -> tornado.httpserver.HTTPServer:
+    server = tornado.httpserver.HTTPServer(tornado.web.Application(http_routes(application)), xheaders=True)
+    server.listen(PORT, address)
+    logger.info(f"🌐 HTTP server listening on {address}:{PORT} (health: /healthz{', metrics: /metrics' if METRICS_ENABLED else ''})")
+    return server
+
+async def run_webhook(application: Application) -> None:
+    """Serve updates pushed by Telegram until SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    async with application:
+        # Application.run_* would call these; the custom server has to do it itself
+        await post_init(application)
+        await application.start()
+        server = start_http_server(application)
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=MAX_CONCURRENT_UPDATES,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"🔗 Webhook set to {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        try:
+            await stop.wait()
+        finally:
+            server.stop()
+            await application.stop()
+            await post_shutdown(application)
+
 # --- Main Application ---
 
+async def post_init(application: Application) -> None:
+    """Start background workers once the event loop is running."""
+    if BOT_MODE != 'webhook' and 'PORT' in os.environ:
+        # Polling on a web service: still answer health checks on the port
+        start_http_server(application)
+    elif BOT_MODE != 'webhook' and METRICS_ENABLED:
+        # Local polling run: metrics on loopback only
+        start_http_server(application, '127.0.0.1')
+    if leaderboard_store:
+        leaderboard_store.start()
+    quiz_timers.start(CallbackContext(application))
+    if session_store:
+        # Bring back quizzes that were running when the process stopped
+        restored = session_store.restore_into(user_sessions)
+        for user_id in restored:
+            if user_sessions[user_id].is_timed:
+                quiz_timers.arm(user_id, user_sessions[user_id])
+        logger.info(f"♻️ Restored {len(restored)} in-flight quiz session(s)")
+        session_store.start()
+    if completed_quizzes.archive:
+        completed_quizzes.archive.start()
+    if mastery.store:
+        mastery.store.start()
+    if seen_questions.store:
+        seen_questions.store.start()
+    if WATCH_QUESTIONS:
+        quiz_watcher.start()
+    search_index.start()
+    retired_banks.start()
+
+async def post_shutdown(application: Application) -> None:
+    """Flush persistent state before the process exits."""
+    await quiz_timers.stop()
+    await quiz_watcher.stop()
+    await search_index.stop()
+    await retired_banks.stop()
+    if leaderboard_store:
+        await leaderboard_store.close()
+    if session_store:
+        await session_store.close()
+    if completed_quizzes.archive:
+        # Everything still in memory goes to disk, so reviews survive the restart
+        completed_quizzes.spill_all()
+        await completed_quizzes.archive.close()
+    if mastery.store:
+        await mastery.store.close()
+    if seen_questions.store:
+        await seen_questions.store.close()
+    callback_ids.close()
+
 def main() -> None:
     """Start the bot."""
+    global leaderboard_store, session_store
     if not BOT_TOKEN:
         logger.error("❌ BOT_TOKEN not found in environment variables!")
         logger.error("Please set BOT_TOKEN environment variable and restart.")
         return
     
+    # Persistent leaderboard (survives restarts)
+    leaderboard_store = LeaderboardStore(BOT_DB_PATH, flush_interval=LEADERBOARD_FLUSH_SECONDS)
+    logger.info(f"💾 Loaded {leaderboard_store.load_into(leaderboard_data)} leaderboard entries from {BOT_DB_PATH}")
+    leaderboard_index.rebuild(leaderboard_data)
+    session_store = SessionStore(BOT_DB_PATH, flush_interval=SESSION_FLUSH_SECONDS)
+    completed_quizzes.archive = ReviewArchive(BOT_DB_PATH, retention=REVIEW_DISK_TTL)
+    mastery.store = MasteryStore(BOT_DB_PATH, flush_interval=MASTERY_FLUSH_SECONDS)
+    seen_questions.store = SeenStore(BOT_DB_PATH, flush_interval=SEEN_FLUSH_SECONDS)
+    callback_ids.open(BOT_DB_PATH)
+    
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES))
+        .rate_limiter(OutboundDispatcher(GLOBAL_SEND_RATE, CHAT_SEND_RATE, CHAT_SEND_BURST, GROUP_SEND_RATE, SEND_MAX_RETRIES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if BOT_API_URL:
+        builder.base_url(BOT_API_URL)
+    application = builder.build()
     
     # Register command handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("quiz", quiz))
-    application.add_handler(CommandHandler("tests", special_tests))
-    application.add_handler(CommandHandler("topics", topics))
-    application.add_handler(CommandHandler("leaderboard", leaderboard_handler))
-    application.add_handler(CommandHandler("mystats", mystats))
+    commands = {
+        "start": start,
+        "help": help_command,
+        "quiz": quiz,
+        "tests": special_tests,
+        "topics": topics,
+        "leaderboard": leaderboard_handler,
+        "mystats": mystats,
+        "search": search_command,
+    }
+    for command, callback in commands.items():
+        application.add_handler(CommandHandler(command, instrumented(f'/{command}', callback)))
     
     # Register callback query handler
     application.add_handler(CallbackQueryHandler(handle_callback))
@@ -928,13 +3804,25 @@ def main() -> None:
     logger.info("🤖 Bot starting up...")
     logger.info(f"📂 Quiz directory: {os.path.abspath(QUIZ_DATA_DIR)}")
     
-    # Discover available quizzes on startup
+    # Build the quiz catalog once on startup
+    quiz_catalog.refresh()
     available = get_available_quizzes()
     logger.info(f"✅ Found {len(available)} quiz(es) on startup")
     
     # Run the bot
-    logger.info("✅ Bot is now running! Press Ctrl+C to stop.")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    logger.info(f"✅ Bot is now running in {BOT_MODE} mode! Press Ctrl+C to stop.")
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            logger.error("❌ BOT_MODE=webhook needs WEBHOOK_URL (or RENDER_EXTERNAL_URL).")
+            return
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
+    if '--compile' in sys.argv[1:]:
+        # Build step: python bot.py --compile (broken files are logged, not fatal)
+        failed = compile_all_banks()
+        logger.info(f"🛠️ Question banks compiled ({failed} file(s) skipped)")
+        sys.exit(0)
     main()
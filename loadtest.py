@@ -0,0 +1,513 @@
+"""
+🧪 Load test for bot.py against a local fake Telegram Bot API.
+
+Two parts, both in this file:
+- FakeBotAPI: a tornado stand-in for api.telegram.org (getMe, getUpdates, setWebhook,
+  sendMessage, editMessageText, editMessageReplyMarkup, answerCallbackQuery, ...)
+  with configurable per-call latency and injected 429 (flood control) replies.
+- Virtual users: each one plays /quiz -> mode -> quiz -> answers -> submit -> review,
+  reading the buttons the bot actually sent and timing every step.
+
+bot.py runs as a subprocess pointed at the fake API (BOT_API_URL), once per load level,
+and the report shows p50/p95/p99 per step, throughput and the bot's memory (RSS).
+
+Usage:
+    python loadtest.py                          # 100, 1000 and 10000 users, polling
+    python loadtest.py --users 100 --bot-mode webhook --api-latency-ms 80 --rate-429 0.02
+    python loadtest.py --users 1000 --json results.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import signal
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import tornado.httpclient
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger('loadtest')
+logging.getLogger('tornado.access').setLevel(logging.WARNING)
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_TOKEN = '123456:LOADTEST'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Quiz Bot', 'username': 'loadtest_quiz_bot'}
+CHAT_METHODS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup'}
+
+# --- Fake Bot API ---
+
+class FakeChat:
+    __slots__ = ('messages', 'inbox')
+
+    def __init__(self):
+        self.messages = {}  # message_id -> message dict as the bot last left it
+        self.inbox = asyncio.Queue()  # every message the bot sent or edited, in order
+
+class FakeBotAPI:
+    """In-memory Bot API: queues updates for getUpdates (or pushes them to the webhook) and records bot output per chat."""
+
+    def __init__(self, latency: float, jitter: float, rate_429: float, retry_after: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.chats = defaultdict(FakeChat)
+        self.calls = defaultdict(int)
+        self.injected_429 = 0
+        self.polled = asyncio.Event()  # set on the first getUpdates / setWebhook: the bot is up
+        self.webhook_url = None
+        self.webhook_secret = None
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._http = None
+
+    def reset(self) -> None:
+        """Forget everything between load levels (a fresh bot process is started for each)."""
+        self.chats.clear()
+        self.calls.clear()
+        self.injected_429 = 0
+        self.polled.clear()
+        self.webhook_url = self.webhook_secret = None
+        self._updates.clear()
+
+    # Requests from the bot
+
+    async def call(self, method: str, params: dict):
+        self.calls[method] += 1
+        if method != 'getUpdates' and (self.latency or self.jitter):
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        if method in CHAT_METHODS and self.rate_429 and random.random() < self.rate_429:
+            self.injected_429 += 1
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        handler = getattr(self, f'api_{method}', None)
+        result = await handler(params) if handler else True
+        if isinstance(result, tuple):
+            return result
+        return 200, {'ok': True, 'result': result}
+
+    async def api_getMe(self, params):
+        return dict(BOT_USER, can_join_groups=True, can_read_all_group_messages=False, supports_inline_queries=False)
+
+    async def api_getUpdates(self, params):
+        self.polled.set()
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=min(float(params.get('timeout') or 0), 10))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit') or 100)]
+
+    async def api_setWebhook(self, params):
+        self.webhook_url = params['url']
+        self.webhook_secret = params.get('secret_token')
+        self.polled.set()
+        return True
+
+    async def api_deleteWebhook(self, params):
+        self.webhook_url = self.webhook_secret = None
+        return True
+
+    async def api_getWebhookInfo(self, params):
+        return {'url': self.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': len(self._updates)}
+
+    async def api_sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+        if params.get('reply_markup'):
+            message['reply_markup'] = params['reply_markup']
+        return self._deliver(chat_id, message)
+
+    async def api_editMessageText(self, params):
+        message = self._find(params)
+        if message is None:
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message to edit not found'}
+        message['text'] = params.get('text', '')
+        message.pop('reply_markup', None)
+        if params.get('reply_markup'):
+            message['reply_markup'] = params['reply_markup']
+        return self._deliver(message['chat']['id'], message)
+
+    async def api_editMessageReplyMarkup(self, params):
+        message = self._find(params)
+        if message is None:
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message to edit not found'}
+        message.pop('reply_markup', None)
+        if params.get('reply_markup'):
+            message['reply_markup'] = params['reply_markup']
+        return self._deliver(message['chat']['id'], message)
+
+    async def api_answerCallbackQuery(self, params):
+        return True
+
+    def _find(self, params):
+        return self.chats[int(params['chat_id'])].messages.get(int(params['message_id']))
+
+    def _deliver(self, chat_id: int, message: dict) -> dict:
+        chat = self.chats[chat_id]
+        chat.messages[message['message_id']] = message
+        snapshot = dict(message)
+        chat.inbox.put_nowait(snapshot)
+        return snapshot
+
+    # Updates from the virtual users
+
+    async def push_update(self, update: dict) -> None:
+        update['update_id'] = next(self._update_ids)
+        if self.webhook_url:
+            headers = {'Content-Type': 'application/json'}
+            if self.webhook_secret:
+                headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook_secret
+            if self._http is None:
+                self._http = tornado.httpclient.AsyncHTTPClient(max_clients=1000)
+            await self._http.fetch(self.webhook_url, method='POST', body=json.dumps(update), headers=headers,
+                                   request_timeout=60, raise_error=False)
+        else:
+            self._updates.append(update)
+            self._new_updates.set()
+
+    def release_pollers(self) -> None:
+        """End pending long polls (a stopped bot leaves one behind)."""
+        self._new_updates.set()
+
+    def next_callback_id(self) -> str:
+        return str(next(self._callback_ids))
+
+class BotAPIHandler(tornado.web.RequestHandler):
+    def initialize(self, api: FakeBotAPI) -> None:
+        self.api = api
+
+    async def post(self, token: str, method: str) -> None:
+        if self.request.headers.get('Content-Type', '').startswith('application/json'):
+            params = json.loads(self.request.body or b'{}')
+        else:
+            params = {key: values[-1].decode() for key, values in self.request.body_arguments.items()}
+        if isinstance(params.get('reply_markup'), str):
+            params['reply_markup'] = json.loads(params['reply_markup'])
+        status, body = await self.api.call(method, params)
+        self.set_status(status)
+        self.write(body)
+
+    get = post
+
+# --- Virtual Users ---
+
+class StepStats:
+    def __init__(self):
+        self.samples = defaultdict(list)  # step -> latencies (seconds)
+        self.failures = defaultdict(int)
+        self.flows_done = 0
+        self.flows_failed = 0
+        self.updates_sent = 0
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(pct / 100 * len(sorted_values)))]
+
+def buttons(message: dict) -> list:
+    """[(text, callback_data)] of a message's inline keyboard."""
+    rows = (message.get('reply_markup') or {}).get('inline_keyboard', [])
+    return [(b['text'], b.get('callback_data')) for row in rows for b in row if b.get('callback_data')]
+
+QUESTION_NO = re.compile(r'Question (\d+)/')
+
+def question_no(message: dict):
+    match = QUESTION_NO.search(message['text'])
+    return match and int(match.group(1))
+
+class StepFailed(Exception):
+    pass
+
+# Browser navigation rows (pages, page indicator, up): not quizzes or folders
+BROWSER_CONTROLS = ('◀️', '📄', 'Next ▶️', '⬆️')
+
+class VirtualUser:
+    def __init__(self, api: FakeBotAPI, user_id: int, stats: StepStats, think: float, step_timeout: float):
+        self.api = api
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'vu{user_id}'}
+        self.chat = api.chats[user_id]
+        self.stats = stats
+        self.think = think
+        self.step_timeout = step_timeout
+
+    async def _wait_for(self, step: str, started: float, predicate) -> dict:
+        deadline = started + self.step_timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats.failures[step] += 1
+                raise StepFailed(step)
+            try:
+                message = await asyncio.wait_for(self.chat.inbox.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                continue
+            if predicate(message):
+                self.stats.samples[step].append(time.monotonic() - started)
+                return message
+
+    async def _act(self, step: str, update: dict, predicate) -> dict:
+        if self.think:
+            await asyncio.sleep(self.think * (0.5 + random.random()))
+        while not self.chat.inbox.empty():  # drop output of earlier steps
+            self.chat.inbox.get_nowait()
+        started = time.monotonic()
+        self.stats.updates_sent += 1
+        await self.api.push_update(update)
+        return await self._wait_for(step, started, predicate)
+
+    async def command(self, step: str, text: str, predicate) -> dict:
+        command = text.split()[0]
+        return await self._act(step, {'message': {
+            'message_id': 0, 'date': int(time.time()), 'chat': {'id': self.user['id'], 'type': 'private'},
+            'from': self.user, 'text': text, 'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        }}, predicate)
+
+    async def tap(self, step: str, message: dict, data: str, predicate) -> dict:
+        return await self._act(step, {'callback_query': {
+            'id': self.api.next_callback_id(), 'from': self.user, 'chat_instance': str(self.user['id']),
+            'message': message, 'data': data,
+        }}, predicate)
+
+    async def play(self) -> None:
+        """/quiz -> Quick mode -> random quiz -> answer all but the last -> submit -> review a few."""
+        try:
+            menu = await self.command('quiz_command', '/quiz', lambda m: 'Select Quiz Mode' in m['text'])
+            mode = next(data for text, data in buttons(menu) if 'Quick' in text)
+            quizzes = await self.tap('mode_select', menu, mode, lambda m: 'Select Quiz for' in m['text'])
+            # The quiz list is a folder browser: walk down random folders until we pick a quiz
+            while True:
+                entries = [(text, data) for text, data in buttons(quizzes)
+                           if not text.startswith(BROWSER_CONTROLS) and 'Back to Modes' not in text]
+                text, choice = random.choice(entries)
+                if not text.startswith('📁'):
+                    break
+                current = quizzes['text']
+                quizzes = await self.tap('browse', quizzes, choice,
+                                         lambda m: 'Select Quiz for' in m['text'] and m['text'] != current)
+            screen = await self.tap('quiz_start', quizzes, choice,
+                                    lambda m: 'Question 1/' in m['text'] or 'Could not load' in m['text'])
+            if 'Could not load' in screen['text']:
+                self.stats.failures['quiz_start'] += 1
+                raise StepFailed('quiz_start')
+
+            while True:
+                labels = dict(buttons(screen))
+                submit = next(data for text, data in labels.items() if 'SUBMIT' in text)
+                following = next((data for text, data in labels.items() if text.startswith('Next')), None)
+                if following is None:  # last question
+                    result = await self.tap('submit', screen, submit, lambda m: 'Review Answers' in str(m.get('reply_markup')))
+                    break
+                options = [data for text, data in labels.items() if text[:2] in ('A.', 'B.', 'C.', 'D.')]
+                current = question_no(screen)
+                if '[MSQ]' in screen['text']:
+                    # Toggles stay on the question; move on explicitly
+                    screen = await self.tap('answer', screen, random.choice(options), lambda m: question_no(m) == current)
+                    screen = await self.tap('next', screen, following, lambda m: question_no(m) != current)
+                else:
+                    screen = await self.tap('answer', screen, random.choice(options), lambda m: question_no(m) != current)
+
+            review = next(data for text, data in buttons(result) if 'Review' in text)
+            page = await self.tap('review', result, review, lambda m: 'Review - Question 1/' in m['text'])
+            for _ in range(2):
+                following = next((data for text, data in buttons(page) if text.startswith('Next')), None)
+                if following is None:
+                    break
+                current = page['text']
+                page = await self.tap('review', page, following, lambda m: m['text'] != current)
+            self.stats.flows_done += 1
+        except (StepFailed, StopIteration, IndexError):
+            self.stats.flows_failed += 1
+
+# --- Bot process ---
+
+def rss_bytes(pid: int):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+async def start_bot(args, api_port: int, workdir: str):
+    env = dict(os.environ)
+    env.update({
+        'BOT_TOKEN': FAKE_TOKEN,
+        'BOT_API_URL': f'http://127.0.0.1:{api_port}/bot',
+        'BOT_DB_PATH': os.path.join(workdir, 'bot.db'),
+        'METRICS_ENABLED': '0',
+        # The fake API stands in for Telegram's flood control (see --rate-429)
+        'GLOBAL_SEND_RATE': str(args.global_send_rate),
+    })
+    env.pop('RENDER_EXTERNAL_URL', None)
+    env.pop('WEBHOOK_URL', None)
+    env.pop('PORT', None)
+    if args.bot_mode == 'webhook':
+        env.update({
+            'BOT_MODE': 'webhook',
+            'WEBHOOK_URL': f'http://127.0.0.1:{args.bot_port}',
+            'PORT': str(args.bot_port),
+            'WEBHOOK_SECRET': secrets.token_hex(16),
+        })
+    else:
+        env['BOT_MODE'] = 'polling'
+    log = open(args.bot_log, 'ab')
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(BOT_DIR, 'bot.py'), cwd=BOT_DIR, env=env, stdout=log, stderr=log)
+    log.close()
+    return process
+
+async def stop_bot(process) -> None:
+    if process.returncode is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(process.wait(), timeout=20)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+async def run_level(args, api: FakeBotAPI, api_port: int, users: int, first_user_id: int) -> dict:
+    api.reset()
+    with tempfile.TemporaryDirectory(prefix='quizbot-load-') as workdir:
+        process = await start_bot(args, api_port, workdir)
+        try:
+            await asyncio.wait_for(api.polled.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            await stop_bot(process)
+            raise SystemExit(f"❌ bot.py did not come up (see {args.bot_log})")
+        await asyncio.sleep(0.5)
+        rss_start = rss_bytes(process.pid)
+
+        stats = StepStats()
+        peak = [rss_start or 0]
+
+        async def sample_memory():
+            while True:
+                await asyncio.sleep(0.5)
+                rss = rss_bytes(process.pid)
+                if rss:
+                    peak[0] = max(peak[0], rss)
+
+        async def launch(index: int):
+            await asyncio.sleep(args.ramp * index / users)
+            await VirtualUser(api, first_user_id + index, stats, args.think, args.step_timeout).play()
+
+        logger.info(f"🚀 {users} virtual users ({args.bot_mode}), ramping over {args.ramp:g}s")
+        sampler = asyncio.create_task(sample_memory())
+        started = time.monotonic()
+        await asyncio.gather(*(launch(i) for i in range(users)))
+        elapsed = time.monotonic() - started
+        sampler.cancel()
+        rss_end = rss_bytes(process.pid)
+        await stop_bot(process)
+        api.release_pollers()
+
+    steps = {}
+    for step, values in stats.samples.items():
+        values.sort()
+        steps[step] = {
+            'count': len(values),
+            'failed': stats.failures.get(step, 0),
+            'p50_ms': round(percentile(values, 50) * 1000, 1),
+            'p95_ms': round(percentile(values, 95) * 1000, 1),
+            'p99_ms': round(percentile(values, 99) * 1000, 1),
+        }
+    for step, failed in stats.failures.items():
+        steps.setdefault(step, {'count': 0, 'failed': failed, 'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0})
+    return {
+        'users': users,
+        'bot_mode': args.bot_mode,
+        'seconds': round(elapsed, 2),
+        'flows_done': stats.flows_done,
+        'flows_failed': stats.flows_failed,
+        'updates_per_s': round(stats.updates_sent / elapsed, 1),
+        'flows_per_s': round(stats.flows_done / elapsed, 2),
+        'api_calls': dict(api.calls),
+        'injected_429': api.injected_429,
+        'rss_start_mb': round(rss_start / 2**20, 1) if rss_start else None,
+        'rss_peak_mb': round(peak[0] / 2**20, 1) if peak[0] else None,
+        'rss_end_mb': round(rss_end / 2**20, 1) if rss_end else None,
+        'steps': steps,
+    }
+
+def print_report(result: dict) -> None:
+    print(f"\n📊 {result['users']} users ({result['bot_mode']}) in {result['seconds']}s: "
+          f"{result['flows_done']} flows done, {result['flows_failed']} failed, "
+          f"{result['updates_per_s']} updates/s, {result['flows_per_s']} flows/s")
+    print(f"   bot RSS: start {result['rss_start_mb']} MB, peak {result['rss_peak_mb']} MB, end {result['rss_end_mb']} MB; "
+          f"429s injected: {result['injected_429']}")
+    print(f"   {'step':<14}{'count':>8}{'failed':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    order = ['quiz_command', 'mode_select', 'browse', 'quiz_start', 'answer', 'next', 'submit', 'review']
+    for step in sorted(result['steps'], key=lambda s: order.index(s) if s in order else len(order)):
+        row = result['steps'][step]
+        print(f"   {step:<14}{row['count']:>8}{row['failed']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+async def main_async(args) -> None:
+    api = FakeBotAPI(args.api_latency_ms / 1000, args.api_jitter_ms / 1000, args.rate_429, args.retry_after)
+    sockets = tornado.netutil.bind_sockets(args.api_port, '127.0.0.1')
+    api_port = sockets[0].getsockname()[1]
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([(r'/bot([^/]+)/(\w+)', BotAPIHandler, {'api': api})]))
+    server.add_sockets(sockets)
+    logger.info(f"🤖 Fake Bot API on 127.0.0.1:{api_port}")
+
+    results = []
+    for level, users in enumerate(args.users):
+        result = await run_level(args, api, api_port, users, first_user_id=1_000_000 * (level + 1))
+        print_report(result)
+        results.append(result)
+    server.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"💾 Results written to {args.json}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test bot.py against a local fake Telegram Bot API.")
+    parser.add_argument('--users', type=lambda s: [int(n) for n in s.split(',')], default=[100, 1000, 10000],
+                        help="comma-separated virtual user counts, one run each (default: 100,1000,10000)")
+    parser.add_argument('--bot-mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--bot-port', type=int, default=18080, help="bot's webhook port (webhook mode)")
+    parser.add_argument('--api-port', type=int, default=0, help="fake Bot API port (default: any free port)")
+    parser.add_argument('--api-latency-ms', type=float, default=40, help="added to every Bot API call")
+    parser.add_argument('--api-jitter-ms', type=float, default=20, help="random extra latency, 0..N ms")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="share of chat calls answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after in injected 429s (seconds)")
+    parser.add_argument('--global-send-rate', type=float, default=100000,
+                        help="bot's GLOBAL_SEND_RATE for the run (default: effectively unlimited)")
+    parser.add_argument('--think', type=float, default=1.0, help="mean seconds a user waits between taps")
+    parser.add_argument('--ramp', type=float, default=10.0, help="seconds over which users start")
+    parser.add_argument('--step-timeout', type=float, default=60.0)
+    parser.add_argument('--bot-log', default=os.devnull, help="where bot.py's output goes")
+    parser.add_argument('--json', help="also write the results to this file")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""AliasTable construction and draws, and the MasteryRecord arrays it is built from."""
+import random
+from collections import Counter
+
+import pytest
+
+import bot
+
+
+@pytest.fixture(autouse=True)
+def seeded():
+    random.seed(20240601)
+
+
+def draw_counts(table, n):
+    return Counter(table.draw() for _ in range(n))
+
+
+def test_table_is_well_formed():
+    weights = [random.random() * 10 for _ in range(1000)]
+    table = bot.AliasTable(weights)
+    assert table.count == len(table.prob) == len(table.alias) == 1000
+    assert all(0.0 <= p <= 1.0 + 1e-6 for p in table.prob)
+    assert all(0 <= a < 1000 for a in table.alias)
+
+
+def test_single_entry_always_drawn():
+    table = bot.AliasTable([3.5])
+    assert set(draw_counts(table, 100)) == {0}
+
+
+def test_zero_weights_are_never_drawn():
+    table = bot.AliasTable([0.0, 1.0, 0.0, 1.0])
+    assert set(draw_counts(table, 5000)) <= {1, 3}
+
+
+def test_draws_follow_the_weights():
+    weights = [1.0, 2.0, 3.0, 4.0]
+    n = 100000
+    counts = draw_counts(bot.AliasTable(weights), n)
+    for i, w in enumerate(weights):
+        assert counts[i] / n == pytest.approx(w / sum(weights), abs=0.01)
+
+
+def test_uniform_weights():
+    n = 60000
+    counts = draw_counts(bot.AliasTable([1.0] * 6), n)
+    assert all(counts[i] / n == pytest.approx(1 / 6, abs=0.01) for i in range(6))
+
+
+def test_mastery_record_round_trip_and_fit():
+    record = bot.MasteryRecord()
+    record.fit(5)
+    record.boxes[2] = 3
+    record.seen[2] = 19000
+    copy = bot.MasteryRecord(bytes(record.boxes), record.seen.tobytes())
+    assert list(copy.boxes) == [0, 0, 3, 0, 0] and copy.seen[2] == 19000
+    copy.fit(3)
+    assert len(copy.boxes) == len(copy.seen) == 3
+    copy.fit(0)
+    assert copy.nbytes() == bot.MasteryRecord().nbytes()
+
+
+def test_mastery_weights_feed_a_valid_table():
+    record = bot.MasteryRecord(bytes([0, 1, 2, bot.MASTERY_MAX_BOX]), bytes(8))
+    weights = record.weights(bot.mastery_today())
+    assert weights[0] == bot.MASTERY_WEIGHT_NEW and weights[1] == bot.MASTERY_WEIGHT_WEAK
+    assert all(bot.MASTERY_WEIGHT_MIN <= w <= bot.MASTERY_WEIGHT_MAX for w in weights[2:])
+    table = bot.AliasTable(weights)
+    assert set(draw_counts(table, 2000)) <= set(range(4))
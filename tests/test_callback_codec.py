@@ -0,0 +1,80 @@
+"""Round-trips and edge cases of the binary callback_data codec."""
+import pytest
+
+import bot
+
+TELEGRAM_LIMIT = 64  # bytes of callback_data
+
+
+@pytest.mark.parametrize('args', [
+    (),
+    (0,),
+    (127,),
+    (128,),
+    (16383, 16384),
+    (2 ** 31 - 1, 2 ** 32, 2 ** 63 - 1),
+])
+def test_round_trip(args):
+    data = bot.encode_callback(bot.OP_QUIZ_START, *args)
+    assert bot.decode_callback(data) == (bot.OP_QUIZ_START, args)
+
+
+def test_payload_at_the_64_byte_limit():
+    # 48 raw bytes encode to exactly 64 base64 characters: version + op + 46 one-byte varints
+    args = tuple(range(46))
+    data = bot.encode_callback(bot.OP_REVIEW, *args)
+    assert len(data.encode('ascii')) == TELEGRAM_LIMIT
+    assert bot.decode_callback(data) == (bot.OP_REVIEW, args)
+
+
+def test_payload_one_byte_short_of_the_limit_needs_no_padding():
+    args = tuple(range(45))
+    data = bot.encode_callback(bot.OP_REVIEW, *args)
+    assert '=' not in data and len(data) == 63
+    assert bot.decode_callback(data) == (bot.OP_REVIEW, args)
+
+
+def test_real_buttons_fit_with_large_values():
+    mode = bot.MODE_KEYS[-1]
+    payloads = [
+        bot.review_data(f"{2 ** 52}_{2 ** 40}", 9999),
+        bot.quiz_start_data('GATE PYQS/some quiz with a very long file name indeed', mode),
+        bot.browse_data('a/deeply/nested/folder', 10 ** 6, mode),
+        bot.search_hit_data('GATE PYQS/computer_networks', 2 ** 31),
+    ]
+    for data in payloads:
+        assert len(data.encode('utf-8')) <= TELEGRAM_LIMIT
+        assert bot.decode_callback(data) is not None
+
+
+def test_review_key_round_trip():
+    data = bot.review_data('123456789_1700000000', 7)
+    assert bot.decode_callback(data) == (bot.OP_REVIEW, (123456789, 1700000000, 7))
+
+
+@pytest.mark.parametrize('legacy', [
+    'answer_clear', 'back_to_modes', 'post_quiz_action_new', 'quiz_nav_next', 'quiz_nav_prev',
+    'quiz_submit_final', 'topic_select_random', 'topics_redirect', 'answer_submit_2',
+    'mode_select_quick_5', 'quiz_start_algorithms_dpp_01_discussion',
+    'quiz_start_GATE PYQS/cn_gate_2025_full_20', 'review_q_123456789_1700000000_3',
+    'review_start_123456789_1700000000', 'topic_select_computer_networks',
+])
+def test_legacy_string_callbacks_decode_to_none(legacy):
+    assert bot.decode_callback(legacy) is None
+
+
+@pytest.mark.parametrize('data', ['', 'A', 'AQ', '!!!!', 'AQ=='])
+def test_malformed_or_too_short(data):
+    assert bot.decode_callback(data) is None
+
+
+def test_other_version_is_rejected():
+    raw = bytes((bot.CALLBACK_VERSION + 1, bot.OP_MODE_MENU))
+    data = bot.base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+    assert bot.decode_callback(data) is None
+
+
+def test_truncated_varint_is_rejected():
+    raw = bytes((bot.CALLBACK_VERSION, bot.OP_QUIZ, 0x80))  # continuation bit with nothing after it
+    data = bot.base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+    assert bot.decode_callback(data) is None
@@ -0,0 +1,107 @@
+"""Round-trips of the compiled .qbank format (compile_bank -> QuestionBank)."""
+import json
+import os
+
+import pytest
+
+import bot
+
+
+def compile_and_open(tmp_path, questions, quiz_id='quiz'):
+    source = tmp_path / f'{quiz_id}.json'
+    source.write_text(json.dumps(questions, ensure_ascii=False), encoding='utf-8')
+    bank_path = str(tmp_path / f'{quiz_id}.qbank')
+    count = bot.compile_bank(str(source), bank_path)
+    bank = bot.QuestionBank(quiz_id, bank_path)
+    bank.base = 0
+    return source, count, bank
+
+
+def test_round_trip_keeps_every_field(tmp_path):
+    questions = [
+        {"q": "Which layer routes packets?", "options": ["A) Link", "B) Network", "C) Transport"], "answer": 1},
+        {"q": "[MSQ] Pick the primes", "options": ["2", "4", "5", "9"], "answer": [0, 2],
+         "explanation": "2 and 5", "topic": "maths", "difficulty": "easy"},
+        {"q": "🧮 Σ of 1..3 — ünïcode", "options": ["6", "7"], "answer": 0, "img_url": "https://example.org/x.png"},
+    ]
+    source, count, bank = compile_and_open(tmp_path, questions)
+    try:
+        assert count == len(bank) == 3
+        for i, raw in enumerate(questions):
+            expected = bot.normalize_question(raw, 'quiz')
+            question = bank[i]
+            assert question.qid == i
+            assert question.to_record() == expected.to_record()
+        assert bank[0].options == ('Link', 'Network', 'Transport')
+        assert bank[1].correct_options == [0, 2] and bank[1].is_msq
+        assert bank[2].needs_calculator
+    finally:
+        bank.close()
+
+
+def test_header_records_source_stats(tmp_path):
+    source, _, bank = compile_and_open(tmp_path, [{"q": "x", "options": ["a", "b"], "answer": 0}])
+    try:
+        st = os.stat(source)
+        assert bank.matches(st.st_size, st.st_mtime_ns)
+        assert not bank.matches(st.st_size + 1, st.st_mtime_ns)
+        assert not bank.matches(st.st_size, st.st_mtime_ns + 1)
+    finally:
+        bank.close()
+
+
+def test_unplayable_questions_are_skipped(tmp_path):
+    questions = [
+        {"q": "no options", "options": [], "answer": 0},
+        {"q": "answer out of range", "options": ["a"], "answer": 3},
+        "not a dict",
+        {"q": "fine", "options": ["a", "b"], "answer": 1},
+    ]
+    _, count, bank = compile_and_open(tmp_path, questions)
+    try:
+        assert count == len(bank) == 1
+        assert bank[0].text == "fine"
+    finally:
+        bank.close()
+
+
+def test_empty_bank(tmp_path):
+    _, count, bank = compile_and_open(tmp_path, [])
+    try:
+        assert count == len(bank) == 0
+        with pytest.raises(IndexError):
+            bank.record_bytes(0)
+    finally:
+        bank.close()
+
+
+def test_record_index_is_bounds_checked(tmp_path):
+    _, _, bank = compile_and_open(tmp_path, [{"q": "x", "options": ["a", "b"], "answer": 0}])
+    try:
+        with pytest.raises(IndexError):
+            bank.record_bytes(1)
+        with pytest.raises(IndexError):
+            bank.record_bytes(-1)
+    finally:
+        bank.close()
+
+
+def test_source_must_be_a_list(tmp_path):
+    source = tmp_path / 'bad.json'
+    source.write_text('{"q": "x"}', encoding='utf-8')
+    with pytest.raises(ValueError):
+        bot.compile_bank(str(source), str(tmp_path / 'bad.qbank'))
+
+
+def test_foreign_file_is_rejected(tmp_path):
+    path = tmp_path / 'foreign.qbank'
+    path.write_bytes(b'NOPE' + bytes(bot.BANK_HEADER.size))
+    with pytest.raises(ValueError):
+        bot.QuestionBank('foreign', str(path))
+
+
+def test_older_version_is_rejected(tmp_path):
+    path = tmp_path / 'old.qbank'
+    path.write_bytes(bot.BANK_HEADER.pack(bot.BANK_MAGIC, bot.BANK_VERSION - 1, 0, 0, 0, 0) + bytes(4))
+    with pytest.raises(ValueError):
+        bot.QuestionBank('old', str(path))
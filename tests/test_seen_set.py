@@ -0,0 +1,91 @@
+"""Round-trips of the roaring-style SeenSet encoding."""
+import random
+
+import bot
+
+
+def round_trip(seen):
+    decoded = bot.SeenSet.from_bytes(seen.to_bytes())
+    assert len(decoded) == len(seen)
+    assert decoded.to_bytes() == seen.to_bytes()
+    return decoded
+
+
+def make(indices):
+    seen = bot.SeenSet()
+    for index in indices:
+        seen.add(index)
+    return seen
+
+
+def test_empty_set():
+    seen = bot.SeenSet()
+    assert seen.to_bytes() == b''
+    decoded = round_trip(seen)
+    assert len(decoded) == 0 and 0 not in decoded
+
+
+def test_cleared_set_encodes_empty():
+    seen = make(range(10))
+    seen.clear()
+    assert seen.to_bytes() == b'' and len(seen) == 0
+
+
+def test_array_chunk():
+    indices = [0, 1, 7, 4095, 65535]
+    decoded = round_trip(make(indices))
+    assert all(i in decoded for i in indices)
+    assert 2 not in decoded and 65536 not in decoded
+
+
+def test_duplicates_count_once():
+    seen = make([5, 5, 5])
+    assert len(seen) == 1
+
+
+def test_largest_array_chunk_stays_an_array():
+    seen = make(range(0, 2 * bot.ROARING_ARRAY_MAX, 2))
+    data = seen.to_bytes()
+    assert len(data) == bot.ROARING_CHUNK.size + 2 * bot.ROARING_ARRAY_MAX
+    decoded = round_trip(seen)
+    assert 0 in decoded and 1 not in decoded and 2 * bot.ROARING_ARRAY_MAX - 2 in decoded
+
+
+def test_one_past_the_array_limit_becomes_a_bitmap():
+    seen = make(range(bot.ROARING_ARRAY_MAX + 1))
+    assert len(seen.to_bytes()) == bot.ROARING_CHUNK.size + bot.ROARING_BITMAP_BYTES
+    decoded = round_trip(seen)
+    assert bot.ROARING_ARRAY_MAX in decoded and bot.ROARING_ARRAY_MAX + 1 not in decoded
+
+
+def test_full_chunk():
+    seen = make(range(65536))
+    assert len(seen) == 65536
+    decoded = round_trip(seen)
+    assert all(i in decoded for i in (0, 32767, 65535))
+    assert 65536 not in decoded
+
+
+def test_several_chunks_and_sparse_high_indices():
+    indices = [3, 65536, 65537, 5 * 65536 + 9, 2 ** 31]
+    decoded = round_trip(make(indices))
+    assert all(i in decoded for i in indices)
+    assert 4 * 65536 not in decoded
+
+
+def test_random_sets_match_python_sets():
+    rng = random.Random(1234)
+    for size in (1, 100, 5000, 20000):
+        indices = {rng.randrange(200000) for _ in range(size)}
+        decoded = round_trip(make(indices))
+        assert len(decoded) == len(indices)
+        assert all(i in decoded for i in indices)
+        assert sum(1 for i in range(200000) if i in decoded) == len(indices)
+
+
+def test_adding_after_decode():
+    decoded = round_trip(make(range(bot.ROARING_ARRAY_MAX + 10)))
+    decoded.add(70000)
+    decoded.add(5)  # already there
+    assert len(decoded) == bot.ROARING_ARRAY_MAX + 11
+    assert 70000 in round_trip(decoded)